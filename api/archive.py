@@ -0,0 +1,270 @@
+# api/archive.py
+
+"""
+Архивация старых транзакций в сжатые Parquet-файлы (холодное хранилище).
+
+События старше ARCHIVE_AFTER_DAYS переносятся из таблицы transactions в файлы
+ARCHIVE_DIR/wallet_<id>/<YYYY-MM>.parquet (по кошельку и месяцу), после чего удаляются
+связи кошелька с ними (wallet_events); само событие с переводами удаляется из общего хранилища,
+когда на него не ссылается ни один кошелёк. Агрегаты (counterparty_stats, роллапы
+объёмов) остаются в БД, а экспорт истории читает архив и горячую таблицу вместе.
+
+Перенос идемпотентен: файл месяца дописывается с дедупликацией по event_id и
+атомарно заменяется, строки из БД удаляются только после записи файла.
+Требует pyarrow (pip install pyarrow); без него задача пропускается.
+"""
+
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, exists, select
+
+from db.db_init import PROJECT_ROOT, async_session, write_session
+from db.models import Transaction, Transfer, WalletEvent
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Архивация опциональна
+    pa = pq = None
+
+load_dotenv()
+
+logger = logging.getLogger("api.archive")
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(PROJECT_ROOT / "data" / "archive")))
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))  # 0 — архивация выключена
+ARCHIVE_DAY_OF_WEEK = os.getenv("ARCHIVE_DAY_OF_WEEK", "sun")
+ARCHIVE_HOUR = int(os.getenv("ARCHIVE_HOUR", "3"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))  # Строк за одну пишущую транзакцию
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+
+ARCHIVE_COLUMNS = ("event_id", "lt", "timestamp", "is_scam_event", "actions_json")
+
+
+def archive_available() -> bool:
+    return pq is not None
+
+
+def _schema():
+    return pa.schema(
+        [
+            ("event_id", pa.string()),
+            ("lt", pa.int64()),
+            ("timestamp", pa.int64()),
+            ("is_scam_event", pa.bool_()),
+            ("actions_json", pa.binary()),  # Закодированные actions (core.codec)
+        ]
+    )
+
+
+def _month_key(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m")
+
+
+def _wallet_dir(wallet_id: int) -> Path:
+    return ARCHIVE_DIR / f"wallet_{wallet_id}"
+
+
+def _merge_into_month_file(path: Path, rows: list[dict]) -> int:
+    """
+    Дописывает строки в файл месяца: читает существующий файл, отбрасывает дубликаты
+    по event_id, пишет во временный файл и атомарно заменяет. Возвращает число строк в файле.
+    """
+    merged = {}
+    if path.exists():
+        for row in pq.read_table(path).to_pylist():
+            if isinstance(row["actions_json"], str):  # Файлы, записанные до перехода на бинарные actions
+                row["actions_json"] = row["actions_json"].encode("utf-8")
+            merged[row["event_id"]] = row
+    for row in rows:
+        merged[row["event_id"]] = {column: row[column] for column in ARCHIVE_COLUMNS}
+
+    ordered = sorted(merged.values(), key=lambda row: (row["timestamp"], row["lt"]))
+    table = pa.Table.from_pylist(ordered, schema=_schema())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".parquet.tmp")
+    pq.write_table(table, tmp_path, compression=ARCHIVE_COMPRESSION)
+    os.replace(tmp_path, path)
+    return len(ordered)
+
+
+def write_archive_rows(wallet_id: int, rows: list[dict]) -> None:
+    """Раскладывает строки transactions кошелька по файлам месяцев (синхронно, вызывать в потоке)."""
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[_month_key(row["timestamp"])].append(row)
+    for month, month_rows in by_month.items():
+        _merge_into_month_file(_wallet_dir(wallet_id) / f"{month}.parquet", month_rows)
+
+
+def _archive_month_paths(wallet_id: int, from_ts: Optional[int], to_ts: Optional[int]) -> list[Path]:
+    """Файлы месяцев кошелька, пересекающиеся с периодом, от новых к старым."""
+    wallet_dir = _wallet_dir(wallet_id)
+    if not wallet_dir.exists():
+        return []
+    first_month = _month_key(from_ts) if from_ts is not None else None
+    last_month = _month_key(to_ts) if to_ts is not None else None
+    return [
+        path
+        for path in sorted(wallet_dir.glob("*.parquet"), reverse=True)
+        if not ((first_month and path.stem < first_month) or (last_month and path.stem > last_month))
+    ]
+
+
+def _read_month_desc(path: Path, from_ts: Optional[int], to_ts: Optional[int]) -> list[dict]:
+    filters = []
+    if from_ts is not None:
+        filters.append(("timestamp", ">=", from_ts))
+    if to_ts is not None:
+        filters.append(("timestamp", "<=", to_ts))
+    rows = pq.read_table(path, filters=filters or None).to_pylist()
+    rows.sort(key=lambda row: row["lt"], reverse=True)
+    return rows
+
+
+def _read_archive_sync(wallet_id: int, from_ts: Optional[int], to_ts: Optional[int]) -> list[dict]:
+    rows = []
+    for path in _archive_month_paths(wallet_id, from_ts, to_ts):  # Файлы целиком вне периода не читаются
+        rows.extend(_read_month_desc(path, from_ts, to_ts))
+    return rows
+
+
+async def read_archived_transactions(
+    wallet_id: int, from_ts: Optional[int] = None, to_ts: Optional[int] = None
+) -> list[dict]:
+    """
+    Архивные транзакции кошелька за период (словари с полями ARCHIVE_COLUMNS).
+    Без pyarrow или архива возвращает пустой список.
+    """
+    if not archive_available():
+        return []
+    return await asyncio.to_thread(_read_archive_sync, wallet_id, from_ts, to_ts)
+
+
+async def iter_archived_transactions(
+    wallet_id: int, from_ts: Optional[int] = None, to_ts: Optional[int] = None
+) -> AsyncIterator[dict]:
+    """
+    Архивные события кошелька за период от новых к старым (по lt), по одному файлу месяца
+    в памяти — для потокового экспорта. Без pyarrow или архива ничего не возвращает.
+    """
+    if not archive_available():
+        return
+    for path in await asyncio.to_thread(_archive_month_paths, wallet_id, from_ts, to_ts):
+        for row in await asyncio.to_thread(_read_month_desc, path, from_ts, to_ts):
+            yield row
+
+
+def _read_archive_page_sync(
+    wallet_id: int, before_lt: Optional[int], before_ts: Optional[int], limit: int
+) -> list[dict]:
+    filters = [("lt", "<", before_lt)] if before_lt is not None else None
+
+    rows = []
+    # От новых месяцев к старым: lt растёт со временем, поэтому после `limit` строк более старые файлы не нужны
+    for path in _archive_month_paths(wallet_id, None, before_ts):
+        rows.extend(pq.read_table(path, filters=filters).to_pylist())
+        if len(rows) >= limit:
+            break
+    rows.sort(key=lambda row: row["lt"], reverse=True)
+    return rows[:limit]
+
+
+async def read_archived_page(
+    wallet_id: int, before_lt: Optional[int] = None, before_ts: Optional[int] = None, limit: int = 50
+) -> list[dict]:
+    """
+    Страница архивных событий кошелька для keyset-пагинации: до `limit` событий с lt < before_lt
+    (от новых к старым). `before_ts` — время события курсора: более новые файлы месяцев не читаются.
+    """
+    if not archive_available():
+        return []
+    return await asyncio.to_thread(_read_archive_page_sync, wallet_id, before_lt, before_ts, limit)
+
+
+def merge_with_archive(hot_rows: list[dict], archived_rows: list[dict]) -> list[dict]:
+    """
+    Объединяет строки горячей таблицы и архива (от новых к старым).
+    Событие, присутствующее в обоих источниках (сбой между записью файла и удалением), берётся из БД.
+    """
+    hot_ids = {row["event_id"] for row in hot_rows}
+    merged = list(hot_rows) + [row for row in archived_rows if row["event_id"] not in hot_ids]
+    merged.sort(key=lambda row: (row["timestamp"], row["lt"]), reverse=True)
+    return merged
+
+
+async def archive_wallet(wallet_id: int, cutoff_ts: int) -> int:
+    """Переносит в архив транзакции кошелька старше cutoff_ts; возвращает число перенесённых."""
+    archived = 0
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(
+                    Transaction.id,
+                    Transaction.event_id,
+                    WalletEvent.lt,  # lt события в ленте этого кошелька
+                    WalletEvent.timestamp,
+                    Transaction.is_scam_event,
+                    Transaction.actions_json,
+                )
+                .join(WalletEvent, WalletEvent.transaction_id == Transaction.id)
+                .where(WalletEvent.wallet_id == wallet_id, WalletEvent.timestamp < cutoff_ts)
+                .order_by(WalletEvent.timestamp)
+                .limit(ARCHIVE_BATCH_SIZE)
+            )
+            rows = [dict(row._mapping) for row in result]
+        if not rows:
+            return archived
+
+        # Сначала файл, потом удаление: при сбое между ними повторный перенос просто дедуплицируется
+        await asyncio.to_thread(write_archive_rows, wallet_id, rows)
+        ids = [row["id"] for row in rows]
+        async with write_session() as session:
+            await session.execute(
+                delete(WalletEvent).where(WalletEvent.wallet_id == wallet_id, WalletEvent.transaction_id.in_(ids))
+            )
+            # Событие, связанное с другими кошельками, остаётся в хранилище до архивации последнего из них
+            orphans = (
+                await session.scalars(
+                    select(Transaction.id).where(
+                        Transaction.id.in_(ids), ~exists().where(WalletEvent.transaction_id == Transaction.id)
+                    )
+                )
+            ).all()
+            if orphans:
+                await session.execute(delete(Transfer).where(Transfer.transaction_id.in_(orphans)))
+                await session.execute(delete(Transaction).where(Transaction.id.in_(orphans)))
+        archived += len(rows)
+
+
+async def scheduled_archive():
+    """
+    Задача планировщика: переносит события старше ARCHIVE_AFTER_DAYS в архив.
+    Освобождённые страницы SQLite переиспользуются новыми данными, поэтому файл БД
+    перестаёт расти и без VACUUM.
+    """
+    if not archive_available():
+        logger.warning("Архивация транзакций пропущена: пакет 'pyarrow' не установлен.")
+        return
+
+    cutoff_ts = int(datetime.now(timezone.utc).timestamp()) - ARCHIVE_AFTER_DAYS * 86400
+    async with async_session() as session:
+        wallet_ids = (
+            await session.scalars(select(WalletEvent.wallet_id).where(WalletEvent.timestamp < cutoff_ts).distinct())
+        ).all()
+
+    total = 0
+    for wallet_id in wallet_ids:
+        try:
+            total += await archive_wallet(wallet_id, cutoff_ts)
+        except Exception as e:
+            logger.error(f"Ошибка архивации транзакций кошелька ID {wallet_id}: {e}", exc_info=True)
+    if total:
+        logger.info(f"В архив {ARCHIVE_DIR} перенесено {total} транзакций старше {ARCHIVE_AFTER_DAYS} дней")
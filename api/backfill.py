@@ -0,0 +1,181 @@
+# api/backfill.py
+
+"""
+Догрузка полной истории событий кошелька из TonAPI.
+
+Плановое обновление (api.scheduler) синхронизирует только новые события,
+а здесь история листается назад страницами через before_lt. После каждой страницы
+контрольная точка пишется в backfill_jobs, поэтому после рестарта работа продолжается
+с того же места. Запросы к TonAPI идут с низким приоритетом и не мешают live-обновлению.
+"""
+
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Optional
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+
+from core.tonapi import TONAPI_KEY, get_tonapi_client
+from db.db_init import async_session, write_lock, write_session
+from db.ingest import create_backfill_jobs, store_events
+from db.models import BackfillJob, Wallet
+
+load_dotenv()
+
+logger = logging.getLogger("api.backfill")
+
+BACKFILL_PAGE_LIMIT = int(os.getenv("BACKFILL_PAGE_LIMIT", "100"))  # Макс. размер страницы TonAPI
+BACKFILL_PAGES_PER_RUN = int(os.getenv("BACKFILL_PAGES_PER_RUN", "20"))
+BACKFILL_WALLETS_PER_RUN = int(os.getenv("BACKFILL_WALLETS_PER_RUN", "5"))
+BACKFILL_INTERVAL_SECONDS = int(os.getenv("BACKFILL_INTERVAL_SECONDS", "60"))
+
+ACTIVE_STATUSES = ("pending", "running")
+
+
+def backfill_progress(job: BackfillJob) -> tuple[Optional[float], Optional[int]]:
+    """
+    Оценивает долю пройденной истории и ETA (в секундах) по логическому времени:
+    история покрыта от start_lt до before_lt из всего диапазона start_lt..target_lt.
+    """
+    if job.status == "done":
+        return 1.0, 0
+    if not (job.start_lt and job.target_lt and job.before_lt) or job.start_lt <= job.target_lt:
+        return None, None
+
+    progress = (job.start_lt - job.before_lt) / (job.start_lt - job.target_lt)
+    progress = min(max(progress, 0.0), 1.0)
+    if progress <= 0 or not (job.started_at and job.updated_at):
+        return progress, None
+    elapsed = (job.updated_at - job.started_at).total_seconds()
+    return progress, int(elapsed * (1 - progress) / progress)
+
+
+async def _fetch_oldest_lt(tonapi, address: str) -> Optional[tuple[int, int]]:
+    """lt и время самой первой транзакции аккаунта — нижняя граница догрузки."""
+    resp = await tonapi.get(
+        f"/blockchain/accounts/{address}/transactions",
+        params={"limit": 1, "sort_order": "asc"},
+        low_priority=True,
+    )
+    transactions = resp.json().get("transactions", [])
+    if not transactions:
+        return None
+    return int(transactions[0].get("lt", 0)), transactions[0].get("utime")
+
+
+async def backfill_wallet(
+    job_id: int, wallet_id: int, address: str, max_pages: int, should_stop: Callable[[], bool] = lambda: False
+) -> int:
+    """
+    Загружает до `max_pages` страниц истории для одного задания догрузки.
+    Возвращает количество обработанных страниц.
+    """
+    tonapi = get_tonapi_client()
+
+    async with async_session() as session:
+        async with session.begin():
+            job = await session.get(BackfillJob, job_id)
+
+        # Сетевые запросы делаем вне транзакций БД, чтобы не держать блокировку на время ответа TonAPI
+        if job.target_lt is None:
+            oldest = await _fetch_oldest_lt(tonapi, address)
+            async with write_lock(), session.begin():
+                if oldest is None:  # Аккаунт без транзакций — догружать нечего
+                    job.status = "done"
+                    job.finished_at = datetime.utcnow()
+                    return 0
+                job.target_lt, first_ts = oldest
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                job.updated_at = job.started_at
+                if first_ts:
+                    await session.execute(
+                        update(Wallet).where(Wallet.id == wallet_id).values(first_activity_ts=first_ts)
+                    )
+
+        pages = 0
+        while pages < max_pages and not should_stop():
+            params = {"limit": BACKFILL_PAGE_LIMIT}
+            if job.before_lt is not None:
+                params["before_lt"] = job.before_lt
+            resp = await tonapi.get(f"/accounts/{address}/events", params=params, low_priority=True)
+            events = resp.json().get("events", [])
+            pages += 1
+
+            async with write_lock(), session.begin():
+                stored = await store_events(session, wallet_id, events, address)
+                job.pages_done += 1
+                job.events_stored += stored
+                job.updated_at = datetime.utcnow()
+                job.last_error = None
+                if events:
+                    if job.start_lt is None:
+                        job.start_lt = max(int(event.get("lt", 0)) for event in events)
+                    job.before_lt = min(int(event.get("lt", 0)) for event in events)
+
+                # Короткая страница или дошли до первой транзакции аккаунта — история загружена целиком
+                if len(events) < BACKFILL_PAGE_LIMIT or (job.before_lt is not None and job.before_lt <= job.target_lt):
+                    job.status = "done"
+                    job.finished_at = job.updated_at
+                    logger.info(
+                        f"Догрузка истории {address} завершена: {job.pages_done} стр., {job.events_stored} событий"
+                    )
+                    break
+        return pages
+
+
+async def scheduled_backfill(should_stop: Callable[[], bool] = lambda: False):
+    """
+    Задача планировщика: ставит в очередь кошельки без задания догрузки и
+    продвигает несколько активных заданий на BACKFILL_PAGES_PER_RUN страниц.
+    `should_stop` позволяет прервать работу, если начался проход live-обновления.
+    """
+    if not TONAPI_KEY:
+        return
+
+    async with async_session() as session:
+        async with write_lock(), session.begin():
+            missing = await session.execute(
+                select(Wallet.id)
+                .outerjoin(BackfillJob, BackfillJob.wallet_id == Wallet.id)
+                .where(BackfillJob.id.is_(None))
+            )
+            queued = await create_backfill_jobs(session, [row[0] for row in missing.all()])
+            if queued:
+                logger.info(f"В очередь догрузки истории добавлено {queued} кошельков")
+
+        jobs = (
+            await session.execute(
+                select(BackfillJob.id, BackfillJob.wallet_id, Wallet.address)
+                .join(Wallet, Wallet.id == BackfillJob.wallet_id)
+                .where(BackfillJob.status.in_(ACTIVE_STATUSES))
+                .order_by(BackfillJob.updated_at.asc().nulls_first())  # По очереди, начиная с давно не двигавшихся
+                .limit(BACKFILL_WALLETS_PER_RUN)
+            )
+        ).all()
+
+    for job_id, wallet_id, address in jobs:
+        if should_stop():
+            logger.info("Догрузка истории приостановлена: идёт плановое обновление кошельков")
+            return
+        try:
+            await backfill_wallet(job_id, wallet_id, address, BACKFILL_PAGES_PER_RUN, should_stop)
+        except httpx.HTTPStatusError as e:
+            status = "failed" if e.response.status_code in (400, 404) else "running"
+            logger.error(f"Ошибка TonAPI при догрузке истории {address}: {e.response.status_code} - {e.response.text}")
+            await _mark_job_error(job_id, f"TonAPI {e.response.status_code}: {e.response.text[:500]}", status)
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка при догрузке истории {address}: {e}", exc_info=True)
+            await _mark_job_error(job_id, str(e)[:500], "running")
+
+
+async def _mark_job_error(job_id: int, error: str, status: str):
+    async with write_session() as session:
+        await session.execute(
+            update(BackfillJob)
+            .where(BackfillJob.id == job_id)
+            .values(last_error=error, status=status, updated_at=datetime.utcnow())
+        )
@@ -0,0 +1,111 @@
+# api/balances.py
+
+"""
+Обновление балансов и флага is_scam кошельков.
+
+Вместо одного GET /accounts/{address} на кошелёк адреса собираются в пачки
+и запрашиваются через POST /accounts/_bulk (до BALANCE_BULK_SIZE за раз),
+а результаты пишутся одним пакетным UPDATE на пачку.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, select, update
+
+from core.address import to_raw_address
+from core.tonapi import TONAPI_KEY, get_tonapi_client
+from db.db_init import async_session, write_session
+from db.models import Wallet
+
+load_dotenv()
+
+logger = logging.getLogger("api.balances")
+
+BALANCE_BULK_SIZE = int(os.getenv("BALANCE_BULK_SIZE", "100"))  # Лимит TonAPI на /accounts/_bulk
+BALANCE_REFRESH_MINUTES = int(os.getenv("BALANCE_REFRESH_MINUTES", "5"))
+BALANCE_STALE_MINUTES = int(os.getenv("BALANCE_STALE_MINUTES", "10"))
+
+_wallets = Wallet.__table__
+_update_balance_stmt = (
+    update(_wallets)
+    .where(_wallets.c.id == bindparam("wallet_id"))
+    .values(
+        last_balance_ton=bindparam("balance"),
+        is_scam=bindparam("scam"),
+        last_balance_updated_at=bindparam("updated_at"),
+    )
+)
+
+
+async def refresh_balances_chunk(wallets: list[tuple[int, str]]) -> int:
+    """
+    Запрашивает аккаунты пачки одним вызовом /accounts/_bulk и обновляет их балансы.
+    Возвращает количество обновлённых кошельков.
+    """
+    # TonAPI отвечает raw-адресами, поэтому сопоставляем кошельки по raw-форме
+    ids_by_raw = {}
+    for wallet_id, address in wallets:
+        raw = to_raw_address(address)
+        if raw is None:
+            logger.warning(f"Пропуск обновления баланса: некорректный адрес {address} (ID: {wallet_id})")
+            continue
+        ids_by_raw[raw] = wallet_id
+    if not ids_by_raw:
+        return 0
+
+    resp = await get_tonapi_client().post("/accounts/_bulk", json={"account_ids": list(ids_by_raw)})
+    accounts = resp.json().get("accounts", [])
+
+    now = datetime.utcnow()
+    rows = []
+    for account in accounts:
+        wallet_id = ids_by_raw.get(to_raw_address(account.get("address", "")))
+        if wallet_id is None:
+            continue
+        rows.append(
+            {
+                "wallet_id": wallet_id,
+                "balance": int(account.get("balance", 0) or 0),  # nanoTONs
+                "scam": bool(account.get("is_scam", False)),
+                "updated_at": now,
+            }
+        )
+    if not rows:
+        return 0
+
+    async with write_session() as session:
+        await session.execute(_update_balance_stmt, rows)
+    return len(rows)
+
+
+async def scheduled_balance_refresh():
+    """Задача планировщика: обновляет балансы кошельков, не обновлявшихся BALANCE_STALE_MINUTES минут."""
+    if not TONAPI_KEY:
+        return
+
+    stale_before = datetime.utcnow() - timedelta(minutes=BALANCE_STALE_MINUTES)
+    async with async_session() as session:
+        result = await session.execute(
+            select(Wallet.id, Wallet.address)
+            .where((Wallet.last_balance_updated_at.is_(None)) | (Wallet.last_balance_updated_at < stale_before))
+            .order_by(Wallet.last_balance_updated_at.asc().nulls_first())
+        )
+        wallets = [tuple(row) for row in result.all()]
+
+    if not wallets:
+        return
+
+    updated = 0
+    for start in range(0, len(wallets), BALANCE_BULK_SIZE):
+        chunk = wallets[start : start + BALANCE_BULK_SIZE]
+        try:
+            updated += await refresh_balances_chunk(chunk)
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Ошибка TonAPI /accounts/_bulk: {e.response.status_code} - {e.response.text}")
+        except httpx.RequestError as e:
+            logger.error(f"Сетевая ошибка при обновлении балансов: {e}")
+    logger.info(f"Обновлены балансы {updated}/{len(wallets)} кошельков")
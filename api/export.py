@@ -0,0 +1,403 @@
+# api/export.py
+
+"""
+Потоковый экспорт истории кошельков.
+
+События читаются из БД серверным курсором (AsyncSession.stream с yield_per) и из
+Parquet-архива по одному файлу месяца, сливаются по lt от новых к старым, кодируются
+построчно и отдаются чанками StreamingResponse: память не зависит от размера истории.
+
+- CSV / NDJSON / JSON — история одного кошелька по actions; по запросу сжимается gzip
+  на лету (Content-Encoding: gzip).
+- Arrow IPC stream / Parquet — переводы нескольких кошельков с типизированными колонками
+  (COLUMNAR_SCHEMA) для аналитики: читаются pandas/polars/duckdb без разбора текста.
+  Требует pyarrow (pip install pyarrow).
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from api.archive import iter_archived_transactions
+from core.address import to_raw_address
+from core.actions import extract_transfers
+from core.codec import decode_actions
+from db.db_init import async_session, load_codec_dictionaries
+from db.ingest import transfer_direction
+from db.models import Transaction, Transfer, Wallet, WalletEvent
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Колоночный экспорт опционален
+    pa = pq = None
+
+load_dotenv()
+
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))  # Строк за одну выборку серверного курсора
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "65536"))  # Символов в одном отдаваемом чанке
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_PARQUET_ROW_GROUP_SIZE = int(os.getenv("EXPORT_PARQUET_ROW_GROUP_SIZE", "65536"))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+EXPORT_MEDIA_TYPES = {"json": "application/json", "csv": "text/csv", "ndjson": "application/x-ndjson"}
+COLUMNAR_MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+EXPORT_FIELDS = (
+    "event_id",
+    "timestamp",
+    "lt",
+    "action_index",
+    "action_type",
+    "action_status",
+    "action_description",
+)
+
+
+async def _next(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _iter_hot_events(wallet_id: int, from_ts: Optional[int], to_ts: Optional[int]) -> AsyncIterator[dict]:
+    """События кошелька из БД от новых к старым; строки приходят порциями по EXPORT_FETCH_SIZE."""
+    stmt = (
+        select(Transaction.event_id, WalletEvent.lt, WalletEvent.timestamp, Transaction.actions_json)
+        .join(Transaction, Transaction.id == WalletEvent.transaction_id)
+        .where(WalletEvent.wallet_id == wallet_id)
+        .order_by(WalletEvent.lt.desc())
+        .execution_options(yield_per=EXPORT_FETCH_SIZE)
+    )
+    if from_ts is not None:
+        stmt = stmt.where(WalletEvent.timestamp >= from_ts)
+    if to_ts is not None:
+        stmt = stmt.where(WalletEvent.timestamp <= to_ts)
+    async with async_session() as session:
+        result = await session.stream(stmt)
+        async for row in result.mappings():
+            yield dict(row)
+
+
+async def merge_by_lt(hot: AsyncIterator[dict], archived: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """
+    Слияние двух потоков строк, упорядоченных по lt от новых к старым (БД и архив).
+    Строки архивного события, которое есть и в БД (сбой между записью файла и удалением),
+    пропускаются: событие берётся из БД. Событию может соответствовать несколько строк подряд.
+    """
+    last_hot = None  # (lt, event_id) последней строки из БД
+    try:
+        hot_row, archived_row = await _next(hot), await _next(archived)
+        while hot_row is not None or archived_row is not None:
+            if archived_row is not None and last_hot == (archived_row["lt"], archived_row["event_id"]):
+                archived_row = await _next(archived)
+            elif archived_row is None or (hot_row is not None and hot_row["lt"] >= archived_row["lt"]):
+                last_hot = (hot_row["lt"], hot_row["event_id"])
+                yield hot_row
+                hot_row = await _next(hot)
+            else:
+                yield archived_row
+                archived_row = await _next(archived)
+    finally:
+        await hot.aclose()
+        await archived.aclose()
+
+
+def iter_wallet_events(
+    wallet_id: int, from_ts: Optional[int] = None, to_ts: Optional[int] = None
+) -> AsyncIterator[dict]:
+    """События кошелька за период от новых к старым: горячая таблица и архив (api.archive)."""
+    return merge_by_lt(
+        _iter_hot_events(wallet_id, from_ts, to_ts), iter_archived_transactions(wallet_id, from_ts, to_ts)
+    )
+
+
+def export_rows(event: dict) -> list[dict]:
+    """Строки экспорта события: по одной на action."""
+    timestamp = datetime.utcfromtimestamp(event["timestamp"]).isoformat() if event["timestamp"] else None
+    rows = []
+    for action_idx, action in enumerate(decode_actions(event["actions_json"])):  # core.codec
+        preview = action.get("simple_preview") or action.get("simplePreview", {})
+        rows.append(
+            {
+                "event_id": event["event_id"],
+                "timestamp": timestamp,
+                "lt": event["lt"],
+                "action_index": action_idx,
+                "action_type": action.get("type"),
+                "action_status": action.get("status"),
+                "action_description": preview.get("description") if isinstance(preview, dict) else str(preview),
+            }
+        )
+    return rows
+
+
+async def _encode(events: AsyncIterator[dict], export_format: str, address: str) -> AsyncIterator[str]:
+    """Построчное кодирование: CSV с заголовком, NDJSON или JSON-объект {"address", "transactions"}."""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        async for event in events:
+            await load_codec_dictionaries([event["actions_json"]])
+            writer.writerows(export_rows(event))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    if export_format == "json":
+        yield f'{{"address": {json.dumps(address)}, "transactions": ['
+    separator = "\n" if export_format == "ndjson" else ", "
+    first = True
+    async for event in events:
+        await load_codec_dictionaries([event["actions_json"]])
+        for row in export_rows(event):
+            text = json.dumps(row, ensure_ascii=False)
+            if export_format == "ndjson":
+                yield text + separator
+            else:
+                yield text if first else separator + text
+            first = False
+    if export_format == "json":
+        yield "]}"
+
+
+async def stream_export(
+    wallet_id: int,
+    address: str,
+    export_format: str,
+    from_ts: Optional[int] = None,
+    to_ts: Optional[int] = None,
+    compress: bool = False,
+) -> AsyncIterator[bytes]:
+    """Тело экспорта чанками по ~EXPORT_CHUNK_SIZE; при compress — gzip-поток."""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    parts, size = [], 0
+    async for text in _encode(iter_wallet_events(wallet_id, from_ts, to_ts), export_format, address):
+        parts.append(text)
+        size += len(text)
+        if size < EXPORT_CHUNK_SIZE:
+            continue
+        data = "".join(parts).encode("utf-8")
+        parts, size = [], 0
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    data = "".join(parts).encode("utf-8")
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def export_response(
+    wallet_id: int,
+    address: str,
+    export_format: str,
+    from_ts: Optional[int] = None,
+    to_ts: Optional[int] = None,
+    compress: bool = False,
+) -> StreamingResponse:
+    headers = {"Content-Disposition": f"attachment; filename=history_{address}.{export_format}"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        stream_export(wallet_id, address, export_format, from_ts, to_ts, compress),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers=headers,
+    )
+
+
+def columnar_available() -> bool:
+    return pa is not None
+
+
+def _columnar_schema():
+    return pa.schema(
+        [
+            ("wallet", pa.string()),  # Адрес кошелька из запроса выгрузки (как в Watchlist)
+            ("event_id", pa.string()),
+            ("lt", pa.int64()),
+            ("timestamp", pa.timestamp("s", tz="UTC")),
+            ("action_index", pa.int32()),
+            ("type", pa.string()),  # TonTransfer / JettonTransfer / NftItemTransfer
+            ("direction", pa.string()),  # "in" / "out" относительно кошелька
+            ("sender", pa.string()),
+            ("recipient", pa.string()),
+            ("asset", pa.string()),  # Адрес jetton master / NFT; null — TON
+            ("asset_symbol", pa.string()),
+            ("amount", pa.decimal256(40, 0)),  # Целое в минимальных единицах, как transfers.amount
+            ("decimals", pa.int16()),  # amount / 10**decimals — сумма в единицах актива
+            ("comment", pa.string()),
+            ("is_scam_event", pa.bool_()),
+        ]
+    )
+
+
+async def _iter_hot_transfers(
+    wallet: Wallet, from_ts: Optional[int], to_ts: Optional[int]
+) -> AsyncIterator[dict]:
+    """Переводы событий кошелька из таблицы transfers (уже разобранные при сохранении), от новых к старым."""
+    stmt = (
+        select(
+            Transaction.event_id,
+            WalletEvent.lt,
+            WalletEvent.timestamp,
+            Transaction.is_scam_event,
+            Transfer.action_index,
+            Transfer.type,
+            Transfer.sender,
+            Transfer.recipient,
+            Transfer.sender_id,
+            Transfer.recipient_id,
+            Transfer.asset,
+            Transfer.asset_symbol,
+            Transfer.amount,
+            Transfer.decimals,
+            Transfer.comment,
+        )
+        .join(Transaction, Transaction.id == WalletEvent.transaction_id)
+        .join(Transfer, Transfer.transaction_id == WalletEvent.transaction_id)
+        .where(WalletEvent.wallet_id == wallet.id)
+        .order_by(WalletEvent.lt.desc(), Transfer.action_index)
+        .execution_options(yield_per=EXPORT_FETCH_SIZE)
+    )
+    if from_ts is not None:
+        stmt = stmt.where(WalletEvent.timestamp >= from_ts)
+    if to_ts is not None:
+        stmt = stmt.where(WalletEvent.timestamp <= to_ts)
+    wallet_raw = to_raw_address(wallet.address) or wallet.address
+    async with async_session() as session:
+        result = await session.stream(stmt)
+        async for row in result.mappings():
+            row = dict(row)
+            sender_id, recipient_id = row.pop("sender_id"), row.pop("recipient_id")
+            if wallet.account_id is not None and sender_id is not None:
+                row["direction"] = (
+                    "out" if sender_id == wallet.account_id else "in" if recipient_id == wallet.account_id else None
+                )
+            else:  # Строки до интернирования аккаунтов
+                row["direction"] = transfer_direction(wallet_raw, row["sender"], row["recipient"])
+            yield row
+
+
+async def _iter_archived_transfers(
+    wallet: Wallet, from_ts: Optional[int], to_ts: Optional[int]
+) -> AsyncIterator[dict]:
+    """Переводы архивных событий кошелька: разбираются из actions (core.actions), как при сохранении."""
+    wallet_raw = to_raw_address(wallet.address) or wallet.address
+    async for event in iter_archived_transactions(wallet.id, from_ts, to_ts):
+        await load_codec_dictionaries([event["actions_json"]])
+        for transfer in extract_transfers(decode_actions(event["actions_json"])):
+            yield {
+                "event_id": event["event_id"],
+                "lt": event["lt"],
+                "timestamp": event["timestamp"],
+                "is_scam_event": event["is_scam_event"],
+                "direction": transfer_direction(wallet_raw, transfer["sender"], transfer["recipient"]),
+                **transfer,
+            }
+
+
+async def _iter_transfer_batches(
+    wallets: list[Wallet], from_ts: Optional[int], to_ts: Optional[int]
+) -> AsyncIterator["pa.RecordBatch"]:
+    """Переводы кошельков по очереди RecordBatch-ами по EXPORT_FETCH_SIZE строк."""
+    schema = _columnar_schema()
+    for wallet in wallets:
+        rows = []
+        transfers = merge_by_lt(
+            _iter_hot_transfers(wallet, from_ts, to_ts), _iter_archived_transfers(wallet, from_ts, to_ts)
+        )
+        async for row in transfers:
+            row["wallet"] = wallet.address
+            rows.append(row)
+            if len(rows) >= EXPORT_FETCH_SIZE:
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+                rows = []
+        if rows:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл, который только копит записанные байты: писатель Arrow/Parquet пишет в него, ответ забирает."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_columnar_export(
+    wallets: list[Wallet], export_format: str, from_ts: Optional[int] = None, to_ts: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Arrow IPC stream (RecordBatch по EXPORT_FETCH_SIZE строк) или Parquet
+    (row group по EXPORT_PARQUET_ROW_GROUP_SIZE строк) с переводами кошельков.
+    """
+    sink = _ChunkSink()
+    schema = _columnar_schema()
+    if export_format == "arrow":
+        writer = pa.ipc.new_stream(sink, schema)
+        async for batch in _iter_transfer_batches(wallets, from_ts, to_ts):
+            writer.write_batch(batch)
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+        return
+
+    writer = pq.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+    batches, size = [], 0
+    async for batch in _iter_transfer_batches(wallets, from_ts, to_ts):
+        batches.append(batch)
+        size += batch.num_rows
+        if size >= EXPORT_PARQUET_ROW_GROUP_SIZE:
+            await asyncio.to_thread(writer.write_table, pa.Table.from_batches(batches, schema))
+            batches, size = [], 0
+            yield sink.drain()
+    if batches:
+        await asyncio.to_thread(writer.write_table, pa.Table.from_batches(batches, schema))
+    writer.close()  # Футер с метаданными row group-ов
+    yield sink.drain()
+
+
+def columnar_export_response(
+    wallets: list[Wallet], export_format: str, from_ts: Optional[int] = None, to_ts: Optional[int] = None
+) -> StreamingResponse:
+    extension = "arrows" if export_format == "arrow" else "parquet"
+    return StreamingResponse(
+        stream_columnar_export(wallets, export_format, from_ts, to_ts),
+        media_type=COLUMNAR_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=transfers.{extension}"},
+    )
@@ -0,0 +1,108 @@
+# api/graph_format.py
+
+"""
+Кодирование ответа /wallet/graph.
+
+- json — GraphResponse как есть: объект на узел и ребро, подписи и подсказки рёбер строками.
+- columnar — тот же граф таблицами: массив id узлов, рёбра — индексами узлов в этом массиве,
+  веса — числовыми массивами, цвет и форма узлов — индексом в общем словаре стилей.
+  Подписи и подсказки рёбер не передаются: клиент строит их из весов. Подпись узла — null,
+  если она стандартная (первые 6 символов адреса и «...»).
+
+Обе формы сжимаются по Accept-Encoding: brotli (если установлен пакет brotli), иначе gzip.
+Объекты графа не проходят повторную валидацию pydantic: JSON пишется model_dump_json,
+columnar — json.dumps по атрибутам.
+"""
+
+import json
+import os
+import zlib
+from typing import Optional
+
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:  # Brotli опционален, без него — gzip
+    brotli = None
+
+load_dotenv()
+
+GRAPH_BROTLI_QUALITY = int(os.getenv("GRAPH_BROTLI_QUALITY", "5"))
+GRAPH_GZIP_LEVEL = int(os.getenv("GRAPH_GZIP_LEVEL", "6"))
+GRAPH_COMPRESS_MIN_SIZE = 1024  # Меньшие ответы не сжимаются: заголовки gzip/br съедают выигрыш
+
+GRAPH_FORMATS = ("json", "columnar")
+NODE_COLUMNS = ("in_tx_count", "out_tx_count", "total_ton_in", "total_ton_out")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Кодирование ответа по Accept-Encoding: "br", "gzip" или None; q=0 запрещает кодирование."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        try:
+            q = float(params.strip().removeprefix("q=")) if params.strip().startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+    """Сжатое тело и применённое кодирование (None — тело не сжато)."""
+    if len(body) < GRAPH_COMPRESS_MIN_SIZE:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body, quality=GRAPH_BROTLI_QUALITY), encoding
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GRAPH_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31 — формат gzip
+        return compressor.compress(body) + compressor.flush(), encoding
+    return body, None
+
+
+def columnar_graph(graph) -> dict:
+    """GraphResponse в колоночном виде (см. описание модуля)."""
+    styles = {}  # (shape, color) -> индекс стиля
+    index = {}  # id узла -> индекс
+    nodes = {"id": [], "label": [], "style": [], "value": [], **{column: [] for column in NODE_COLUMNS}}
+    for node in graph.nodes:
+        index[node.id] = len(index)
+        nodes["id"].append(node.id)
+        nodes["label"].append(None if node.label == f"{node.id[:6]}..." else node.label)
+        nodes["style"].append(styles.setdefault((node.shape, node.color), len(styles)))
+        nodes["value"].append(node.value)
+        for column in NODE_COLUMNS:
+            nodes[column].append(getattr(node.meta, column) if node.meta is not None else 0)
+
+    edges = {"source": [], "target": [], "count": [], "ton": [], "jetton_count": [], "last_ts": []}
+    for edge in graph.edges:
+        stats = edge.stats
+        edges["source"].append(index[edge.from_node])
+        edges["target"].append(index[edge.to_node])
+        edges["count"].append(stats.count if stats else edge.value or 1)
+        edges["ton"].append(stats.ton_amount / 10**9 if stats else 0)
+        edges["jetton_count"].append(stats.jetton_count if stats else 0)
+        edges["last_ts"].append(stats.last_ts if stats else None)
+
+    return {
+        "format": "columnar",
+        "styles": {
+            "node": [{"shape": shape, "color": color} for shape, color in styles],
+            "edge": {"arrows": "to"},
+        },
+        "nodes": nodes,
+        "edges": edges,
+        "message": graph.message,
+        "truncated": graph.truncated,
+        "pruned": graph.pruned.model_dump() if graph.pruned is not None else None,
+    }
+
+
+def encode_graph(graph, graph_format: str) -> bytes:
+    if graph_format == "columnar":
+        return json.dumps(columnar_graph(graph), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return graph.model_dump_json().encode("utf-8")
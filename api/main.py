@@ -6,6 +6,7 @@ import logging
 from contextlib import asynccontextmanager
 from .routes.wallets import router as wallets_router # Убедитесь, что путь правильный
 from db.db_init import init_db
+from core.tonapi import init_tonapi_client, close_tonapi_client
 from .scheduler import init_scheduler, shutdown_scheduler  # <--- Импорт функций планировщика
 import os  # для доступа к TONAPI_KEY
 
@@ -16,6 +17,9 @@ async def lifespan(app: FastAPI):
     await init_db()
     logger.info("API Запуск - Инициализация базы данных завершена.")
 
+    # Один пул соединений TonAPI на всё приложение: его используют роуты и планировщик
+    init_tonapi_client()
+
     if os.getenv("TONAPI_KEY"):  # Запускаем планировщик только если есть ключ API
         logger.info("API Запуск - Инициализация планировщика...")
         if init_scheduler():
@@ -31,6 +35,8 @@ async def lifespan(app: FastAPI):
     shutdown_scheduler()
     logger.info("API Завершение работы - Планировщик остановлен.")
 
+    await close_tonapi_client()
+
 
 app = FastAPI(
     title="JetRadar API",
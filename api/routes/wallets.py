@@ -1,21 +1,47 @@
-from datetime import datetime
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
 
-from fastapi import APIRouter, Query, HTTPException
-from sqlalchemy import select
-from pydantic import BaseModel
+from fastapi import APIRouter, Header, Query, HTTPException, Response
+from sqlalchemy import select, func, or_
+from pydantic import BaseModel, PrivateAttr
 import httpx
-import os
 from dotenv import load_dotenv
 import logging  # <--- Добавляем logging
-import json  # Для работы с actions_json
-from fastapi import Response  # Для экспорта
 from sqlalchemy.orm import selectinload
 from typing import List, Optional  # Для типизации
-import csv
-import io  # Для экспорта CSV
 
-from db.models import User, Wallet, UserWallet, Transaction
-from db.db_init import async_session
+from db.models import (
+    Account,
+    User,
+    Wallet,
+    UserWallet,
+    Transaction,
+    WalletEvent,
+    BackfillJob,
+    CounterpartyStat,
+    VolumeHourly,
+    VolumeDaily,
+    Transfer,
+)
+from db.db_init import async_session, load_codec_dictionaries, write_lock
+from db.ingest import create_backfill_jobs, intern_accounts, TON_ASSET
+from db.graph import GraphEdgeStats, PrunedTail, expand_graph, transfers_version
+from db.search import search_watchlist
+from core.address import TonAddress, parse_address, to_raw_address
+from core.cache import TTLCache
+from core.codec import decode_actions
+from core.tonapi import TONAPI_KEY, get_tonapi_client
+from api.backfill import backfill_progress
+from api.archive import read_archived_page
+from api.graph_format import GRAPH_FORMATS, compress, encode_graph, negotiate_encoding
+from api.export import (
+    COLUMNAR_MEDIA_TYPES,
+    EXPORT_MEDIA_TYPES,
+    columnar_available,
+    columnar_export_response,
+    export_response,
+)
 
 load_dotenv()
 
@@ -25,31 +51,127 @@ logging.basicConfig(level=logging.INFO)  # Устанавливаем базов
 
 router = APIRouter()
 
-TONAPI_KEY = os.getenv("TONAPI_KEY")
-TONAPI_BASE_URL = "https://tonapi.io/v2"
+SUMMARY_TOP_COUNTERPARTIES = 5
+
+# Кэш данных аккаунта TonAPI для сводки (баланс, last_activity, is_scam), см. core.cache:
+# свежие SUMMARY_CACHE_TTL секунд, ещё SUMMARY_CACHE_STALE_TTL отдаются с фоновым обновлением
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "30"))
+SUMMARY_CACHE_STALE_TTL = float(os.getenv("SUMMARY_CACHE_STALE_TTL", "300"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+# Баланс из БД (его обновляет планировщик, api.balances) берётся без TonAPI, если он не старше стольких секунд
+SUMMARY_DB_BALANCE_MAX_AGE = int(os.getenv("SUMMARY_DB_BALANCE_MAX_AGE", "60"))
+
+account_cache = TTLCache(SUMMARY_CACHE_TTL, SUMMARY_CACHE_STALE_TTL, SUMMARY_CACHE_MAX_ENTRIES)
 
+# Граф связей (db.graph): максимальная глубина и бюджеты, ограничивающие время ответа вокруг загруженных кошельков
+GRAPH_MAX_DEPTH = int(os.getenv("GRAPH_MAX_DEPTH", "4"))
+GRAPH_MAX_NODES = int(os.getenv("GRAPH_MAX_NODES", "2000"))
+GRAPH_MAX_EDGES = int(os.getenv("GRAPH_MAX_EDGES", "5000"))
+# Контрагентов на направление узла по умолчанию; остальные сворачиваются в агрегат «прочие»
+GRAPH_TOP_K = int(os.getenv("GRAPH_TOP_K", "50"))
+# Кэш готовых графов: ключ — параметры запроса и версия данных, поэтому новые события не отдаются устаревшими;
+# TTL ограничивает жизнь записи (архивация и редкие изменения, не сдвигающие курсоры кошельков)
+GRAPH_CACHE_TTL = float(os.getenv("GRAPH_CACHE_TTL", "600"))
+GRAPH_CACHE_MAX_ENTRIES = int(os.getenv("GRAPH_CACHE_MAX_ENTRIES", "500"))
 
-async def fetch_from_tonapi(url: str) -> httpx.Response:
-    """Виконує GET-запит до TonAPI та обробляє помилки."""
-    headers = {"Authorization": f"Bearer {TONAPI_KEY}"}
-    async with httpx.AsyncClient() as client:
+graph_cache = TTLCache(GRAPH_CACHE_TTL, max_entries=GRAPH_CACHE_MAX_ENTRIES)  # (параметры, ETag) -> JSON графа
+graph_accounts = TTLCache(GRAPH_CACHE_TTL, max_entries=GRAPH_CACHE_MAX_ENTRIES)  # параметры -> аккаунты графа
+
+HISTORY_MAX_LIMIT = 100  # Событий на одной странице /history
+EXPORT_MAX_WALLETS = 500  # Адресов в одном запросе колоночного экспорта
+
+# Роллап-таблица, из которой строится ряд, и окно по умолчанию (секунд назад от to_ts; None — без ограничения)
+TIMESERIES_SOURCES = {"hour": VolumeHourly, "day": VolumeDaily, "week": VolumeDaily}
+TIMESERIES_DEFAULT_RANGE = {"hour": 7 * 86400, "day": 365 * 86400, "week": None}
+WEEK_SECONDS = 7 * 86400
+WEEK_START_OFFSET = 4 * 86400  # 1970-01-01 — четверг; недели начинаются с понедельника
+
+
+async def fetch_from_tonapi(path: str, params: Optional[dict] = None) -> httpx.Response:
+    """Виконує GET-запит до TonAPI через спільний клієнт (core.tonapi) та обробляє помилки."""
+    try:
+        return await get_tonapi_client().get(path, params=params)
+    except httpx.HTTPStatusError as e:
+        detail = f"TonAPI error {e.response.status_code}"
         try:
-            resp = await client.get(url, headers=headers)
-            resp.raise_for_status()
-            return resp
-        except httpx.HTTPStatusError as e:
-            detail = f"TonAPI error {e.response.status_code}"
-            try:
-                data = e.response.json()
-                if "error" in data:
-                    detail += f": {data['error']}"
-                else:
-                    detail += f": {e.response.text}"
-            except Exception:
+            data = e.response.json()
+            if "error" in data:
+                detail += f": {data['error']}"
+            else:
                 detail += f": {e.response.text}"
-            raise HTTPException(status_code=e.response.status_code, detail=detail)
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, detail=f"Network error: {str(e)}")
+        except Exception:
+            detail += f": {e.response.text}"
+        raise HTTPException(status_code=e.response.status_code, detail=detail)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Network error: {str(e)}")
+
+
+class BackfillStatus(BaseModel):
+    status: str  # pending / running / done / failed
+    pages_done: int = 0
+    events_stored: int = 0
+    progress: Optional[float] = None  # Доля загруженной истории, 0..1
+    eta_seconds: Optional[int] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+
+class CounterpartySummary(BaseModel):
+    counterparty: str
+    asset: str  # Адрес jetton master или "TON"
+    asset_symbol: Optional[str] = None
+    in_count: int = 0  # Переводов от контрагента кошельку
+    out_count: int = 0  # Переводов кошелька контрагенту
+    in_amount: float = 0  # В единицах актива (TON, не nanoTON)
+    out_amount: float = 0
+    first_ts: Optional[int] = None
+    last_ts: Optional[int] = None
+
+
+def _wallet_address_clause(address: str):
+    """
+    Условие поиска кошелька по адресу в любой форме (EQ.../UQ.../raw):
+    сравнение идёт по интернированному аккаунту, а не по строке.
+    """
+    parsed = parse_address(address)
+    if parsed is None:
+        return Wallet.address == address
+    account_id = (
+        select(Account.id).where(Account.workchain == parsed.workchain, Account.hash == parsed.hash).scalar_subquery()
+    )
+    return or_(Wallet.account_id == account_id, Wallet.address == address)
+
+
+def _counterparty_summary(stat: CounterpartyStat) -> CounterpartySummary:
+    scale = 10 ** (stat.decimals or 0)
+    return CounterpartySummary(
+        counterparty=stat.counterparty,
+        asset=stat.asset,
+        asset_symbol=stat.asset_symbol,
+        in_count=stat.in_count,
+        out_count=stat.out_count,
+        in_amount=int(stat.in_amount or 0) / scale,
+        out_amount=int(stat.out_amount or 0) / scale,
+        first_ts=stat.first_ts,
+        last_ts=stat.last_ts,
+    )
+
+
+class TimeseriesPoint(BaseModel):
+    ts: int  # Начало интервала (unix timestamp, UTC)
+    asset: str  # Адрес jetton master или "TON"
+    asset_symbol: Optional[str] = None
+    in_count: int = 0
+    out_count: int = 0
+    in_amount: float = 0  # В единицах актива (TON, не nanoTON)
+    out_amount: float = 0
+
+
+class TimeseriesResponse(BaseModel):
+    address: str
+    bucket: str
+    points: List[TimeseriesPoint]
 
 
 class WalletSummary(BaseModel):
@@ -61,6 +183,9 @@ class WalletSummary(BaseModel):
     first_activity_ts: Optional[int] = None
     total_tx_count: Optional[int] = None
     is_scam: Optional[bool] = None
+    backfill: Optional[BackfillStatus] = None  # Статус догрузки полной истории
+    counterparties_count: Optional[int] = None  # Уникальных контрагентов (по counterparty_stats)
+    top_counterparties: List[CounterpartySummary] = []
     # Можно добавить информацию о Jetton-балансах
     # jettons: List[dict] = []
 
@@ -91,12 +216,30 @@ class GraphEdge(BaseModel):
     label: Optional[str] = None  # Например, "TON: 450" или "5 txs"
     title: Optional[str] = None  # Подсказка при наведении
     arrows: Optional[str] = "to"
+    _stats: Optional[GraphEdgeStats] = PrivateAttr(None)  # Веса ребра для format=columnar, в JSON не выводятся
+
+    @property
+    def stats(self) -> Optional[GraphEdgeStats]:
+        return self._stats
+
+
+class GraphPruning(BaseModel):
+    """Что убрано из графа ради размера ответа."""
+
+    top_k: int
+    rank_by: str
+    aggregate_nodes: int = 0  # Узлов «прочие» (хвост контрагентов узла за пределами top_k)
+    collapsed_counterparties: int = 0  # Контрагентов, свёрнутых в эти узлы
+    collapsed_transfers: int = 0  # Их переводов
+    dropped_edges: int = 0  # Рёбер и агрегатов, не вошедших в бюджеты max_nodes / max_edges
 
 
 class GraphResponse(BaseModel):
     nodes: List[GraphNode]
     edges: List[GraphEdge]
     message: Optional[str] = None
+    truncated: bool = False  # Граф обрезан бюджетом узлов/рёбер
+    pruned: Optional[GraphPruning] = None  # Что убрано ради размера ответа
 
 
 class WalletRequestBase(BaseModel):
@@ -159,14 +302,42 @@ class EventResponse(BaseModel):
     actions: List[ActionResponse]
 
 
+class HistoryPage(BaseModel):
+    events: List[EventResponse]
+    next_cursor: Optional[str] = None  # Курсор следующей (более старой) страницы; None — история закончилась
+
+
+async def get_account_info(address: str) -> dict:
+    """
+    Баланс (nanoTON), last_activity и is_scam аккаунта из TonAPI /accounts/{address} через account_cache.
+    Ключ — raw-форма адреса, поэтому EQ.../UQ.../raw-запросы одного аккаунта делят запись кэша,
+    а одновременные запросы (WebApp и бот) — один вызов TonAPI.
+    """
+
+    async def _load() -> dict:
+        if not TONAPI_KEY:
+            raise HTTPException(status_code=503, detail="TONAPI_KEY not set")
+        acc_data = (await fetch_from_tonapi(f"/accounts/{address}")).json()
+        return {
+            "balance": acc_data.get("balance", 0) or 0,
+            "last_activity": acc_data.get("last_activity"),
+            "is_scam": acc_data.get("is_scam", False),
+        }
+
+    return await account_cache.get(to_raw_address(address) or address, _load)
+
+
 @router.get("/{address}/summary", response_model=WalletSummary, summary="Получить сводку кошелька")
 async def get_wallet_summary(address: str, telegram_user_id: int = Query(...)):
     """
     Возвращает:
       - address, alias, group из БД (если кошелёк есть в watchlist);
-      - баланс (balance_ton) и last_activity_ts из TonAPI;
+      - баланс (balance_ton) и last_activity_ts: из БД, если баланс обновлён не раньше
+        SUMMARY_DB_BALANCE_MAX_AGE секунд назад, иначе из TonAPI через кэш (get_account_info);
       - first_activity_ts и total_tx_count из БД (если ранее сохранились);
-      - is_scam из TonAPI (или из БД, если хотите).
+      - is_scam из TonAPI (или из БД, если хотите);
+      - статус догрузки полной истории (страницы, сохранённые события, ETA);
+      - число контрагентов и топ по количеству переводов (из counterparty_stats).
     """
 
     # 1) Сначала проверим, есть ли пользователь в базе (чтобы он имел доступ)
@@ -179,7 +350,7 @@ async def get_wallet_summary(address: str, telegram_user_id: int = Query(...)):
         stmt = (
             select(Wallet, UserWallet.alias, UserWallet.group)
             .outerjoin(UserWallet, (UserWallet.wallet_id == Wallet.id) & (UserWallet.user_id == user.id))
-            .where(Wallet.address == address)
+            .where(_wallet_address_clause(address))
         )
         result = await session.execute(stmt)
         row = result.first()
@@ -189,6 +360,9 @@ async def get_wallet_summary(address: str, telegram_user_id: int = Query(...)):
         first_activity_ts = None
         total_tx_count = None
         db_is_scam = None
+        backfill = None
+        counterparties_count = None
+        top_counterparties = []
 
         if row:
             db_wallet, alias, group = row
@@ -198,23 +372,49 @@ async def get_wallet_summary(address: str, telegram_user_id: int = Query(...)):
             # При желании можно брать is_scam из БД (если вы заранее сохраняете его при добавлении)
             db_is_scam = db_wallet.is_scam
 
-    # 3) Теперь _всегда_ делаем запрос к TonAPI → /accounts/{address} для актуального баланса и last_activity
-    if not TONAPI_KEY:
-        raise HTTPException(status_code=503, detail="TONAPI_KEY not set")
-
-    resp = await fetch_from_tonapi(f"{TONAPI_BASE_URL}/accounts/{address}")
+            job = await session.scalar(select(BackfillJob).where(BackfillJob.wallet_id == db_wallet.id))
+            if job:
+                progress, eta_seconds = backfill_progress(job)
+                backfill = BackfillStatus(
+                    status=job.status,
+                    pages_done=job.pages_done,
+                    events_stored=job.events_stored,
+                    progress=progress,
+                    eta_seconds=eta_seconds,
+                    started_at=job.started_at,
+                    finished_at=job.finished_at,
+                    last_error=job.last_error,
+                )
 
-    acc_data = resp.json()
-    # Из TonAPI получаем:
-    #   balance  (в нанотонах) → делим на 1e9
-    #   last_activity (Unix-timestamp)
-    #   is_scam     (булево)
-    # Если хотите, можно также забрать из acc_data первые сведения о транзакциях, но в этом методе нам достаточно баланса
+            counterparties_count = await session.scalar(
+                select(func.count(func.distinct(CounterpartyStat.counterparty))).where(
+                    CounterpartyStat.wallet_id == db_wallet.id
+                )
+            )
+            top_stats = await session.scalars(
+                select(CounterpartyStat)
+                .where(CounterpartyStat.wallet_id == db_wallet.id)
+                .order_by((CounterpartyStat.in_count + CounterpartyStat.out_count).desc())
+                .limit(SUMMARY_TOP_COUNTERPARTIES)
+            )
+            top_counterparties = [_counterparty_summary(stat) for stat in top_stats]
+
+    # 3) Баланс, last_activity и is_scam: свежий баланс из БД или данные TonAPI через кэш
+    account = None
+    if row and db_wallet.last_balance_ton is not None and db_wallet.last_balance_updated_at is not None:
+        balance_age = datetime.utcnow() - db_wallet.last_balance_updated_at
+        if balance_age <= timedelta(seconds=SUMMARY_DB_BALANCE_MAX_AGE):
+            account = {
+                "balance": db_wallet.last_balance_ton,
+                "last_activity": db_wallet.last_activity_ts,
+                "is_scam": db_wallet.is_scam,
+            }
+    if account is None:
+        account = await get_account_info(address)
 
-    ton_balance_raw = acc_data.get("balance", 0) or 0
-    balance_ton = int(ton_balance_raw) / 1_000_000_000
-    last_activity_ts = acc_data.get("last_activity")  # может быть None или int
-    api_is_scam = acc_data.get("is_scam", False)
+    balance_ton = int(account["balance"] or 0) / 1_000_000_000
+    last_activity_ts = account["last_activity"]  # может быть None или int
+    api_is_scam = account["is_scam"]
 
     # 4) Формируем и возвращаем WalletSummary
     return WalletSummary(
@@ -227,112 +427,293 @@ async def get_wallet_summary(address: str, telegram_user_id: int = Query(...)):
         total_tx_count=total_tx_count,
         # Если в БД уже записан is_scam → используем его, иначе берём из TonAPI
         is_scam=(db_is_scam if db_is_scam is not None else api_is_scam),
+        backfill=backfill,
+        counterparties_count=counterparties_count,
+        top_counterparties=top_counterparties,
     )
 
 
+@router.get(
+    "/{address}/counterparties",
+    response_model=List[CounterpartySummary],
+    summary="Аналитика контрагентов кошелька",
+)
+async def get_wallet_counterparties(
+    address: str,
+    asset: Optional[str] = Query(None, description='Адрес jetton master или "TON"'),
+    order_by: str = Query(
+        "tx_count",
+        enum=["tx_count", "volume", "last_ts"],
+        description="volume — сумма в минимальных единицах актива, сравнима только вместе с фильтром asset",
+    ),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    Возвращает агрегаты переводов кошелька по контрагентам: количество и суммы
+    входящих/исходящих переводов, первое и последнее взаимодействие.
+    Читается готовая таблица counterparty_stats — O(контрагентов), а не O(транзакций).
+    """
+    async with async_session() as session:
+        wallet_id = await session.scalar(select(Wallet.id).where(_wallet_address_clause(address)))
+        if not wallet_id:
+            raise HTTPException(status_code=404, detail=f"Кошелек {address} не найден в локальной базе.")
+
+        stmt = select(CounterpartyStat).where(CounterpartyStat.wallet_id == wallet_id)
+        if asset:
+            stmt = stmt.where(CounterpartyStat.asset == asset)
+        order_columns = {
+            "tx_count": CounterpartyStat.in_count + CounterpartyStat.out_count,
+            "volume": CounterpartyStat.in_amount + CounterpartyStat.out_amount,
+            "last_ts": CounterpartyStat.last_ts,
+        }
+        stats = await session.scalars(stmt.order_by(order_columns[order_by].desc()).limit(limit))
+        return [_counterparty_summary(stat) for stat in stats]
+
+
+@router.get("/{address}/timeseries", response_model=TimeseriesResponse, summary="Объёмы переводов кошелька по времени")
+async def get_wallet_timeseries(
+    address: str,
+    bucket: str = Query("day", enum=["hour", "day", "week"]),
+    asset: Optional[str] = Query(None, description='Адрес jetton master или "TON"'),
+    from_ts: Optional[int] = Query(None, description="Начало периода (unix timestamp)"),
+    to_ts: Optional[int] = Query(None, description="Конец периода (unix timestamp)"),
+):
+    """
+    Возвращает количество и суммы входящих/исходящих переводов кошелька по интервалам
+    (час, день, неделя) и активам. Читаются предрассчитанные роллапы volume_hourly /
+    volume_daily (недели собираются из дневных), а не таблица transactions.
+    """
+    model = TIMESERIES_SOURCES[bucket]
+    to_ts = to_ts if to_ts is not None else int(datetime.now(timezone.utc).timestamp())
+    if from_ts is None and TIMESERIES_DEFAULT_RANGE[bucket] is not None:
+        from_ts = to_ts - TIMESERIES_DEFAULT_RANGE[bucket]
+
+    if bucket == "week":
+        bucket_ts = model.bucket_ts - (model.bucket_ts - WEEK_START_OFFSET) % WEEK_SECONDS
+        # Нижняя граница — начало недели: первая точка суммирует все дни своей недели, а не с from_ts
+        from_bucket = from_ts - (from_ts - WEEK_START_OFFSET) % WEEK_SECONDS if from_ts is not None else None
+    else:
+        bucket_ts = model.bucket_ts
+        from_bucket = from_ts - from_ts % model.bucket_seconds if from_ts is not None else None
+    bucket_ts = bucket_ts.label("ts")
+
+    async with async_session() as session:
+        wallet_id = await session.scalar(select(Wallet.id).where(_wallet_address_clause(address)))
+        if not wallet_id:
+            raise HTTPException(status_code=404, detail=f"Кошелек {address} не найден в локальной базе.")
+
+        stmt = (
+            select(
+                bucket_ts,
+                model.asset,
+                func.max(model.asset_symbol).label("asset_symbol"),
+                func.max(model.decimals).label("decimals"),
+                func.sum(model.in_count).label("in_count"),
+                func.sum(model.out_count).label("out_count"),
+                func.sum(model.in_amount).label("in_amount"),
+                func.sum(model.out_amount).label("out_amount"),
+            )
+            .where(model.wallet_id == wallet_id)
+            .where(model.bucket_ts <= to_ts)
+            .group_by(bucket_ts, model.asset)
+            .order_by(bucket_ts, model.asset)
+        )
+        if from_bucket is not None:
+            stmt = stmt.where(model.bucket_ts >= from_bucket)
+        if asset:
+            stmt = stmt.where(model.asset == asset)
+        rows = (await session.execute(stmt)).all()
+
+    points = []
+    for row in rows:
+        scale = 10 ** (row.decimals or 0)
+        points.append(
+            TimeseriesPoint(
+                ts=row.ts,
+                asset=row.asset,
+                asset_symbol=row.asset_symbol,
+                in_count=row.in_count,
+                out_count=row.out_count,
+                in_amount=int(row.in_amount or 0) / scale,
+                out_amount=int(row.out_amount or 0) / scale,
+            )
+        )
+    return TimeseriesResponse(address=address, bucket=bucket, points=points)
+
+
 @router.get("/wallets/search", response_model=List[dict], summary="Поиск кошельков в Watchlist пользователя")
 async def search_user_wallets(telegram_user_id: int = Query(...), query: str = Query(..., min_length=3)):
     """
-    Ищет кошельки в Watchlist пользователя по адресу, метке или группе.
+    Ищет кошельки в Watchlist пользователя по адресу, метке, группе и комментариям переводов.
+    Поиск идёт по полнотекстовому индексу (db.search), результаты ранжированы по релевантности;
+    для совпадений по комментарию в matched_comment возвращается фрагмент комментария.
     """
     async with async_session() as session:
         user = await session.scalar(select(User).where(User.telegram_id == telegram_user_id))
         if not user:
             return []  # Пользователь не найден
 
-        search_query = f"%{query.lower()}%"
-
-        result = await session.execute(
-            select(Wallet.address, UserWallet.alias, UserWallet.group)
-            .join(UserWallet, Wallet.id == UserWallet.wallet_id)
-            .where(UserWallet.user_id == user.id)
-            .where(
-                (Wallet.address.ilike(search_query))
-                | (UserWallet.alias.ilike(search_query))
-                | (UserWallet.group.ilike(search_query))
-            )
-            .limit(20)  # Ограничиваем результаты
-        )
-
-        found_wallets = result.all()
-        return [{"address": r.address, "alias": r.alias, "group": r.group} for r in found_wallets]
+        return await search_watchlist(session, user.id, query)
 
 
 @router.get("/{address}/history/export", summary="Экспорт истории транзакций кошелька")
-async def export_wallet_history(address: str, format: str = Query("json", enum=["json", "csv"])):
+async def export_wallet_history(
+    address: str,
+    format: str = Query("json", enum=list(EXPORT_MEDIA_TYPES)),
+    from_ts: Optional[int] = Query(None, description="Начало периода (unix time, включительно)"),
+    to_ts: Optional[int] = Query(None, description="Конец периода (unix time, включительно)"),
+    gzip: bool = Query(False, description="Сжать ответ gzip на лету (Content-Encoding: gzip)"),
+):
     """
-    Экспортирует историю транзакций для заданного адреса кошелька в формате JSON или CSV.
-    Данные берутся из локально сохраненных транзакций.
+    Экспортирует историю транзакций кошелька в формате JSON, CSV или NDJSON (строка на action).
+    Данные берутся из локально сохраненных транзакций: горячей таблицы и архива (api.archive),
+    и отдаются потоком (api.export) — память сервера не зависит от размера истории.
     """
     async with async_session() as session:
-        wallet = await session.scalar(select(Wallet).where(Wallet.address == address))
-        if not wallet:
-            raise HTTPException(status_code=404, detail=f"Кошелек {address} не найден в локальной базе.")
+        wallet_id = await session.scalar(select(Wallet.id).where(_wallet_address_clause(address)))
+    if wallet_id is None:
+        raise HTTPException(status_code=404, detail=f"Кошелек {address} не найден в локальной базе.")
+    return export_response(wallet_id, address, format, from_ts, to_ts, compress=gzip)
+
+
+@router.get("/wallets/export", summary="Колоночный экспорт переводов нескольких кошельков (Arrow / Parquet)")
+async def export_wallets_columnar(
+    address: List[str] = Query([], description="Адреса кошельков (параметр повторяется)"),
+    telegram_user_id: Optional[int] = Query(None, description="Добавить все кошельки Watchlist пользователя"),
+    format: str = Query("arrow", enum=list(COLUMNAR_MEDIA_TYPES)),
+    from_ts: Optional[int] = Query(None, description="Начало периода (unix time, включительно)"),
+    to_ts: Optional[int] = Query(None, description="Конец периода (unix time, включительно)"),
+):
+    """
+    Переводы выбранных кошельков одним потоком Arrow IPC или Parquet: строка на перевод
+    с типизированными колонками (сумма — целое в минимальных единицах + decimals, адреса,
+    jetton, время, направление относительно кошелька). Колонка wallet — кошелёк выгрузки.
+    """
+    if not columnar_available():
+        raise HTTPException(status_code=501, detail="Колоночный экспорт требует пакет 'pyarrow'.")
+    if not address and telegram_user_id is None:
+        raise HTTPException(status_code=400, detail="Укажите address и/или telegram_user_id.")
+    if len(address) > EXPORT_MAX_WALLETS:
+        raise HTTPException(status_code=400, detail=f"Не более {EXPORT_MAX_WALLETS} адресов за запрос.")
+
+    wallets = {}
+    async with async_session() as session:
+        for item in address:
+            wallet = await session.scalar(select(Wallet).where(_wallet_address_clause(item)))
+            if wallet is None:
+                raise HTTPException(status_code=404, detail=f"Кошелек {item} не найден в локальной базе.")
+            wallets[wallet.id] = wallet
+        if telegram_user_id is not None:
+            watchlist = await session.scalars(
+                select(Wallet)
+                .join(UserWallet, UserWallet.wallet_id == Wallet.id)
+                .join(User, User.id == UserWallet.user_id)
+                .where(User.telegram_id == telegram_user_id)
+                .order_by(Wallet.id)
+            )
+            for wallet in watchlist:
+                wallets.setdefault(wallet.id, wallet)
+    return columnar_export_response(list(wallets.values()), format, from_ts, to_ts)
 
-        # Загружаем транзакции для этого кошелька
-        transactions_result = await session.execute(
-            select(Transaction)
-            .where(Transaction.wallet_id == wallet.id)
-            .order_by(Transaction.timestamp.desc())
-            # .limit(1000) # Опционально: ограничить количество экспортируемых транзакций
-        )
-        transactions = transactions_result.scalars().all()
-
-        if not transactions:
-            if format == "json":
-                return {"message": "Нет транзакций для экспорта.", "transactions": []}
-            else:  # csv
-                return Response("Нет транзакций для экспорта.", media_type="text/plain")
-
-        export_data = []
-        for tx in transactions:
-            actions = json.loads(tx.actions_json)  # Десериализуем actions
-            # Упрощенное представление для экспорта - можно детализировать
-            for action_idx, action in enumerate(actions):
-                export_data.append(
-                    {
-                        "event_id": tx.event_id,
-                        "timestamp": datetime.utcfromtimestamp(tx.timestamp).isoformat() if tx.timestamp else None,
-                        "lt": tx.lt,
-                        "action_index": action_idx,
-                        "action_type": action.get("type"),
-                        "action_status": action.get("status"),
-                        "action_description": (
-                            (action.get("simple_preview") or action.get("simplePreview", {})).get("description")
-                            if isinstance(action.get("simple_preview") or action.get("simplePreview"), dict)
-                            else str(action.get("simple_preview") or action.get("simplePreview", ""))
-                        ),
-                        # Можно добавить больше полей из action в зависимости от типа
-                    }
-                )
 
-        if format == "json":
-            return {"address": address, "transactions": export_data}
+async def _fill_node_meta_from_stats(
+    session, nodes_dict: dict, queried_wallets: dict, incoming: bool, outgoing: bool, jetton_only: bool
+):
+    """
+    Заполняет NodeMeta узлов графа агрегатами counterparty_stats — O(контрагентов).
+    Для кошелька берутся его собственные счётчики, для контрагента — зеркальные
+    (входящие кошелька — исходящие контрагента). Если контрагент сам запрошенный кошелёк,
+    его переводы уже учтены собственной строкой и второй раз не добавляются.
+    queried_wallets: wallet_id -> account_id; узлы графа — по account_id.
+    """
+    if not queried_wallets:
+        return
+    stmt = select(CounterpartyStat).where(CounterpartyStat.wallet_id.in_(list(queried_wallets)))
+    if jetton_only:
+        stmt = stmt.where(CounterpartyStat.asset != TON_ASSET)
+    queried_accounts = set(queried_wallets.values())
+
+    for stat in await session.scalars(stmt):
+        in_count = stat.in_count if incoming else 0
+        out_count = stat.out_count if outgoing else 0
+        is_ton = stat.asset == TON_ASSET
+        ton_in = int(stat.in_amount or 0) / 10**9 if is_ton and incoming else 0.0
+        ton_out = int(stat.out_amount or 0) / 10**9 if is_ton and outgoing else 0.0
+
+        wallet_node = nodes_dict.get(queried_wallets[stat.wallet_id])
+        if wallet_node is not None and wallet_node.meta is not None:
+            wallet_node.meta.in_tx_count += in_count
+            wallet_node.meta.out_tx_count += out_count
+            wallet_node.meta.total_ton_in += ton_in
+            wallet_node.meta.total_ton_out += ton_out
+
+        counterparty_node = nodes_dict.get(stat.counterparty_id)
+        if counterparty_node is None or counterparty_node.meta is None:
+            continue
+        if stat.counterparty_id in queried_accounts:
+            continue
+        counterparty_node.meta.in_tx_count += out_count
+        counterparty_node.meta.out_tx_count += in_count
+        counterparty_node.meta.total_ton_in += ton_out
+        counterparty_node.meta.total_ton_out += ton_in
+
+
+def _graph_edge_label(stats: GraphEdgeStats) -> str:
+    parts = []
+    if stats.count > stats.jetton_count:
+        parts.append(f"{stats.ton_amount / 10**9:.2f} TON")
+    if stats.jetton_count:
+        parts.append(f"{stats.jetton_count} jetton")
+    return " + ".join(parts)
+
+
+def _graph_edge_title(stats: GraphEdgeStats) -> str:
+    last = datetime.utcfromtimestamp(stats.last_ts).strftime("%Y-%m-%d %H:%M") if stats.last_ts else "—"
+    return (
+        f"Переводов: {stats.count}\n"
+        f"TON: {stats.ton_amount / 10**9:.2f} ({stats.count - stats.jetton_count})\n"
+        f"Jetton: {stats.jetton_count}\n"
+        f"Последний: {last}"
+    )
+
 
-        elif format == "csv":
-            output = io.StringIO()
-            if not export_data:  # Если после разбора actions ничего нет
-                return Response(
-                    "Нет данных для CSV экспорта.",
-                    media_type="text/plain",
-                )
+def _graph_other_node(node_id: str, direction: str, tail: PrunedTail) -> GraphNode:
+    """Узел «прочие»: контрагенты узла за пределами top_k в одном направлении (in — отправители, out — получатели)."""
+    stats = tail.stats
+    ton = (stats.ton_amount or 0) / 10**9
+    meta = NodeMeta.model_construct(
+        in_tx_count=stats.count if direction == "out" else 0,
+        out_tx_count=stats.count if direction == "in" else 0,
+        total_ton_in=ton if direction == "out" else 0,
+        total_ton_out=ton if direction == "in" else 0,
+    )
+    return GraphNode.model_construct(
+        id=f"other:{direction}:{node_id}",
+        label=f"+{tail.counterparties}",
+        shape="dot",
+        color="#D3D3D3",  # Серый
+        value=tail.counterparties,
+        meta=meta,
+    )
 
-            writer = csv.DictWriter(output, fieldnames=export_data[0].keys())
-            writer.writeheader()
-            writer.writerows(export_data)
 
-            return Response(
-                output.getvalue(),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename=history_{address}.csv"},
-            )
-    raise HTTPException(status_code=400, detail="Неподдерживаемый формат экспорта.")
+def _graph_edge(from_node: str, to_node: str, stats: GraphEdgeStats, title_prefix: str = "") -> GraphEdge:
+    """Ребро по агрегату переводов; без валидации pydantic — поля собраны из типизированных агрегатов SQL."""
+    edge = GraphEdge.model_construct(
+        from_node=from_node,
+        to_node=to_node,
+        value=stats.count,
+        label=_graph_edge_label(stats),
+        title=title_prefix + _graph_edge_title(stats),
+    )
+    edge._stats = stats
+    return edge
 
 
 @router.get("/graph", response_model=GraphResponse, summary="Построить граф связей для кошельков пользователя")
 async def get_connection_graph_api(
     telegram_user_id: int = Query(...),
-    depth: int = Query(1, ge=1, le=2, description="Глубина анализа связей (1 или 2)"),
+    depth: int = Query(1, ge=1, le=GRAPH_MAX_DEPTH, description="Глубина анализа связей (шагов от кошельков)"),
     target_address: Optional[str] = Query(
         None,
         description="Центральный адрес для графа (если не указан, используются все из Watchlist)",
@@ -341,158 +722,229 @@ async def get_connection_graph_api(
     outgoing: bool = Query(True, description="Включать исходящие транзакции"),
     jetton_only: bool = Query(False, description="Только JettonTransfer"),
     min_value: float = Query(0.0, description="Мин. сумма TON/Jetton для ребра"),
+    max_nodes: int = Query(GRAPH_MAX_NODES, ge=1, le=GRAPH_MAX_NODES, description="Бюджет узлов ответа"),
+    max_edges: int = Query(GRAPH_MAX_EDGES, ge=1, le=GRAPH_MAX_EDGES, description="Бюджет рёбер ответа"),
+    top_k: int = Query(GRAPH_TOP_K, ge=1, description="Контрагентов на направление узла, остальные — в «прочие»"),
+    rank_by: str = Query("count", enum=["count", "volume"], description="Отбор top_k: число переводов / сумма TON"),
+    format: str = Query("json", enum=list(GRAPH_FORMATS), description="json — объекты, columnar — таблицы"),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
 ):
     """
     Строит граф связей.
     Если target_address указан, граф строится вокруг него.
-    Иначе, граф показывает связи между кошельками в Watchlist пользователя и их прямыми контрагентами.
-    Использует локально сохраненные транзакции.
+    Иначе, граф показывает связи между кошельками в Watchlist пользователя и их контрагентами
+    на depth шагов. Использует локально сохраненные переводы: все переводы между парой адресов
+    сведены в одно ребро (value — число переводов, сумма TON, число переводов jetton, последний).
+    Размер графа ограничен: у каждого узла остаются top_k контрагентов (rank_by), хвост сворачивается
+    в узел «прочие» на направление; всего не больше max_nodes узлов и max_edges рёбер (не выше
+    GRAPH_MAX_NODES / GRAPH_MAX_EDGES). truncated — граф обрезан бюджетом, pruned — что убрано.
+    Счётчики и суммы в NodeMeta берутся из counterparty_stats (за всю сохранённую историю,
+    без учёта min_value), а не пересчитываются по переводам на каждый запрос.
+
+    Готовый граф кэшируется (graph_cache) с версией — числом и последним id переводов аккаунтов графа
+    и корнями с метками. Ответ несёт ETag версии: повторный запрос с If-None-Match получает
+    304 Not Modified, пока не сохранено новых переводов с участием узлов графа (кем бы они ни были загружены).
     """
-    nodes_dict = {}  # address -> GraphNode
-    edges_list = []  # список GraphEdge
-
     async with async_session() as session:
         user = await session.scalar(select(User).where(User.telegram_id == telegram_user_id))
         if not user:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
 
         # 1. Определяем начальные узлы (root_nodes)
-        root_wallet_addresses = set()
+        root_accounts = {}  # account_id -> адрес кошелька (как сохранён в wallets)
+        root_labels = {}  # account_id -> метка кошелька в Watchlist
         if target_address:
             # Проверяем, есть ли такой кошелек в системе (не обязательно в watchlist пользователя)
-            wallet_check = await session.scalar(select(Wallet.address).where(Wallet.address == target_address))
-            if not wallet_check:
+            wallet_check = (
+                await session.execute(
+                    select(Wallet.account_id, Wallet.address).where(_wallet_address_clause(target_address))
+                )
+            ).first()
+            if not wallet_check or wallet_check.account_id is None:
                 raise HTTPException(status_code=404, detail=f"Целевой адрес {target_address} не найден в системе.")
-            root_wallet_addresses.add(target_address)
+            root_accounts[wallet_check.account_id] = wallet_check.address
         else:
             # Берем все кошельки из watchlist пользователя
             user_wallets_q = await session.execute(
-                select(Wallet.address, UserWallet.alias)
+                select(Wallet.account_id, Wallet.address, UserWallet.alias)
                 .join(UserWallet, Wallet.id == UserWallet.wallet_id)
-                .where(UserWallet.user_id == user.id)
+                .where(UserWallet.user_id == user.id, Wallet.account_id.is_not(None))
             )
-            for uw_addr, uw_alias in user_wallets_q.all():
-                root_wallet_addresses.add(uw_addr)
-                nodes_dict[uw_addr] = GraphNode(
-                    id=uw_addr,
-                    label=uw_alias or f"{uw_addr[:6]}...",
-                    shape="box",  # Кошельки из watchlist - квадраты
-                    color="#FFD700",  # Золотой
-                    meta=NodeMeta(user_label=uw_alias),
-                )
+            for uw_account_id, uw_addr, uw_alias in user_wallets_q.all():
+                root_accounts[uw_account_id] = uw_addr
+                root_labels[uw_account_id] = uw_alias
+
+        encoding = negotiate_encoding(accept_encoding)
+        if not root_accounts:
+            graph = GraphResponse(nodes=[], edges=[], message="Нет кошельков для построения графа.")
+            return _graph_body_response(compress(encode_graph(graph, format), encoding), {})
+
+        # 2. Версия графа: корни с метками и переводы аккаунтов, попавших в граф при прошлом построении
+        filters = (incoming, outgoing, jetton_only, min_value)
+        budgets = (max_nodes, max_edges, top_k, rank_by)
+        params = (telegram_user_id, target_address, depth, *filters, *budgets)
+        accounts = set(root_accounts) | graph_accounts.peek(params, set())
+        roots = sorted((account_id, addr, root_labels.get(account_id)) for account_id, addr in root_accounts.items())
+        version = await transfers_version(session, accounts)
+        # Граница переводов на момент проверки: по ней считается версия аккаунтов, впервые попавших в граф
+        last_transfer_id = await session.scalar(select(func.max(Transfer.id))) or 0
+
+    version_tag = _graph_version_tag(params, roots, version)
+    if _etag_matches(if_none_match, _graph_etag(version_tag, format, encoding)):
+        return Response(status_code=304, headers=_graph_headers(version_tag, format, encoding))
+
+    async def _build() -> tuple[GraphResponse, set[int]]:
+        graph, graph_account_ids = await _build_connection_graph(
+            root_accounts, root_labels, depth, *filters, *budgets
+        )
+        graph_accounts.set(params, set(root_accounts) | graph_account_ids)
+        return graph, set(root_accounts) | graph_account_ids
+
+    graph, built_accounts = await graph_cache.get((params, version_tag), _build)
+    if not built_accounts <= accounts:
+        # В граф попали аккаунты, которых не было в версии (первое построение или граф вырос): версия
+        # ответа — по аккаунтам возвращаемого графа, иначе следующий запрос получит другой ETag.
+        # Переводы считаются не позже границы last_transfer_id: перевод, сохранённый во время построения,
+        # не войдёт в эту версию, и следующий запрос перестроит граф
+        async with async_session() as session:
+            version = await transfers_version(session, accounts | built_accounts, upto=last_transfer_id)
+        version_tag = _graph_version_tag(params, roots, version)
+        graph_cache.set((params, version_tag), (graph, built_accounts))
 
-        if not root_wallet_addresses:
-            return GraphResponse(nodes=[], edges=[], message="Нет кошельков для построения графа.")
+    async def _encode() -> tuple[bytes, Optional[str]]:
+        return compress(encode_graph(graph, format), encoding)
 
-        # 2. Собираем транзакции для root_nodes (и их контрагентов, если depth > 0)
-        #    Это упрощенная логика, для реальной глубины > 1 потребуется рекурсивный сбор или более сложный запрос.
-        #    Для MVP (depth=1) достаточно транзакций, где root_node является отправителем или получателем.
+    # В кэше — граф версии и готовые тела его представлений (формат x кодирование)
+    body = await graph_cache.get((params, version_tag, format, encoding), _encode)
+    return _graph_body_response(body, _graph_headers(version_tag, format, encoding))
 
-        current_level_addresses = set(root_wallet_addresses)
-        processed_addresses = set()  # Для избежания циклов и повторной обработки
 
-        for _ in range(depth):  # Итерации по глубине
-            if not current_level_addresses:
-                break
+def _graph_version_tag(params: tuple, roots: list, version: tuple) -> str:
+    return hashlib.sha256(repr((params, roots, version)).encode("utf-8")).hexdigest()[:32]
 
-            addresses_to_query_this_level = list(current_level_addresses - processed_addresses)
-            if not addresses_to_query_this_level:
-                break
 
-            processed_addresses.update(addresses_to_query_this_level)
-            next_level_addresses = set()
+def _graph_etag(version_tag: str, graph_format: str, encoding: Optional[str]) -> str:
+    """Строгий ETag — на представление: версия графа, формат и кодирование ответа."""
+    return f'"{version_tag}-{graph_format}-{encoding or "identity"}"'
 
-            # Получаем ID кошельков для запроса транзакций
-            wallet_ids_q = await session.execute(
-                select(Wallet.id, Wallet.address, UserWallet.alias)
-                .outerjoin(UserWallet, (Wallet.id == UserWallet.wallet_id) & (UserWallet.user_id == user.id))
-                .where(Wallet.address.in_(addresses_to_query_this_level))
-            )
-            wallet_id_map = {res.address: (res.id, res.alias) for res in wallet_ids_q.all()}
 
-            if not wallet_id_map:
-                continue  # Нет таких кошельков в нашей БД
+def _graph_headers(version_tag: str, graph_format: str, encoding: Optional[str]) -> dict:
+    # Клиент всегда перепроверяет версию; тело зависит от Accept-Encoding
+    etag = _graph_etag(version_tag, graph_format, encoding)
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
 
-            db_transactions_q = await session.execute(
-                select(Transaction, Wallet.address.label("source_wallet_address"))
-                .join(Wallet, Transaction.wallet_id == Wallet.id)
-                .where(Wallet.id.in_([w_id for w_id, _ in wallet_id_map.values()]))
-                .order_by(Transaction.timestamp.desc())
-                .limit(len(wallet_id_map) * 20)  # Ограничение на общее кол-во транзакций для анализа
-            )
 
-            for tx, source_wallet_addr in db_transactions_q.all():
-                actions = json.loads(tx.actions_json)
-                for action in actions:
-                    # Упрощенный анализ: ищем TonTransfer или JettonTransfer
-                    sender, recipient = None, None
-                    amount_str = ""
-                    amount_val = 0.0
+def _graph_body_response(body: tuple[bytes, Optional[str]], headers: dict) -> Response:
+    content, encoding = body
+    if encoding:
+        headers = {**headers, "Content-Encoding": encoding}
+    return Response(content, media_type="application/json", headers=headers)
 
-                    if action.get("type") == "TonTransfer":
-                        transfer = action.get("TonTransfer", {})
-                        sender = transfer.get("sender", {}).get("address")
-                        recipient = transfer.get("recipient", {}).get("address")
-                        amount_val = int(transfer.get("amount", 0)) / 1e9
-                        amount_str = f"{amount_val:.2f} TON"
-                    elif action.get("type") == "JettonTransfer":
-                        transfer = action.get("JettonTransfer", {})
-                        sender = transfer.get("sender", {}).get("address")
-                        recipient = transfer.get("recipient", {}).get("address")
-                        jetton_info = transfer.get("jetton", {})
-                        decimals = int(jetton_info.get("decimals", 9) or 9)
-                        amount_val = int(transfer.get("amount", 0)) / (10**decimals)
-                        amount_str = f"{amount_val:.2f} {jetton_info.get('symbol', 'JTN')}"
 
-                    if sender and recipient:
-                        if jetton_only and action.get("type") != "JettonTransfer":
-                            continue
-                        if amount_val < min_value:
-                            continue
-                        if not incoming and recipient in root_wallet_addresses:
-                            continue
-                        if not outgoing and sender in root_wallet_addresses:
-                            continue
-                        # Добавляем узлы, если их еще нет
-                        for addr in [sender, recipient]:
-                            if addr not in nodes_dict:
-                                # Является ли этот адрес одним из root_nodes?
-                                is_root_node_related = addr in root_wallet_addresses
-                                nodes_dict[addr] = GraphNode(
-                                    id=addr,
-                                    label=f"{addr[:6]}...",
-                                    shape="ellipse" if not is_root_node_related else "box",  # Обычные эллипсы
-                                    color="#97C2FC" if not is_root_node_related else "#FFD700",  # Голубой
-                                    meta=NodeMeta(),
-                                )
-                            # Обновляем метаданные узлов
-                            if addr == sender:
-                                nodes_dict[addr].meta.out_tx_count += 1
-                                if action.get("type") == "TonTransfer":
-                                    nodes_dict[addr].meta.total_ton_out += amount_val
-                            if addr == recipient:
-                                nodes_dict[addr].meta.in_tx_count += 1
-                                if action.get("type") == "TonTransfer":
-                                    nodes_dict[addr].meta.total_ton_in += amount_val
-
-                        # Добавляем ребро
-                        edges_list.append(
-                            GraphEdge(
-                                from_node=sender,
-                                to_node=recipient,
-                                label=amount_str,
-                                title=f"{action.get('type')}\n{amount_str}\nEvent: {tx.event_id[:10]}...\nTime: {datetime.utcfromtimestamp(tx.timestamp).strftime('%Y-%m-%d %H:%M')}",
-                                # value=1 # Можно увеличить, если несколько транзакций между теми же узлами
-                            )
-                        )
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match: список ETag через запятую или "*"; сравнение слабое (RFC 9110), префикс W/ не учитывается."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+async def _build_connection_graph(
+    root_accounts: dict,
+    root_labels: dict,
+    depth: int,
+    incoming: bool,
+    outgoing: bool,
+    jetton_only: bool,
+    min_value: float,
+    max_nodes: int = GRAPH_MAX_NODES,
+    max_edges: int = GRAPH_MAX_EDGES,
+    top_k: int = GRAPH_TOP_K,
+    rank_by: str = "count",
+) -> tuple[GraphResponse, set[int]]:
+    """Граф вокруг корневых аккаунтов и id аккаунтов его узлов (для версии кэша)."""
+    # Узлы графа ключуются по accounts.id: EQ.../UQ.../raw-формы одного адреса — один узел
+    nodes_dict = {}  # account_id -> GraphNode
+    edges_list = []  # список GraphEdge
+    queried_wallets = {}  # wallet_id -> account_id кошельков, чьи переводы попали в граф
+    graph_account_ids = set()
+    truncated = False
+    pruned = GraphPruning(top_k=top_k, rank_by=rank_by)
+    for account_id, label in root_labels.items():
+        addr = root_accounts[account_id]
+        nodes_dict[account_id] = GraphNode(
+            id=addr,
+            label=label or f"{addr[:6]}...",
+            shape="box",  # Кошельки из watchlist - квадраты
+            color="#FFD700",  # Золотой
+            meta=NodeMeta(user_label=label),
+        )
 
-                        # Добавляем контрагентов на следующий уровень обработки, если глубина позволяет
-                        if sender not in processed_addresses and sender not in current_level_addresses:
-                            next_level_addresses.add(sender)
-                        if recipient not in processed_addresses and recipient not in current_level_addresses:
-                            next_level_addresses.add(recipient)
+    async with async_session() as session:
+        # 2. Граф по сохранённым переводам: пакетный обход по уровням с агрегацией рёбер в SQL (db.graph)
+        graph = await expand_graph(
+            session,
+            root_accounts,
+            depth,
+            max_nodes=max_nodes,
+            max_edges=max_edges,
+            incoming=incoming,
+            outgoing=outgoing,
+            jetton_only=jetton_only,
+            min_value=min_value,
+            top_k=top_k,
+            rank_by=rank_by,
+        )
+        truncated = graph.truncated
+        pruned.dropped_edges = graph.dropped_edges
+        graph_account_ids.update(graph.nodes)
+
+        if graph.edges or graph.others:
+            node_ids = [account_id for account_id in graph.nodes if account_id not in nodes_dict]
+            wallet_rows = await session.execute(
+                select(Wallet.id, Wallet.account_id, Wallet.address).where(Wallet.account_id.in_(list(graph.nodes)))
+            )
+            wallet_addresses = {}
+            for wallet_id, account_id, wallet_address in wallet_rows:
+                wallet_addresses[account_id] = wallet_address
+                if graph.nodes[account_id] < depth:  # Переводы кошелька раскрыты в графе
+                    queried_wallets[wallet_id] = account_id
+            # Адреса остальных аккаунтов — user-friendly форма из accounts
+            account_rows = await session.execute(
+                select(Account.id, Account.workchain, Account.hash).where(
+                    Account.id.in_([account_id for account_id in node_ids if account_id not in wallet_addresses])
+                )
+            )
+            for account_id, workchain, account_hash in account_rows:
+                wallet_addresses[account_id] = TonAddress(workchain, bytes(account_hash)).to_friendly()
+
+            for account_id in node_ids:
+                addr = root_accounts.get(account_id) or wallet_addresses.get(account_id, str(account_id))
+                is_root = account_id in root_accounts
+                # Узлы и рёбра из БД собираются без валидации pydantic (model_construct): на больших графах
+                # она занимала большую часть времени ответа
+                nodes_dict[account_id] = GraphNode.model_construct(
+                    id=addr,
+                    label=f"{addr[:6]}...",
+                    shape="box" if is_root else "ellipse",
+                    color="#FFD700" if is_root else "#97C2FC",  # Золотой / голубой
+                    meta=NodeMeta.model_construct(),
+                )
 
-            current_level_addresses = next_level_addresses  # Переход на следующий уровень
+            for (sender, recipient), stats in graph.edges.items():
+                edges_list.append(_graph_edge(nodes_dict[sender].id, nodes_dict[recipient].id, stats))
+            for (account_id, direction), tail in graph.others.items():
+                other = _graph_other_node(nodes_dict[account_id].id, direction, tail)
+                nodes_dict[(account_id, direction)] = other
+                ends = (other.id, nodes_dict[account_id].id)
+                if direction == "out":
+                    ends = ends[::-1]
+                edges_list.append(_graph_edge(*ends, tail.stats, f"Прочие контрагенты: {tail.counterparties}\n"))
+                pruned.aggregate_nodes += 1
+                pruned.collapsed_counterparties += tail.counterparties
+                pruned.collapsed_transfers += tail.stats.count
+            await _fill_node_meta_from_stats(session, nodes_dict, queried_wallets, incoming, outgoing, jetton_only)
 
     # Преобразуем словарь узлов в список
     final_nodes = list(nodes_dict.values())
@@ -500,10 +952,17 @@ async def get_connection_graph_api(
     # ...
 
     if not edges_list:
-        # Если локальная база пуста, попробуем взять последние события из TonAPI
-        for addr in root_wallet_addresses:
+        # Если локальная база пуста, попробуем взять последние события из TonAPI.
+        # Адреса из TonAPI не интернированы: ключ узла — разобранный адрес (для кошельков — их account_id)
+        root_by_address = {parse_address(addr): account_id for account_id, addr in root_accounts.items()}
+
+        def node_key(address: str):
+            parsed = parse_address(address)
+            return root_by_address.get(parsed, parsed or address)
+
+        for addr in root_accounts.values():
             try:
-                tonapi_events = await get_wallet_history_from_tonapi(addr, limit=5)
+                tonapi_events = await _tonapi_history(addr, limit=5)
             except Exception:
                 continue
             for event in tonapi_events:
@@ -527,37 +986,42 @@ async def get_connection_graph_api(
                             continue
                         if amount_val < min_value:
                             continue
-                        if not incoming and recipient in root_wallet_addresses:
+                        sender_key, recipient_key = node_key(sender), node_key(recipient)
+                        if not incoming and recipient_key in root_accounts:
                             continue
-                        if not outgoing and sender in root_wallet_addresses:
+                        if not outgoing and sender_key in root_accounts:
                             continue
-                        for a in [sender, recipient]:
-                            if a not in nodes_dict:
-                                nodes_dict[a] = GraphNode(
+                        for key, a in [(sender_key, sender), (recipient_key, recipient)]:
+                            if key not in nodes_dict:
+                                nodes_dict[key] = GraphNode(
                                     id=a,
                                     label=f"{a[:6]}...",
                                     color="#97C2FC",
                                     shape="ellipse",
                                     meta=NodeMeta(),
                                 )
-                        nodes_dict[sender].meta.out_tx_count += 1
-                        nodes_dict[recipient].meta.in_tx_count += 1
-                        edges_list.append(
-                            GraphEdge(
-                                from_node=sender,
-                                to_node=recipient,
-                                label=amount_str,
-                                title=amount_str,
-                            )
+                        nodes_dict[sender_key].meta.out_tx_count += 1
+                        nodes_dict[recipient_key].meta.in_tx_count += 1
+                        edge = GraphEdge(
+                            from_node=nodes_dict[sender_key].id,
+                            to_node=nodes_dict[recipient_key].id,
+                            label=amount_str,
+                            title=amount_str,
                         )
+                        is_jetton = act_type == "JettonTransfer"
+                        ton_amount = 0 if is_jetton else int(amount_val * 10**9)
+                        edge._stats = GraphEdgeStats(1, ton_amount, int(is_jetton), event.get("timestamp") or 0)
+                        edges_list.append(edge)
         final_nodes = list(nodes_dict.values())
 
     if not final_nodes and not edges_list:
-        return GraphResponse(
-            nodes=[], edges=[], message="Не удалось найти транзакции для построения графа по заданным параметрам."
-        )
+        message = "Не удалось найти транзакции для построения графа по заданным параметрам."
+        return GraphResponse(nodes=[], edges=[], message=message), graph_account_ids
 
-    return GraphResponse(nodes=final_nodes, edges=edges_list)
+    graph_response = GraphResponse.model_construct(
+        nodes=final_nodes, edges=edges_list, truncated=truncated, pruned=pruned
+    )
+    return graph_response, graph_account_ids
 
 
 # Не забудьте добавить logging и обработку ошибок в новые эндпоинты, как в /add
@@ -571,30 +1035,34 @@ async def add_wallet_to_user_watchlist(item: AddWalletRequest):
     возвращает ошибку ``409``. Только убедившись в ее отсутствии, открывает
     транзакцию и создает недостающие записи.
     """
+    if parse_address(item.address) is None:
+        raise HTTPException(status_code=400, detail=f"Некорректный адрес TON: {item.address}")
     try:
         async with async_session() as session:
-            # Получаем пользователя и кошелек, если они уже есть в БД
-            user = await session.scalar(select(User).where(User.telegram_id == item.telegram_user_id))
-            wallet = await session.scalar(select(Wallet).where(Wallet.address == item.address))
-
-            if user and wallet:
-                link = await session.scalar(
-                    select(UserWallet).where(
-                        UserWallet.user_id == user.id,
-                        UserWallet.wallet_id == wallet.id,
+            # Получаем пользователя и кошелек, если они уже есть в БД (читающая транзакция).
+            # Кошелёк ищется по аккаунту: EQ.../UQ.../raw-форма уже добавленного адреса не создаёт дубликат
+            async with session.begin():
+                user = await session.scalar(select(User).where(User.telegram_id == item.telegram_user_id))
+                wallet = await session.scalar(select(Wallet).where(_wallet_address_clause(item.address)))
+                link = None
+                if user and wallet:
+                    link = await session.scalar(
+                        select(UserWallet).where(
+                            UserWallet.user_id == user.id,
+                            UserWallet.wallet_id == wallet.id,
+                        )
                     )
+            if link:
+                logger.warning(
+                    f"Попытка повторного добавления: Кошелек {item.address} уже в Watchlist для пользователя {item.telegram_user_id}"
+                )
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Кошелек {item.address} уже в Watchlist для пользователя {item.telegram_user_id}",
                 )
-                if link:
-                    logger.warning(
-                        f"Попытка повторного добавления: Кошелек {item.address} уже в Watchlist для пользователя {item.telegram_user_id}"
-                    )
-                    raise HTTPException(
-                        status_code=409,
-                        detail=f"Кошелек {item.address} уже в Watchlist для пользователя {item.telegram_user_id}",
-                    )
 
-            # Открываем транзакцию только после проверки отсутствия ссылки
-            async with session.begin():
+            # Открываем пишущую транзакцию только после проверки отсутствия ссылки
+            async with write_lock(), session.begin():
                 if not user:
                     logger.info(
                         f"Создание нового пользователя: telegram_id={item.telegram_user_id}, username='{item.username}'"
@@ -608,9 +1076,12 @@ async def add_wallet_to_user_watchlist(item: AddWalletRequest):
 
                 if not wallet:
                     logger.info(f"Создание нового кошелька: address='{item.address}'")
-                    wallet = Wallet(address=item.address)
+                    account_ids = await intern_accounts(session, [item.address])
+                    wallet = Wallet(address=item.address, account_id=account_ids[item.address])
                     session.add(wallet)
                     await session.flush()
+                    # Полная история нового кошелька догружается фоном (api.backfill)
+                    await create_backfill_jobs(session, [wallet.id])
 
                 # Повторная проверка на случай гонки добавлений
                 link = await session.scalar(
@@ -697,7 +1168,7 @@ async def update_wallet_label_api(address: str, item: UpdateWalletLabelRequest):
         if not user:
             raise HTTPException(status_code=404, detail=f"Пользователь с ID {item.telegram_user_id} не найден")
 
-        wallet = await session.scalar(select(Wallet).where(Wallet.address == address))
+        wallet = await session.scalar(select(Wallet).where(_wallet_address_clause(address)))
         if not wallet:
             # Обычно, если пользователь редактирует метку, кошелек уже должен быть в системе.
             # Если нет, то это ошибка данных или UI.
@@ -721,7 +1192,8 @@ async def update_wallet_label_api(address: str, item: UpdateWalletLabelRequest):
             updated_fields = True
 
         if updated_fields:
-            await session.commit()
+            async with write_lock():
+                await session.commit()
             await session.refresh(user_wallet)  # Обновить данные из БД
             return {
                 "message": "Метка/группа кошелька успешно обновлена",
@@ -738,218 +1210,304 @@ async def update_wallet_label_api(address: str, item: UpdateWalletLabelRequest):
             }
 
 
-@router.get(
-    "/{address}/history",
-    response_model=List[EventResponse],
-    summary="Получить историю транзакций кошелька (через TonAPI)",
-)
-async def get_wallet_history_from_tonapi(address: str, limit: int = Query(5, ge=1, le=50)):
+def parse_event(event: dict, address: str) -> dict:
     """
-    Получает историю событий (операций) для заданного адреса кошелька,
-    используя TonAPI. Возвращает массив событий,
-    каждое событие содержит список actions с расширенными полями.
+    Событие TonAPI (ответ /accounts/{id}/events или сохранённое в БД) в формате EventResponse:
+    actions с расширенными полями. is_send определяется по аккаунту, а не по строке адреса.
     """
-    if not TONAPI_KEY:
-        raise HTTPException(status_code=500, detail="TONAPI_KEY не установлен в окружении.")
+    wallet = parse_address(address)
+
+    def is_wallet(addr: Optional[str]) -> bool:
+        return bool(addr) and (parse_address(addr) == wallet if wallet else addr == address)
+
+    event_info = {
+        "timestamp": event.get("timestamp"),
+        "event_id": event.get("event_id"),
+        "is_scam": event.get("is_scam", False),
+        "lt": event.get("lt", 0),
+        "actions": [],
+    }
+
+    for action in event.get("actions", []):
+        action_type = action.get("type")
+        status = action.get("status")  # "ok" или "failed"
+        simple_preview = action.get("simple_preview") or action.get("simplePreview", {})
+        action_details = {
+            "type": action_type,
+            "status": status,
+            "description": simple_preview.get("description", ""),
+        }
 
-    url = f"{TONAPI_BASE_URL}/accounts/{address}/events?limit={limit}"
-    response = await fetch_from_tonapi(url)
+        # === Уже существующие ветки ===
+        if action_type == "TonTransfer":
+            transfer = action.get("TonTransfer", {})
+            sender_addr = transfer.get("sender", {}).get("address")
+            recipient_addr = transfer.get("recipient", {}).get("address")
+            raw_amount = transfer.get("amount", 0) or 0
+            try:
+                amount_ton = int(raw_amount) / 1_000_000_000
+            except (ValueError, TypeError):
+                amount_ton = 0.0
+
+            action_details.update(
+                {
+                    "sender": sender_addr,
+                    "recipient": recipient_addr,
+                    "amount_ton": amount_ton,
+                    "comment": transfer.get("comment"),
+                    "is_send": is_wallet(sender_addr),
+                }
+            )
 
-    data = response.json()
-    events = data.get("events", [])
-    parsed_transactions = []
+        elif action_type == "JettonTransfer":
+            transfer = action.get("JettonTransfer", {})
+            sender_addr = transfer.get("sender", {}).get("address")
+            recipient_addr = transfer.get("recipient", {}).get("address")
+            jetton_info = transfer.get("jetton", {})
+            decimals = int(jetton_info.get("decimals", 9) or 9)
+            try:
+                amount_jetton = int(transfer.get("amount", 0)) / (10**decimals)
+            except (ValueError, TypeError):
+                amount_jetton = 0.0
+
+            action_details.update(
+                {
+                    "sender": sender_addr,
+                    "recipient": recipient_addr,
+                    "amount": amount_jetton,
+                    "jetton_symbol": jetton_info.get("symbol", "Unknown Jetton"),
+                    "jetton_name": jetton_info.get("name", ""),
+                    "jetton_address": jetton_info.get("address"),
+                    "jetton_image": jetton_info.get("metadata", {}).get("image")
+                    or jetton_info.get("metadata", {}).get("logo"),
+                    "is_send": is_wallet(sender_addr),
+                }
+            )
 
-    for event in events:
-        event_info = {
-            "timestamp": event.get("timestamp"),
-            "event_id": event.get("event_id"),
-            "is_scam": event.get("is_scam", False),
-            "lt": event.get("lt", 0),
-            "actions": [],
-        }
+        # --- Обработка NFT Transfer (пример) ---
+        elif action_type in ("NFT Transfer", "NftTransfer", "NftItemTransfer"):
+            # TON API может использовать разные структуры
+            nft_transfer = action.get("NftItemTransfer") or action.get("NftTransfer", {})
+            sender_addr = nft_transfer.get("sender", {}).get("address")
+            recipient_addr = nft_transfer.get("recipient", {}).get("address")
+            nft_metadata = nft_transfer.get("nft", {}) or nft_transfer.get("item", {})
+            action_details.update(
+                {
+                    "sender": sender_addr,
+                    "recipient": recipient_addr,
+                    "nft_address": nft_metadata.get("address"),
+                    "nft_name": nft_metadata.get("metadata", {}).get("name", ""),
+                    "is_send": is_wallet(sender_addr),
+                }
+            )
 
-        for action in event.get("actions", []):
-            action_type = action.get("type")
-            status = action.get("status")  # "ok" или "failed"
-            simple_preview = action.get("simple_preview") or action.get("simplePreview", {})
-            action_details = {
-                "type": action_type,
-                "status": status,
-                "description": simple_preview.get("description", ""),
-            }
+        # --- Обработка Swap (пример) ---
+        elif action_type == "Swap":
+            swap_data = action.get("Swap", {})
+            dex = swap_data.get("dex")
+            amount_in_str = swap_data.get("amount_in", "0")
+            amount_out_str = swap_data.get("amount_out", "0")
+            asset_in_info = swap_data.get("asset_in")
+            asset_out_info = swap_data.get("asset_out")
+
+            def parse_asset(asset_info, raw_amount_str):
+                # Если это строка "ton" или объект для Jetton
+                if isinstance(asset_info, str) and asset_info.lower() == "ton":
+                    try:
+                        a = int(raw_amount_str) / 1e9
+                    except (ValueError, TypeError):
+                        a = 0.0
+                    return ("TON", a, None, None)
+                elif isinstance(asset_info, dict):
+                    dec = int(asset_info.get("decimals", 9) or 9)
+                    try:
+                        a = int(raw_amount_str) / (10**dec)
+                    except (ValueError, TypeError):
+                        a = 0.0
+                    return (
+                        asset_info.get("symbol", "JETTON"),
+                        a,
+                        asset_info.get("address"),
+                        asset_info.get("metadata", {}).get("image"),
+                    )
+                else:
+                    return (None, 0.0, None, None)
 
-            # === Уже существующие ветки ===
-            if action_type == "TonTransfer":
-                transfer = action.get("TonTransfer", {})
-                sender_addr = transfer.get("sender", {}).get("address")
-                recipient_addr = transfer.get("recipient", {}).get("address")
-                raw_amount = transfer.get("amount", 0) or 0
-                try:
-                    amount_ton = int(raw_amount) / 1_000_000_000
-                except (ValueError, TypeError):
-                    amount_ton = 0.0
-
-                action_details.update(
-                    {
-                        "sender": sender_addr,
-                        "recipient": recipient_addr,
-                        "amount_ton": amount_ton,
-                        "comment": transfer.get("comment"),
-                        "is_send": (sender_addr == address) if sender_addr else False,
-                    }
-                )
+            asset_in_symbol, amount_in, jetton_in_addr, jetton_in_img = parse_asset(asset_in_info, amount_in_str)
+            asset_out_symbol, amount_out, jetton_out_addr, jetton_out_img = parse_asset(
+                asset_out_info, amount_out_str
+            )
 
-            elif action_type == "JettonTransfer":
-                transfer = action.get("JettonTransfer", {})
-                sender_addr = transfer.get("sender", {}).get("address")
-                recipient_addr = transfer.get("recipient", {}).get("address")
-                jetton_info = transfer.get("jetton", {})
-                decimals = int(jetton_info.get("decimals", 9) or 9)
-                try:
-                    amount_jetton = int(transfer.get("amount", 0)) / (10**decimals)
-                except (ValueError, TypeError):
-                    amount_jetton = 0.0
-
-                action_details.update(
-                    {
-                        "sender": sender_addr,
-                        "recipient": recipient_addr,
-                        "amount": amount_jetton,
-                        "jetton_symbol": jetton_info.get("symbol", "Unknown Jetton"),
-                        "jetton_name": jetton_info.get("name", ""),
-                        "jetton_address": jetton_info.get("address"),
-                        "jetton_image": jetton_info.get("metadata", {}).get("image")
-                        or jetton_info.get("metadata", {}).get("logo"),
-                        "is_send": (sender_addr == address) if sender_addr else False,
-                    }
-                )
+            action_details.update(
+                {
+                    "dex": dex,
+                    "amount_in": amount_in,
+                    "asset_in": asset_in_symbol,
+                    "asset_in_address": jetton_in_addr,
+                    "asset_in_image": jetton_in_img,
+                    "amount_out": amount_out,
+                    "asset_out": asset_out_symbol,
+                    "asset_out_address": jetton_out_addr,
+                    "asset_out_image": jetton_out_img,
+                    "is_send": True,  # По Swap нет смысла «send/receive» – можно определить по direction
+                }
+            )
 
-            # --- Обработка NFT Transfer (пример) ---
-            elif action_type in ("NFT Transfer", "NftTransfer", "NftItemTransfer"):
-                # TON API может использовать разные структуры
-                nft_transfer = action.get("NftItemTransfer") or action.get("NftTransfer", {})
-                sender_addr = nft_transfer.get("sender", {}).get("address")
-                recipient_addr = nft_transfer.get("recipient", {}).get("address")
-                nft_metadata = nft_transfer.get("nft", {}) or nft_transfer.get("item", {})
-                action_details.update(
-                    {
-                        "sender": sender_addr,
-                        "recipient": recipient_addr,
-                        "nft_address": nft_metadata.get("address"),
-                        "nft_name": nft_metadata.get("metadata", {}).get("name", ""),
-                        "is_send": (sender_addr == address) if sender_addr else False,
-                    }
-                )
+            # ==== ЗДЕСЬ НУЖНО ДОБАВИТЬ НОВУЮ ВЕТКУ ДЛЯ JettonSwap ====
+        elif action_type == "JettonSwap":
+            swap = action.get("JettonSwap", {})
 
-            # --- Обработка Swap (пример) ---
-            elif action_type == "Swap":
-                swap_data = action.get("Swap", {})
-                dex = swap_data.get("dex")
-                amount_in_str = swap_data.get("amount_in", "0")
-                amount_out_str = swap_data.get("amount_out", "0")
-                asset_in_info = swap_data.get("asset_in")
-                asset_out_info = swap_data.get("asset_out")
-
-                def parse_asset(asset_info, raw_amount_str):
-                    # Если это строка "ton" или объект для Jetton
-                    if isinstance(asset_info, str) and asset_info.lower() == "ton":
-                        try:
-                            a = int(raw_amount_str) / 1e9
-                        except (ValueError, TypeError):
-                            a = 0.0
-                        return ("TON", a, None, None)
-                    elif isinstance(asset_info, dict):
-                        dec = int(asset_info.get("decimals", 9) or 9)
-                        try:
-                            a = int(raw_amount_str) / (10**dec)
-                        except (ValueError, TypeError):
-                            a = 0.0
-                        return (
-                            asset_info.get("symbol", "JETTON"),
-                            a,
-                            asset_info.get("address"),
-                            asset_info.get("metadata", {}).get("image"),
-                        )
-                    else:
-                        return (None, 0.0, None, None)
+            # 1) сколько TON ушло (в "нанотонах"):
+            raw_ton_in = swap.get("ton_in", 0) or 0
+            try:
+                ton_in = int(raw_ton_in) / 1_000_000_000
+            except (ValueError, TypeError):
+                ton_in = 0.0
+
+            # 2) сколько джеттона пришло (amount_out в минимальных единицах):
+            jm_out = swap.get("jetton_master_out", {})
+            raw_amt_out = swap.get("amount_out", "0") or "0"
+            decimals = int(jm_out.get("decimals", 9) or 9)
+            try:
+                jetton_amount = int(raw_amt_out) / (10**decimals)
+            except (ValueError, TypeError):
+                jetton_amount = 0.0
+
+            # 3) символ, имя и картинка джеттона
+            jetton_symbol = jm_out.get("symbol", "")
+            jetton_name = jm_out.get("name", "")
+            jetton_address = jm_out.get("address", "")
+            # TonAPI часто кладёт картинку токена в поле image или в metadata.image
+            jetton_image = (
+                jm_out.get("image")
+                or jm_out.get("metadata", {}).get("image")
+                or jm_out.get("metadata", {}).get("logo")
+            )
 
-                asset_in_symbol, amount_in, jetton_in_addr, jetton_in_img = parse_asset(asset_in_info, amount_in_str)
-                asset_out_symbol, amount_out, jetton_out_addr, jetton_out_img = parse_asset(
-                    asset_out_info, amount_out_str
-                )
+            # 4) DEX, через который шел swap (router name)
+            router_info = swap.get("router", {})
+            dex_name = router_info.get("name", "")
+
+            action_details.update(
+                {
+                    "ton_in": ton_in,
+                    "amount_out": jetton_amount,
+                    "jetton_symbol": jetton_symbol,
+                    "jetton_name": jetton_name,
+                    "jetton_address": jetton_address,
+                    "jetton_image": jetton_image,
+                    "dex": dex_name,
+                    # Признак swap-операции, чтобы фронтенд легче идентифицировал:
+                    "is_swap": True,
+                }
+            )
+        # --- Остальные типы действий просто ложим в raw_data ---
+        else:
+            action_details["raw_data"] = simple_preview
 
-                action_details.update(
-                    {
-                        "dex": dex,
-                        "amount_in": amount_in,
-                        "asset_in": asset_in_symbol,
-                        "asset_in_address": jetton_in_addr,
-                        "asset_in_image": jetton_in_img,
-                        "amount_out": amount_out,
-                        "asset_out": asset_out_symbol,
-                        "asset_out_address": jetton_out_addr,
-                        "asset_out_image": jetton_out_img,
-                        "is_send": True,  # По Swap нет смысла «send/receive» – можно определить по direction
-                    }
-                )
+        # Добавляем action_details только если есть развёрнутые поля
+        event_info["actions"].append(action_details)
 
-                # ==== ЗДЕСЬ НУЖНО ДОБАВИТЬ НОВУЮ ВЕТКУ ДЛЯ JettonSwap ====
-            elif action_type == "JettonSwap":
-                swap = action.get("JettonSwap", {})
-
-                # 1) сколько TON ушло (в "нанотонах"):
-                raw_ton_in = swap.get("ton_in", 0) or 0
-                try:
-                    ton_in = int(raw_ton_in) / 1_000_000_000
-                except (ValueError, TypeError):
-                    ton_in = 0.0
-
-                # 2) сколько джеттона пришло (amount_out в минимальных единицах):
-                jm_out = swap.get("jetton_master_out", {})
-                raw_amt_out = swap.get("amount_out", "0") or "0"
-                decimals = int(jm_out.get("decimals", 9) or 9)
-                try:
-                    jetton_amount = int(raw_amt_out) / (10**decimals)
-                except (ValueError, TypeError):
-                    jetton_amount = 0.0
-
-                # 3) символ, имя и картинка джеттона
-                jetton_symbol = jm_out.get("symbol", "")
-                jetton_name = jm_out.get("name", "")
-                jetton_address = jm_out.get("address", "")
-                # TonAPI часто кладёт картинку токена в поле image или в metadata.image
-                jetton_image = (
-                    jm_out.get("image")
-                    or jm_out.get("metadata", {}).get("image")
-                    or jm_out.get("metadata", {}).get("logo")
-                )
+    return event_info
+
+
+async def _tonapi_history(address: str, limit: int, before_lt: Optional[int] = None) -> list[dict]:
+    """Страница событий аккаунта из TonAPI (от новых к старым, lt < before_lt) в формате EventResponse."""
+    if not TONAPI_KEY:
+        raise HTTPException(status_code=500, detail="TONAPI_KEY не установлен в окружении.")
+    params = {"limit": limit}
+    if before_lt is not None:
+        params["before_lt"] = before_lt
+    response = await fetch_from_tonapi(f"/accounts/{address}/events", params=params)
+    return [parse_event(event, address) for event in response.json().get("events", [])]
+
+
+def _parse_history_cursor(cursor: Optional[str]) -> tuple[Optional[int], Optional[int]]:
+    """Курсор истории "<lt>_<timestamp>" (непрозрачен для клиента) -> (before_lt, before_ts)."""
+    if not cursor:
+        return None, None
+    lt, _, timestamp = cursor.partition("_")
+    try:
+        return int(lt), int(timestamp) if timestamp else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
 
-                # 4) DEX, через который шел swap (router name)
-                router_info = swap.get("router", {})
-                dex_name = router_info.get("name", "")
-
-                action_details.update(
-                    {
-                        "ton_in": ton_in,
-                        "amount_out": jetton_amount,
-                        "jetton_symbol": jetton_symbol,
-                        "jetton_name": jetton_name,
-                        "jetton_address": jetton_address,
-                        "jetton_image": jetton_image,
-                        "dex": dex_name,
-                        # Признак swap-операции, чтобы фронтенд легче идентифицировал:
-                        "is_swap": True,
-                    }
-                )
-            # --- Остальные типы действий просто ложим в raw_data ---
-            else:
-                action_details["raw_data"] = simple_preview
 
-            # Добавляем action_details только если есть развёрнутые поля
-            event_info["actions"].append(action_details)
+def _stored_event(row: dict) -> dict:
+    """Строка хранилища или архива в формате события TonAPI (для parse_event)."""
+    return {
+        "event_id": row["event_id"],
+        "lt": row["lt"],
+        "timestamp": row["timestamp"],
+        "is_scam": bool(row["is_scam_event"]),
+        "actions": decode_actions(row["actions_json"]),
+    }
 
-        # Если в событии вообще нет ни одного action, пропускаем:
-        if event_info["actions"]:
-            parsed_transactions.append(event_info)
 
-    return parsed_transactions
+@router.get(
+    "/{address}/history",
+    response_model=HistoryPage,
+    summary="Получить историю транзакций кошелька",
+)
+async def get_wallet_history(
+    address: str,
+    limit: int = Query(5, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+):
+    """
+    История событий кошелька от новых к старым, страницами с keyset-пагинацией по lt:
+    следующая страница запрашивается с cursor=next_cursor, стоимость страницы не зависит от глубины.
+
+    События читаются из локального хранилища (wallet_events, индекс ix_wallet_events_wallet_lt),
+    затем из Parquet-архива. TonAPI запрашивается только для диапазонов, которых локально нет:
+    кошелёк не отслеживается или ещё не синхронизирован, либо полная история ещё не догружена
+    (api.backfill), а локальные события закончились.
+    """
+    before_lt, before_ts = _parse_history_cursor(cursor)
+
+    async with async_session() as session:
+        wallet = await session.scalar(select(Wallet).where(_wallet_address_clause(address)))
+        history_loaded = False
+        rows = []
+        if wallet is not None and wallet.last_synced_at is not None:
+            stmt = (
+                select(
+                    Transaction.event_id,
+                    WalletEvent.lt,
+                    WalletEvent.timestamp,
+                    Transaction.is_scam_event,
+                    Transaction.actions_json,
+                )
+                .join(Transaction, Transaction.id == WalletEvent.transaction_id)
+                .where(WalletEvent.wallet_id == wallet.id)
+                .order_by(WalletEvent.lt.desc())
+                .limit(limit)
+            )
+            if before_lt is not None:
+                stmt = stmt.where(WalletEvent.lt < before_lt)
+            rows = [dict(row._mapping) for row in await session.execute(stmt)]
+            job_status = await session.scalar(select(BackfillJob.status).where(BackfillJob.wallet_id == wallet.id))
+            history_loaded = job_status == "done"
+
+    await load_codec_dictionaries(row["actions_json"] for row in rows)
+    events = [parse_event(_stored_event(row), address) for row in rows]
+    if wallet is not None and len(events) < limit:
+        # Хранилище закончилось — более старые события могли уйти в архив
+        last = rows[-1] if rows else None
+        archived = await read_archived_page(
+            wallet.id,
+            last["lt"] if last else before_lt,
+            last["timestamp"] if last else before_ts,
+            limit - len(events),
+        )
+        await load_codec_dictionaries(row["actions_json"] for row in archived)
+        events.extend(parse_event(_stored_event(row), address) for row in archived)
+    if len(events) < limit and not history_loaded:
+        # Диапазона нет локально: кошелёк не отслеживается, не синхронизирован или история не догружена
+        tonapi_before = events[-1]["lt"] if events else before_lt
+        events.extend(await _tonapi_history(address, limit - len(events), tonapi_before))
+
+    next_cursor = None
+    if len(events) >= limit:
+        next_cursor = f"{events[-1]['lt']}_{events[-1]['timestamp']}"
+    return HistoryPage(events=[event for event in events if event["actions"]], next_cursor=next_cursor)
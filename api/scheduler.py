@@ -1,17 +1,31 @@
 # api/scheduler.py
-import json
+import asyncio
 import os
+import time
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 import logging
-import httpx  # Для запросов к TonAPI
-from datetime import datetime, timedelta
+import httpx  # Для обработки ошибок TonAPI
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
 
 # Импорты из вашего проекта
-from db.db_init import async_session
-from db.models import Wallet, Transaction
-from sqlalchemy import select, update
+from db.db_init import async_session, write_session
+from db.models import Wallet, UserWallet, WalletEvent
+from db.ingest import store_events
+from sqlalchemy import select, update, func
+from core.tonapi import TONAPI_KEY, get_tonapi_client
+from core.ratelimit import TONAPI_RPS
+from core.polling import (
+    PollingQueue,
+    compute_poll_interval,
+    update_activity_rate,
+    POLL_ERROR_BACKOFF_SECONDS,
+)
+from .backfill import scheduled_backfill, BACKFILL_INTERVAL_SECONDS
+from .balances import scheduled_balance_refresh, BALANCE_REFRESH_MINUTES
+from .archive import scheduled_archive, ARCHIVE_AFTER_DAYS, ARCHIVE_DAY_OF_WEEK, ARCHIVE_HOUR
 
 
 load_dotenv()
@@ -20,111 +34,163 @@ load_dotenv()
 logger = logging.getLogger("api.scheduler")
 # logging.basicConfig(level=logging.INFO) # Уже должно быть настроено в main.py или wallets.py
 
-TONAPI_BASE_URL = "https://tonapi.io/v2"  # Перенести в конфиг или .env если нужно
-TONAPI_KEY = os.getenv("TONAPI_KEY")  # Убедитесь, что TONAPI_KEY доступен
+# Параметры пула обновления: воркеры делят один token bucket (core.ratelimit),
+# так что их число определяет только степень параллелизма, а не RPS.
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+# Как часто планировщик проверяет очередь (core.polling) на кошельки, которым пора обновиться.
+# Сами интервалы обновления у каждого кошелька свои — от активности и числа наблюдателей.
+POLL_TICK_SECONDS = int(os.getenv("POLL_TICK_SECONDS", "30"))
+# Инкрементальная синхронизация: размер страницы событий TonAPI (макс. 100)
+# и предел страниц за один проход, чтобы догнать курсор после долгого простоя
+SYNC_PAGE_LIMIT = int(os.getenv("SYNC_PAGE_LIMIT", "25"))
+SYNC_MAX_PAGES = int(os.getenv("SYNC_MAX_PAGES", "10"))
+# Как часто (в кошельках) писать прогресс прохода в лог
+SWEEP_PROGRESS_EVERY = int(os.getenv("SWEEP_PROGRESS_EVERY", "50"))
+
+# Статистика последнего прохода планировщика (для логов/диагностики)
+last_sweep_stats: dict = {}
+# Пока идёт проход live-обновления, догрузка истории ставится на паузу
+sweep_in_progress = False
+
+# Очередь кошельков по времени следующего обновления. Заполняется из БД при первом проходе,
+# дальше пополняется только новыми кошельками (next_sync_at IS NULL) и перепланированием.
+polling_queue = PollingQueue()
+_polling_queue_loaded = False
+# Результат обновления кошелька, удалённого из БД после постановки в очередь: он не перепланируется
+WALLET_REMOVED = object()
 
 
 # --- Функции для выполнения задач ---
 
 
+async def fetch_new_events(wallet_address: str, cursor_lt: Optional[int]) -> list[dict]:
+    """
+    Листает события кошелька от самых новых назад (before_lt), пока не дойдёт
+    до курсора `cursor_lt` — т.е. до последнего уже синхронизированного события.
+    Возвращает события с lt >= cursor_lt (граничное событие остаётся для дедупликации).
+
+    Без курсора (первая синхронизация) берётся только первая страница:
+    полная история — задача отдельной догрузки, а не планового обновления.
+    """
+    tonapi = get_tonapi_client()  # Общий пул соединений (core.tonapi), RPS ограничивается внутри
+    collected: list[dict] = []
+    before_lt = None
+
+    for page in range(1, SYNC_MAX_PAGES + 1):
+        params = {"limit": SYNC_PAGE_LIMIT}
+        if before_lt is not None:
+            params["before_lt"] = before_lt
+        response = await tonapi.get(f"/accounts/{wallet_address}/events", params=params)
+        events = response.json().get("events", [])
+        if not events:
+            return collected
+
+        caught_up = False
+        for event in events:
+            if cursor_lt is not None and int(event.get("lt", 0)) < cursor_lt:
+                caught_up = True
+                continue
+            collected.append(event)
+
+        if cursor_lt is None or caught_up or len(events) < SYNC_PAGE_LIMIT:
+            return collected
+        before_lt = min(int(event.get("lt", 0)) for event in events)
+
+    logger.warning(
+        f"{wallet_address}: за {SYNC_MAX_PAGES} страниц не удалось дойти до курсора lt={cursor_lt}, "
+        f"часть событий между проходами могла быть пропущена (увеличьте SYNC_MAX_PAGES)."
+    )
+    return collected
+
+
 async def fetch_and_store_wallet_activity(wallet_id: int, wallet_address: str):
     """
     Запрашивает активность (события/транзакции) для одного кошелька из TonAPI
     и сохраняет новые транзакции в локальную БД.
-    Обновляет метаданные кошелька (last_activity_ts, total_tx_count).
+
+    Синхронизация инкрементальная: на кошельке хранится курсор (lt и event_id
+    последнего сохранённого события), из TonAPI дочитываются только события новее него,
+    а дубликаты отбрасываются при вставке (db.ingest.store_events).
+    Баланс здесь не запрашивается — он обновляется пачками отдельной задачей (api.balances).
+    Обновляет метаданные кошелька (last_activity_ts, курсор синхронизации) и
+    планирует следующее обновление по его активности и числу наблюдателей (core.polling).
+    Возвращает время следующего обновления (UTC) при успехе, None при ошибке
+    и WALLET_REMOVED, если кошелька уже нет в БД.
     """
     if not TONAPI_KEY:
         logger.error(f"TONAPI_KEY не установлен. Пропуск обновления для {wallet_address}")
-        return
+        return None
 
     logger.info(f"Обновление активности для кошелька {wallet_address} (ID: {wallet_id})")
-    headers = {"Authorization": f"Bearer {TONAPI_KEY}"}
-    # Запрашиваем достаточное количество событий, чтобы покрыть период с последнего обновления
-    # Можно использовать before_lt из последней сохраненной транзакции, но это усложнит первый запрос
-    # Пока запрашиваем N последних, а потом фильтруем по event_id
-    events_limit = 25  # Сколько событий запрашивать за раз
-
-    url = f"{TONAPI_BASE_URL}/accounts/{wallet_address}/events?limit={events_limit}"
-
-    new_transactions_count = 0
-    latest_event_ts = None
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            events = data.get("events", [])
-
-        if not events:
-            logger.info(f"Нет новых событий для {wallet_address}")
-            # Обновим время последней проверки баланса/активности, даже если событий нет
-            async with async_session() as session:
-                async with session.begin():
-                    await session.execute(
-                        update(Wallet)
-                        .where(Wallet.id == wallet_id)
-                        .values(last_balance_updated_at=datetime.utcnow())  # Обновляем как время проверки
-                    )
-            return
-
         async with async_session() as session:
-            async with session.begin():
-                # Получаем существующие event_ids для этого кошелька, чтобы не дублировать
-                existing_event_ids_result = await session.execute(
-                    select(Transaction.event_id).where(Transaction.wallet_id == wallet_id)
+            wallet_state = (
+                await session.execute(
+                    select(
+                        # Кошельки без курсора (синхронизированные до его появления) продолжают
+                        # с максимального сохранённого lt — covering-индекс ix_wallet_events_wallet_lt
+                        func.coalesce(
+                            Wallet.sync_cursor_lt,
+                            select(func.max(WalletEvent.lt)).where(WalletEvent.wallet_id == Wallet.id).scalar_subquery(),
+                        ).label("sync_cursor_lt"),
+                        Wallet.last_synced_at,
+                        Wallet.last_activity_ts,
+                        Wallet.activity_rate,
+                        select(func.count(UserWallet.id))
+                        .where(UserWallet.wallet_id == Wallet.id)
+                        .scalar_subquery()
+                        .label("watchers"),
+                    ).where(Wallet.id == wallet_id)
                 )
-                existing_event_ids = {row[0] for row in existing_event_ids_result}
-
-                parsed_transactions_to_add = []
-                for event in events:
-                    event_id = event.get("event_id")
-                    if event_id in existing_event_ids:
-                        continue  # Пропускаем уже сохраненное событие
-
-                    # Обновляем latest_event_ts для данного кошелька
-                    if latest_event_ts is None or event.get("timestamp", 0) > latest_event_ts:
-                        latest_event_ts = event.get("timestamp", 0)
-
-                    parsed_transactions_to_add.append(
-                        Transaction(
-                            wallet_id=wallet_id,
-                            event_id=event_id,
-                            lt=event.get("lt"),
-                            timestamp=event.get("timestamp"),
-                            is_scam_event=event.get("is_scam", False),
-                            actions_json=json.dumps(event.get("actions", [])),  # Сохраняем actions как JSON строку
-                        )
-                    )
-                    new_transactions_count += 1
-
-                if parsed_transactions_to_add:
-                    session.add_all(parsed_transactions_to_add)
-                    logger.info(f"Сохранено {new_transactions_count} новых транзакций для {wallet_address}")
-
-                # Обновляем метаданные кошелька
-                wallet_update_values = {
-                    "last_balance_updated_at": datetime.utcnow()
-                }  # Время последней успешной проверки
-                if latest_event_ts:
-                    wallet_update_values["last_activity_ts"] = latest_event_ts
-
-                # Запрос общего количества транзакций (может быть неточным если событий > лимита)
-                # Более точный способ - запросить /accounts/{account_id} и взять оттуда stats.tx_count
-                # Пока оставим так или запросим отдельно.
-                # Для примера, можно запросить account info:
-                account_info_url = f"{TONAPI_BASE_URL}/accounts/{wallet_address}"
-                acc_resp = await client.get(account_info_url, headers=headers)
-                if acc_resp.status_code == 200:
-                    acc_data = acc_resp.json()
-                    wallet_update_values["last_balance_ton"] = int(acc_data.get("balance", 0))  # nanoTONs
-                    # wallet_update_values["total_tx_count"] = acc_data.get("stats", {}).get("tx_count", 0) # Если TonAPI предоставляет
-                    if not wallet_update_values.get("last_activity_ts") and acc_data.get("last_activity"):
-                        wallet_update_values["last_activity_ts"] = acc_data.get("last_activity")
-                    if acc_data.get("is_scam") is not None:
-                        wallet_update_values["is_scam"] = acc_data.get("is_scam")
-
-                await session.execute(update(Wallet).where(Wallet.id == wallet_id).values(**wallet_update_values))
+            ).one_or_none()
+        if wallet_state is None:
+            logger.info(f"Кошелёк {wallet_address} (ID: {wallet_id}) удалён, снимаем его с очереди обновления")
+            return WALLET_REMOVED
+        cursor_lt = wallet_state.sync_cursor_lt
+
+        events = await fetch_new_events(wallet_address, cursor_lt)
+        newest_event = max(events, key=lambda ev: int(ev.get("lt", 0)), default=None)
+
+        # Активность кошелька: сколько событий появилось после курсора с прошлого обновления
+        now = datetime.utcnow()
+        activity_rate = wallet_state.activity_rate
+        if cursor_lt is not None and wallet_state.last_synced_at is not None:
+            fresh_events = sum(1 for event in events if int(event.get("lt", 0)) > cursor_lt)
+            elapsed = (now - wallet_state.last_synced_at).total_seconds()
+            activity_rate = update_activity_rate(activity_rate, fresh_events, elapsed)
+
+        async with write_session() as session:
+            # Дубликаты (граничное событие курсора, параллельный запрос) отбрасываются самой БД
+            # через ON CONFLICT DO NOTHING; событие, уже записанное другим кошельком, только связывается с этим
+            new_transactions_count = await store_events(session, wallet_id, events, wallet_address)
+
+            # Обновляем метаданные кошелька
+            wallet_update_values = {
+                "last_synced_at": now,  # Время последней успешной проверки
+                "activity_rate": activity_rate,
+            }
+            last_activity_ts = wallet_state.last_activity_ts
+
+            if not new_transactions_count:
+                logger.info(f"Нет новых событий для {wallet_address}")
+            else:
+                logger.info(f"Сохранено {new_transactions_count} новых транзакций для {wallet_address}")
+                last_activity_ts = newest_event.get("timestamp")
+                wallet_update_values["last_activity_ts"] = last_activity_ts
+
+            if newest_event is not None:
+                wallet_update_values["sync_cursor_lt"] = int(newest_event.get("lt", 0))
+                wallet_update_values["sync_cursor_event_id"] = newest_event.get("event_id")
+
+            interval = compute_poll_interval(
+                activity_rate, wallet_state.watchers, last_activity_ts, now.replace(tzinfo=timezone.utc).timestamp()
+            )
+            next_sync_at = now + timedelta(seconds=interval)
+            wallet_update_values["next_sync_at"] = next_sync_at
+
+            await session.execute(update(Wallet).where(Wallet.id == wallet_id).values(**wallet_update_values))
+        return next_sync_at
 
     except httpx.HTTPStatusError as e:
         logger.error(
@@ -134,40 +200,156 @@ async def fetch_and_store_wallet_activity(wallet_id: int, wallet_address: str):
         logger.error(
             f"Непредвиденная ошибка при обновлении {wallet_address} (ID: {wallet_id}): {str(e)}", exc_info=True
         )
+    return None
+
+
+class SweepProgress:
+    """Счётчики одного прохода планировщика, общие для всех воркеров."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def as_dict(self) -> dict:
+        elapsed = self.elapsed()
+        return {
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "elapsed_sec": round(elapsed, 1),
+            "wallets_per_sec": round(self.done / elapsed, 2) if elapsed > 0 else 0.0,
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+
+    def log(self) -> None:
+        processed = self.done + self.failed
+        elapsed = self.elapsed()
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - processed) / rate if rate > 0 else 0.0
+        logger.info(
+            f"Прогресс обновления: {processed}/{self.total} (ошибок: {self.failed}), "
+            f"{rate:.2f} кош./с, прошло {elapsed:.0f} с, осталось ~{eta:.0f} с"
+        )
 
 
-async def scheduled_wallet_updates():
+async def _refresh_worker(
+    worker_no: int, queue: asyncio.Queue, progress: SweepProgress, on_result: Optional[Callable] = None
+):
+    """
+    Воркер пула: берёт кошельки из очереди, пока она не опустеет.
+    `on_result(wallet_id, address, next_sync_at)` вызывается после каждого кошелька.
+    """
+    while True:
+        try:
+            wallet_id, wallet_address = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            next_sync_at = await fetch_and_store_wallet_activity(wallet_id, wallet_address)
+        except Exception as e:  # Ловим ошибки на уровне отдельного кошелька
+            logger.error(
+                f"Ошибка при обработке кошелька {wallet_address} (воркер {worker_no}): {e}", exc_info=True
+            )
+            next_sync_at = None
+        finally:
+            queue.task_done()
+
+        if next_sync_at:
+            progress.done += 1
+        else:
+            progress.failed += 1
+        if on_result is not None:
+            on_result(wallet_id, wallet_address, next_sync_at)
+        if (progress.done + progress.failed) % SWEEP_PROGRESS_EVERY == 0:
+            progress.log()
+
+
+async def run_refresh_pool(
+    wallets: list[tuple[int, str]], workers: int = SCHEDULER_WORKERS, on_result: Optional[Callable] = None
+) -> SweepProgress:
+    """
+    Обновляет кошельки пулом из `workers` корутин, читающих общую очередь.
+    Частота запросов к TonAPI ограничивается общим tonapi_limiter, поэтому пул
+    выбирает весь доступный RPS, но никогда его не превышает.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in wallets:
+        queue.put_nowait(item)
+
+    progress = SweepProgress(total=len(wallets))
+    pool_size = max(1, min(workers, len(wallets)))
+    await asyncio.gather(*(_refresh_worker(n, queue, progress, on_result) for n in range(pool_size)))
+    return progress
+
+
+def _utc_ts(dt: datetime) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _reschedule(wallet_id: int, wallet_address: str, next_sync_at: Optional[datetime]):
+    """Возвращает кошелёк в очередь: по рассчитанному времени или с backoff после ошибки. Удалённый — убирает."""
+    if next_sync_at is WALLET_REMOVED:
+        polling_queue.discard(wallet_id)
+        return
+    due_ts = _utc_ts(next_sync_at) if next_sync_at else time.time() + POLL_ERROR_BACKOFF_SECONDS
+    polling_queue.push(wallet_id, wallet_address, due_ts)
+
+
+async def _refill_polling_queue():
     """
-    Основная задача планировщика: проходит по всем кошелькам,
-    которые давно не обновлялись, и запускает для них fetch_and_store_wallet_activity.
+    При первом запуске загружает в очередь все кошельки, дальше — только новые
+    (next_sync_at IS NULL, по индексу), не сканируя всю таблицу на каждом тике.
     """
-    logger.info("Запуск планового обновления кошельков...")
+    global _polling_queue_loaded
+    stmt = select(Wallet.id, Wallet.address, Wallet.next_sync_at)
+    if _polling_queue_loaded:
+        stmt = stmt.where(Wallet.next_sync_at.is_(None))
+
     async with async_session() as session:
-        # Выбираем кошельки, которые не обновлялись, например, последние 10 минут
-        # Или все кошельки, если их немного
-        ten_minutes_ago = datetime.utcnow() - timedelta(minutes=10)
+        rows = (await session.execute(stmt)).all()
+    _polling_queue_loaded = True
 
-        wallets_to_update_result = await session.execute(
-            select(Wallet.id, Wallet.address).where(
-                (Wallet.last_balance_updated_at.is_(None)) | (Wallet.last_balance_updated_at < ten_minutes_ago)
-            )
-            # .order_by(Wallet.last_balance_updated_at.asc().nulls_first()) # Обновляем самые старые сначала
-            # .limit(20) # Ограничиваем количество кошельков за один проход, чтобы не перегружать TonAPI
-        )
-        wallets_to_update = wallets_to_update_result.all()
+    now = time.time()
+    for wallet_id, wallet_address, next_sync_at in rows:
+        if wallet_id not in polling_queue:
+            polling_queue.push(wallet_id, wallet_address, _utc_ts(next_sync_at) if next_sync_at else now)
+
+
+async def scheduled_wallet_updates():
+    """
+    Основная задача планировщика: достаёт из очереди (core.polling.PollingQueue)
+    кошельки, которым пора обновиться, и обновляет их пулом воркеров (run_refresh_pool).
+    После обновления каждый кошелёк возвращается в очередь со своим следующим временем.
+    """
+    await _refill_polling_queue()
+    wallets_to_update = polling_queue.pop_due()
 
     if not wallets_to_update:
-        logger.info("Нет кошельков, требующих немедленного обновления.")
+        logger.debug("Нет кошельков, требующих немедленного обновления.")
         return
 
-    logger.info(f"Найдено {len(wallets_to_update)} кошельков для обновления.")
-    for wallet_id, wallet_address in wallets_to_update:
-        try:
-            await fetch_and_store_wallet_activity(wallet_id, wallet_address)
-        except Exception as e:  # Ловим ошибки на уровне отдельного кошелька
-            logger.error(
-                f"Ошибка при обработке кошелька {wallet_address} в scheduled_wallet_updates: {e}", exc_info=True
-            )
+    logger.info(
+        f"Найдено {len(wallets_to_update)} кошельков для обновления из {len(wallets_to_update) + len(polling_queue)} "
+        f"(воркеров: {SCHEDULER_WORKERS}, лимит TonAPI: {TONAPI_RPS} RPS)."
+    )
+    global sweep_in_progress
+    sweep_in_progress = True
+    try:
+        progress = await run_refresh_pool(wallets_to_update, on_result=_reschedule)
+    finally:
+        sweep_in_progress = False
+    progress.log()
+
+    last_sweep_stats.clear()
+    last_sweep_stats.update(progress.as_dict())
+    next_due_ts = polling_queue.next_due_ts()
+    if next_due_ts is not None:
+        logger.info(f"Следующий кошелёк к обновлению через {max(next_due_ts - time.time(), 0):.0f} с")
 
 
 # --- Настройка и запуск планировщика ---
@@ -200,19 +382,54 @@ def init_scheduler():
         logger.warning("TONAPI_KEY не установлен. Фоновые задачи обновления кошельков не будут запущены.")
         return False
 
-    # Добавляем задачу периодического обновления кошельков
-    # Например, каждые 5 минут
+    # Добавляем задачу периодического обновления кошельков:
+    # каждые POLL_TICK_SECONDS секунд обновляются кошельки, чей next_sync_at уже наступил
     scheduler.add_job(
         scheduled_wallet_updates,
         trigger="interval",
-        minutes=5,  # Интервал можно вынести в настройки
+        seconds=POLL_TICK_SECONDS,
         id="periodic_wallet_updates",
         replace_existing=True,
         misfire_grace_time=60,  # Секунд, если задача "пропущена"
+        max_instances=1,  # Новый проход не стартует, пока не закончен предыдущий
+        coalesce=True,  # Пропущенные запуски схлопываются в один
+    )
+
+    # Балансы и is_scam — отдельной задачей, пачками через /accounts/_bulk
+    scheduler.add_job(
+        scheduled_balance_refresh,
+        trigger="interval",
+        minutes=BALANCE_REFRESH_MINUTES,
+        id="balance_refresh",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+
+    # Догрузка полной истории: низкий приоритет, уступает плановому обновлению
+    scheduler.add_job(
+        scheduled_backfill,
+        trigger="interval",
+        seconds=BACKFILL_INTERVAL_SECONDS,
+        kwargs={"should_stop": lambda: sweep_in_progress},
+        id="history_backfill",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
     )
 
-    # Можно добавить другие задачи, например, очистку старых транзакций
-    # scheduler.add_job(cleanup_old_transactions, trigger='cron', day_of_week='sun', hour=3)
+    # Перенос старых транзакций в архив (Parquet): горячая таблица не растёт бесконечно
+    if ARCHIVE_AFTER_DAYS > 0:
+        scheduler.add_job(
+            scheduled_archive,
+            trigger="cron",
+            day_of_week=ARCHIVE_DAY_OF_WEEK,
+            hour=ARCHIVE_HOUR,
+            id="archive_transactions",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
 
     try:
         scheduler.start()
@@ -0,0 +1,135 @@
+# benchmarks/db_profiles.py
+
+"""
+Сравнение пропускной способности профилей БД (db.db_init.create_db_engine).
+
+Для каждого профиля создаётся чистая схема, затем в течение --seconds секунд
+параллельно работают писатели (store_events пачками по --batch событий) и читатели
+(последние 50 транзакций случайного кошелька). Печатается число операций в секунду
+и количество ошибок (например, "database is locked").
+
+    python -m benchmarks.db_profiles --seconds 10 --writers 8 --readers 16
+
+PostgreSQL проверяется, если задан BENCH_POSTGRES_URL (postgresql+asyncpg://...).
+Внимание: таблицы в этой БД будут пересозданы и удалены — используйте отдельную базу.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from db.db_init import create_db_engine, write_lock
+from db.ingest import store_events
+from db.models import Base, Transaction, Wallet, WalletEvent
+
+WALLETS = 20
+
+
+def _event(n: int) -> dict:
+    transfer = {"sender": {"address": "0:a"}, "recipient": {"address": "0:b"}, "amount": n}
+    return {
+        "event_id": f"bench{n}",
+        "lt": 1000 + n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+    }
+
+
+async def _run_profile(name: str, url: str, profile: str, args) -> dict:
+    engine = create_db_engine(url, profile)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    async with session_factory() as session:
+        async with session.begin():
+            session.add_all(Wallet(id=i, address=f"EQbench{i}") for i in range(1, WALLETS + 1))
+
+    # Очередь писателей — часть профиля; в профиле "default" её нет, как и было раньше
+    use_write_lock = profile != "default"
+    counter = itertools.count()
+    stats = {"writes": 0, "reads": 0, "errors": 0}
+    deadline = time.monotonic() + args.seconds
+
+    async def writer():
+        while time.monotonic() < deadline:
+            events = [_event(next(counter)) for _ in range(args.batch)]
+            try:
+                if use_write_lock:
+                    async with write_lock(engine), session_factory() as session, session.begin():
+                        await store_events(session, random.randint(1, WALLETS), events)
+                else:
+                    async with session_factory() as session, session.begin():
+                        await store_events(session, random.randint(1, WALLETS), events)
+                stats["writes"] += 1
+            except Exception:
+                stats["errors"] += 1
+
+    async def reader():
+        while time.monotonic() < deadline:
+            try:
+                async with session_factory() as session:
+                    await session.execute(
+                        select(Transaction.event_id, WalletEvent.timestamp)
+                        .join(WalletEvent, WalletEvent.transaction_id == Transaction.id)
+                        .where(WalletEvent.wallet_id == random.randint(1, WALLETS))
+                        .order_by(WalletEvent.timestamp.desc())
+                        .limit(50)
+                    )
+                stats["reads"] += 1
+            except Exception:
+                stats["errors"] += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(writer() for _ in range(args.writers)), *(reader() for _ in range(args.readers)))
+    elapsed = time.monotonic() - started
+
+    if url.startswith("postgresql"):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+    return {
+        "profile": name,
+        "writes_per_sec": stats["writes"] / elapsed,
+        "events_per_sec": stats["writes"] * args.batch / elapsed,
+        "reads_per_sec": stats["reads"] / elapsed,
+        "errors": stats["errors"],
+    }
+
+
+async def main(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("default", "auto"):
+            url = f"sqlite+aiosqlite:///{Path(tmp) / f'bench_{profile}.db'}"
+            results.append(await _run_profile(f"sqlite/{profile}", url, profile, args))
+
+    pg_url = os.getenv("BENCH_POSTGRES_URL")
+    if pg_url:
+        for profile in ("default", "auto"):
+            results.append(await _run_profile(f"postgresql/{profile}", pg_url, profile, args))
+
+    print(f"{'profile':<20}{'writes/s':>12}{'events/s':>12}{'reads/s':>12}{'errors':>8}")
+    for row in results:
+        print(
+            f"{row['profile']:<20}{row['writes_per_sec']:>12.1f}{row['events_per_sec']:>12.1f}"
+            f"{row['reads_per_sec']:>12.1f}{row['errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей БД JetRadar")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=25, help="Событий в одной пишущей транзакции")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+# benchmarks/transaction_plans.py
+
+"""
+Планы запросов к ленте кошелька (wallet_events + transactions) на сгенерированных таблицах.
+
+Заполняет чистую схему --rows транзакциями (по --wallets кошелькам) и печатает
+EXPLAIN горячих запросов: ленты кошелька (история/экспорт), курсора синхронизации
+и диапазона по lt. Ожидаемые планы — поиск по ix_wallet_events_wallet_ts /
+ix_wallet_events_wallet_lt без отдельной сортировки (в PostgreSQL — Index Only Scan).
+
+    python -m benchmarks.transaction_plans --rows 10000000
+
+PostgreSQL проверяется вместо SQLite, если задан BENCH_POSTGRES_URL
+(таблицы в этой БД пересоздаются — используйте отдельную базу).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import insert, text
+
+from db.db_init import create_db_engine
+from db.models import Base, Transaction, Wallet, WalletEvent
+
+CHUNK = 50_000
+
+QUERIES = {
+    "лента кошелька (история, keyset)": (
+        "SELECT transaction_id, lt, timestamp FROM wallet_events "
+        "WHERE wallet_id = :wallet_id AND timestamp < :before_ts ORDER BY timestamp DESC LIMIT 50"
+    ),
+    "экспорт кошелька": (
+        "SELECT transactions.* FROM wallet_events JOIN transactions ON transactions.id = wallet_events.transaction_id "
+        "WHERE wallet_events.wallet_id = :wallet_id ORDER BY wallet_events.timestamp DESC"
+    ),
+    "курсор синхронизации": "SELECT max(lt) FROM wallet_events WHERE wallet_id = :wallet_id",
+    "диапазон по lt": (
+        "SELECT transaction_id, lt FROM wallet_events "
+        "WHERE wallet_id = :wallet_id AND lt BETWEEN :lt_from AND :lt_to ORDER BY lt"
+    ),
+}
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = os.getenv("BENCH_POSTGRES_URL") or f"sqlite+aiosqlite:///{Path(tmp) / 'plans.db'}"
+        engine = create_db_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(
+                insert(Wallet.__table__), [{"id": i, "address": f"EQplan{i}"} for i in range(1, args.wallets + 1)]
+            )
+
+        started = time.monotonic()
+        for start in range(0, args.rows, CHUNK):
+            rows = [
+                {
+                    "id": n + 1,
+                    "event_id": f"plan{n}",
+                    "lt": 10_000_000 + n * 7,
+                    "timestamp": 1_600_000_000 + n,
+                    "is_scam_event": False,
+                    "actions_json": "[]",
+                }
+                for n in range(start, min(start + CHUNK, args.rows))
+            ]
+            links = [
+                {
+                    "wallet_id": random.randint(1, args.wallets),
+                    "transaction_id": row["id"],
+                    "lt": row["lt"],
+                    "timestamp": row["timestamp"],
+                }
+                for row in rows
+            ]
+            async with engine.begin() as conn:
+                await conn.execute(insert(Transaction.__table__), rows)
+                await conn.execute(insert(WalletEvent.__table__), links)
+        print(f"Вставлено {args.rows} транзакций за {time.monotonic() - started:.1f} с ({engine.dialect.name})")
+
+        params = {"wallet_id": 1, "before_ts": 1_600_000_000 + args.rows, "lt_from": 10_000_000, "lt_to": 10_100_000}
+        explain = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+        async with engine.begin() as conn:
+            if engine.dialect.name == "postgresql":
+                await conn.execute(text("ANALYZE transactions"))
+                await conn.execute(text("ANALYZE wallet_events"))
+            for title, query in QUERIES.items():
+                plan = (await conn.execute(text(explain + query), params)).all()
+                print(f"\n{title}:\n  {query}")
+                for row in plan:
+                    print(f"  -> {row[-1]}")
+
+        if url.startswith("postgresql"):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.drop_all)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Планы запросов к transactions")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
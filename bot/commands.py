@@ -7,6 +7,7 @@ from aiogram.filters import Command
 from datetime import datetime
 import logging
 from config import BACKEND_URL as API_BASE_URL
+from core.address import parse_address
 
 bot_logger = logging.getLogger(__name__)  # Логгер для команд бота
 logging.basicConfig(level=logging.INFO)
@@ -37,8 +38,8 @@ async def add_wallet_via_api(message: Message):
     address = args[1].strip()
     alias = args[2].strip() if len(args) > 2 else None
 
-    # Валидация адреса (очень базовая)
-    if not (address.startswith("UQ") or address.startswith("EQ")) or len(address) < 48:
+    # Валидация адреса: EQ.../UQ... (с проверкой CRC) или raw 0:hex
+    if parse_address(address) is None:
         await message.answer("❗ Схоже, це недійсна адреса TON гаманця.", parse_mode="HTML")
         return
 
@@ -182,7 +183,7 @@ async def tx_history_via_api(message: types.Message):
                 )
                 return
 
-            events_data = resp.json()
+            events_data = resp.json().get("events", [])  # Сторінка історії: {"events": [...], "next_cursor": ...}
         except httpx.RequestError as e:
             await message.answer(f"❌ Помилка з'єднання з API при запиті історії: {str(e)}")
             return
@@ -0,0 +1,75 @@
+# core/actions.py
+
+"""
+Розбір actions подій TonAPI у типізовані перекази (transfers).
+
+Результат пишеться в таблицю transfers один раз при збереженні події,
+тож споживачам (граф, експорт, аналітика) не потрібно щоразу робити json.loads.
+"""
+
+from typing import Optional
+
+TON_DECIMALS = 9
+
+
+def _address(account: Optional[dict]) -> Optional[str]:
+    return (account or {}).get("address")
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_transfers(actions: list[dict]) -> list[dict]:
+    """
+    Повертає перекази з actions однієї події:
+    {action_index, type, sender, recipient, asset, asset_symbol, amount, decimals, comment}.
+
+    amount — ціле число у мінімальних одиницях (nanoTON / одиниці джеттона),
+    asset — адреса jetton master або NFT (None для TON).
+    Дії без відправника й отримувача (swap, контрактні виклики) пропускаються.
+    """
+    transfers = []
+    for index, action in enumerate(actions or []):
+        action_type = action.get("type")
+        if action_type == "TonTransfer":
+            data = action.get("TonTransfer", {}) or {}
+            asset, symbol, decimals = None, "TON", TON_DECIMALS
+            amount = _int_or_none(data.get("amount"))
+        elif action_type == "JettonTransfer":
+            data = action.get("JettonTransfer", {}) or {}
+            jetton = data.get("jetton", {}) or {}
+            asset, symbol = jetton.get("address"), jetton.get("symbol")
+            decimals = _int_or_none(jetton.get("decimals"))
+            decimals = TON_DECIMALS if decimals is None else decimals
+            amount = _int_or_none(data.get("amount"))
+        elif action_type in ("NftItemTransfer", "NftTransfer"):
+            data = action.get(action_type, {}) or {}
+            asset, symbol, decimals, amount = data.get("nft"), None, 0, None
+            if isinstance(asset, dict):
+                asset = asset.get("address")
+        else:
+            continue
+
+        sender = _address(data.get("sender"))
+        recipient = _address(data.get("recipient"))
+        if not sender or not recipient:
+            continue
+
+        transfers.append(
+            {
+                "action_index": index,
+                "type": action_type,
+                "sender": sender,
+                "recipient": recipient,
+                "asset": asset,
+                "asset_symbol": symbol,
+                "amount": amount,
+                "decimals": decimals,
+                "comment": data.get("comment") or None,  # Текстовий коментар переказу (для пошуку)
+            }
+        )
+    return transfers
@@ -0,0 +1,88 @@
+# core/address.py
+
+"""
+Канонічне подання адрес TON.
+
+Той самий акаунт приходить у різних формах: user-friendly (EQ.../UQ..., base64 або base64url,
+bounceable чи ні, mainnet чи testnet) та raw (`0:hex`). TonAPI у відповідях часто повертає raw,
+а в нашій БД і від користувачів приходять user-friendly. Порівнювати адреси можна лише після
+розбору до (workchain, 32-байтовий хеш) — TonAddress; у БД акаунт інтернується в таблицю
+accounts і далі всюди фігурує як цілочисельний id.
+"""
+
+import base64
+import binascii
+from typing import NamedTuple, Optional
+
+# Прапорці user-friendly адреси: bounceable 0x11, non-bounceable 0x51, +0x80 — тільки для testnet
+_FLAG_BOUNCEABLE = 0x11
+_FLAG_NON_BOUNCEABLE = 0x51
+_FLAG_TESTNET = 0x80
+
+
+class TonAddress(NamedTuple):
+    workchain: int
+    hash: bytes  # 32 байти
+
+    @property
+    def raw(self) -> str:
+        """Raw-форма `workchain:hex` (hex у нижньому регістрі)."""
+        return f"{self.workchain}:{self.hash.hex()}"
+
+    def to_friendly(self, bounceable: bool = True, testnet: bool = False) -> str:
+        """User-friendly форма (base64url, 48 символів): EQ... для bounceable, UQ... для non-bounceable."""
+        flags = _FLAG_BOUNCEABLE if bounceable else _FLAG_NON_BOUNCEABLE
+        if testnet:
+            flags |= _FLAG_TESTNET
+        data = bytes([flags]) + self.workchain.to_bytes(1, "big", signed=True) + self.hash
+        return base64.urlsafe_b64encode(data + _crc16(data).to_bytes(2, "big")).decode("ascii")
+
+
+def _crc16(data: bytes) -> int:
+    """CRC16-XMODEM (поліном 0x1021), яким захищена user-friendly адреса."""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+def parse_address(address: str) -> Optional[TonAddress]:
+    """
+    Розбирає адресу TON у будь-якій формі в TonAddress
+    або повертає None, якщо рядок не є коректною адресою (зокрема з невірною контрольною сумою).
+    """
+    address = (address or "").strip()
+    if ":" in address:
+        workchain, _, account_hex = address.partition(":")
+        try:
+            workchain = int(workchain)
+            if len(account_hex) != 64 or not -128 <= workchain <= 127:
+                return None
+            return TonAddress(workchain, bytes.fromhex(account_hex))
+        except ValueError:
+            return None
+
+    if len(address) != 48:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(address.replace("+", "-").replace("/", "_"))
+    except (binascii.Error, ValueError):
+        return None
+    # 1 байт прапорців, 1 байт workchain (signed), 32 байти хешу, 2 байти CRC16
+    if len(data) != 36 or data[0] & ~_FLAG_TESTNET not in (_FLAG_BOUNCEABLE, _FLAG_NON_BOUNCEABLE):
+        return None
+    if _crc16(data[:34]) != int.from_bytes(data[34:], "big"):
+        return None
+    return TonAddress(int.from_bytes(data[1:2], "big", signed=True), data[2:34])
+
+
+def to_raw_address(address: str) -> Optional[str]:
+    """
+    Повертає адресу у raw-формі `workchain:hex` (hex у нижньому регістрі)
+    або None, якщо рядок не схожий на адресу TON.
+    """
+    parsed = parse_address(address)
+    return parsed.raw if parsed else None
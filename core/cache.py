@@ -0,0 +1,108 @@
+# core/cache.py
+
+"""
+In-memory TTL-кеш із об'єднанням однакових запитів (single-flight).
+
+- Значення свіже `ttl` секунд — віддається з пам'яті без звернення до джерела.
+- Ще `stale_ttl` секунд після цього значення віддається як застаріле, а оновлення
+  запускається у фоні (stale-while-revalidate): відповідь не чекає на джерело.
+- Паралельні промахи по одному ключу чекають на одне завантаження, а не роблять
+  кожен свій запит; скасування одного з очікувачів не скасовує спільне завантаження.
+- Кількість записів обмежена `max_entries`, найдавніше використані витісняються (LRU).
+
+Помилки завантаження не кешуються: вони передаються всім очікувачам, а невдале
+фонове оновлення лише логується — застаріле значення лишається до кінця `stale_ttl`.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    def __init__(
+        self,
+        ttl: float,
+        stale_ttl: float = 0,
+        max_entries: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max(1, max_entries)
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()  # key -> (значення, час завантаження)
+        self._inflight: dict = {}  # key -> asyncio.Task завантаження
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _age(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return None if entry is None else self._clock() - entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Кладе значення в кеш (наприклад, отримане іншим шляхом) як щойно завантажене."""
+        self._entries[key] = (value, self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Значення ключа, якщо воно ще не застаріло остаточно (ttl + stale_ttl), без завантаження."""
+        age = self._age(key)
+        if age is None or age >= self.ttl + self.stale_ttl:
+            return default
+        return self._entries[key][0]
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Спільне завантаження ключа: повертає вже запущене або запускає нове."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:  # Задачі прив'язані до event loop (тести, скрипти з кількома asyncio.run)
+            self._inflight.clear()
+            self._loop = loop
+        task = self._inflight.get(key)
+        if task is None:
+
+            async def _run():
+                try:
+                    value = await loader()
+                    self.set(key, value)
+                    return value
+                finally:
+                    self._inflight.pop(key, None)
+
+            task = self._inflight[key] = loop.create_task(_run())
+        return task
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Значення ключа з кешу; при промаху — результат `loader()` (один виклик на всіх
+        паралельних очікувачів). Застаріле значення віддається одразу, оновлення — у фоні.
+        """
+        age = self._age(key)
+        if age is not None and age < self.ttl:
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+        if age is not None and age < self.ttl + self.stale_ttl:
+            if key not in self._inflight:
+                self._load(key, loader).add_done_callback(self._log_refresh_error)
+            return self._entries[key][0]
+        return await asyncio.shield(self._load(key, loader))
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Фонове оновлення кешу не вдалося: {task.exception()!r}")
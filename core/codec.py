@@ -0,0 +1,236 @@
+# core/codec.py
+
+"""
+Кодеки для збереження actions подій TonAPI (колонка transactions.actions_json).
+
+Замість JSON-тексту actions пишуться компактним бінарним форматом: MessagePack або CBOR,
+стиснені zstd (за наявності — з натренованим словником). Перший байт значення — тег кодека,
+тому різні формати співіснують у таблиці, а старі рядки з JSON-текстом (починаються з "[")
+читаються як раніше. Перекодувати старі рядки можна інструментом db.reencode_actions.
+
+Пакети msgpack, cbor2 та zstandard — опціональні: якщо обраного кодека немає,
+використовується json-zlib зі стандартної бібліотеки.
+"""
+
+import json
+import logging
+import os
+import time
+import zlib
+from functools import lru_cache
+from typing import Callable, Iterable, Optional, Union
+
+from dotenv import load_dotenv
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ACTIONS_CODEC = os.getenv("ACTIONS_CODEC", "msgpack-zstd")
+ACTIONS_ZSTD_LEVEL = int(os.getenv("ACTIONS_ZSTD_LEVEL", "10"))
+# Прибирати поля лише для відображення (картинки, іконки, прев'ю) — вони не потрібні ні графу, ні експорту
+ACTIONS_STRIP_DISPLAY = os.getenv("ACTIONS_STRIP_DISPLAY", "false").lower() in ("1", "true", "yes")
+DISPLAY_ONLY_FIELDS = frozenset({"image", "icon", "previews", "value_image"})
+# Картинку токена (image, metadata.image) у цих об'єктах /history віддає як jetton_image — її не прибирати
+JETTON_INFO_FIELDS = frozenset({"jetton", "jetton_master_in", "jetton_master_out", "asset_in", "asset_out"})
+
+FALLBACK_CODEC = "json-zlib"
+
+# Тег кодека — перший байт значення. JSON-текст завжди починається з "[" (0x5B), тому теги < 0x20
+CODEC_TAGS = {
+    "json-zlib": 0x01,
+    "msgpack": 0x02,
+    "msgpack-zstd": 0x03,
+    "cbor": 0x04,
+    "cbor-zstd": 0x05,
+}
+_CODECS_BY_TAG = {tag: name for name, tag in CODEC_TAGS.items()}
+
+# Натреновані словники zstd: dict_id -> ZstdCompressionDict; для кодування — найновіший словник кодека
+_dictionaries: dict = {}
+_active_dictionaries: dict[str, int] = {}
+_compressors: dict = {}
+_decompressors: dict = {}
+# Словники, яких не знайшлося в codec_dictionaries: dict_id -> час перевірки (time.monotonic).
+# Повторно їх шукають не частіше ніж раз на DICTIONARY_RETRY_SECONDS, а не на кожне читання
+_missing_dictionaries: dict[int, float] = {}
+DICTIONARY_RETRY_SECONDS = 300
+
+
+def codec_available(name: str) -> bool:
+    if name == "json":
+        return True
+    if name not in CODEC_TAGS:
+        return False
+    serializer, _, compression = name.partition("-")
+    if serializer == "msgpack" and msgpack is None:
+        return False
+    if serializer == "cbor" and cbor2 is None:
+        return False
+    return not (compression == "zstd" and zstandard is None)
+
+
+@lru_cache(maxsize=None)
+def resolve_codec(name: str = ACTIONS_CODEC) -> str:
+    """Обраний кодек або json-zlib, якщо потрібних пакетів не встановлено."""
+    if codec_available(name):
+        return name
+    logger.warning(f"Кодек actions '{name}' недоступний (не встановлено пакет) — використовується {FALLBACK_CODEC}.")
+    return FALLBACK_CODEC
+
+
+def strip_display_fields(value, keep_image: bool = False):
+    """Рекурсивно прибирає поля DISPLAY_ONLY_FIELDS, крім картинок токена в JETTON_INFO_FIELDS."""
+    if isinstance(value, dict):
+        return {
+            key: strip_display_fields(item, keep_image or key in JETTON_INFO_FIELDS)
+            for key, item in value.items()
+            if key not in DISPLAY_ONLY_FIELDS or (keep_image and key == "image")
+        }
+    if isinstance(value, list):
+        return [strip_display_fields(item, keep_image) for item in value]
+    return value
+
+
+def register_dictionaries(dictionaries: list[tuple[int, str, bytes]]) -> None:
+    """
+    Реєструє натреновані словники zstd (dict_id, кодек, дані). Для кодування кодеком
+    використовується його словник з найбільшим id, решта — лише для читання старих значень.
+    """
+    if zstandard is None:
+        return
+    for dict_id, codec, data in dictionaries:
+        _dictionaries[dict_id] = zstandard.ZstdCompressionDict(data)
+        _missing_dictionaries.pop(dict_id, None)
+        _active_dictionaries[codec] = max(dict_id, _active_dictionaries.get(codec, dict_id))
+    _compressors.clear()
+    _decompressors.clear()
+
+
+def payload_dictionary(value: Union[bytes, str, None]) -> Optional[int]:
+    """dict_id словника zstd, яким стиснуте значення (None — без словника або кодек не zstd)."""
+    if zstandard is None or not payload_codec(value).endswith("-zstd"):
+        return None
+    return zstandard.get_frame_parameters(value[1:]).dict_id or None
+
+
+def unknown_dictionaries(values: Iterable[Union[bytes, str, None]]) -> set[int]:
+    """
+    Словники значень, яких немає в пам'яті: їх натренував інший процес (db.reencode_actions), поки
+    сервіс працював. Завантажує їх db.db_init.load_codec_dictionaries перед decode_actions — сам
+    декодер синхронний і в БД не ходить. Нещодавно не знайдені словники не повертаються.
+    """
+    now = time.monotonic()
+    unknown = set()
+    for value in values:
+        dict_id = payload_dictionary(value)
+        if dict_id is None or dict_id in _dictionaries:
+            continue
+        checked_at = _missing_dictionaries.get(dict_id)
+        if checked_at is None or now - checked_at >= DICTIONARY_RETRY_SECONDS:
+            unknown.add(dict_id)
+    return unknown
+
+
+def mark_dictionaries_missing(dict_ids: Iterable[int]) -> None:
+    """Запам'ятовує словники, яких немає в codec_dictionaries (див. unknown_dictionaries)."""
+    now = time.monotonic()
+    for dict_id in dict_ids:
+        _missing_dictionaries[dict_id] = now
+
+
+def train_dictionary(samples: list[bytes], dict_size: int = 112640):
+    """Тренує словник zstd на зразках серіалізованих actions (без стиснення)."""
+    if zstandard is None:
+        raise RuntimeError("Для тренування словника потрібен пакет 'zstandard'")
+    return zstandard.train_dictionary(dict_size, samples)
+
+
+def _compressor(codec: str):
+    dict_id = _active_dictionaries.get(codec)
+    compressor = _compressors.get(dict_id)
+    if compressor is None:
+        compressor = zstandard.ZstdCompressor(level=ACTIONS_ZSTD_LEVEL, dict_data=_dictionaries.get(dict_id))
+        _compressors[dict_id] = compressor
+    return compressor
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    dict_id = zstandard.get_frame_parameters(data).dict_id or None
+    decompressor = _decompressors.get(dict_id)
+    if decompressor is None:
+        if dict_id is not None and dict_id not in _dictionaries:
+            raise ValueError(f"Словник zstd {dict_id} не завантажено (таблиця codec_dictionaries)")
+        decompressor = zstandard.ZstdDecompressor(dict_data=_dictionaries.get(dict_id))
+        _decompressors[dict_id] = decompressor
+    return decompressor.decompress(data)
+
+
+def _serializer(name: str) -> tuple[Callable, Callable]:
+    serializer = name.partition("-")[0]
+    if serializer == "msgpack":
+        return (lambda value: msgpack.packb(value, use_bin_type=True)), (lambda data: msgpack.unpackb(data, raw=False))
+    if serializer == "cbor":
+        return cbor2.dumps, cbor2.loads
+    return (lambda value: json.dumps(value, separators=(",", ":")).encode("utf-8")), json.loads
+
+
+def serialize_actions(actions: list, codec: str) -> bytes:
+    """Серіалізує actions без стиснення (зразки для тренування словника)."""
+    return _serializer(codec)[0](actions)
+
+
+def encode_actions(actions: list, codec: Optional[str] = None) -> Union[bytes, str]:
+    """Кодує actions події для збереження в transactions.actions_json."""
+    codec = resolve_codec(codec or ACTIONS_CODEC)
+    if ACTIONS_STRIP_DISPLAY:
+        actions = strip_display_fields(actions)
+    if codec == "json":
+        return json.dumps(actions)
+
+    payload = serialize_actions(actions, codec)
+    if codec.endswith("-zstd"):
+        payload = _compressor(codec).compress(payload)
+    elif codec == "json-zlib":
+        payload = zlib.compress(payload, 6)
+    return bytes([CODEC_TAGS[codec]]) + payload
+
+
+def decode_actions(value: Union[bytes, str, None]) -> list:
+    """Декодує збережені actions: і новий бінарний формат, і старий JSON-текст."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return json.loads(value)
+    if value[:1] == b"[":  # JSON-текст (старі рядки або ACTIONS_CODEC=json)
+        return json.loads(value)
+
+    codec = _CODECS_BY_TAG.get(value[0])
+    if codec is None:
+        raise ValueError(f"Невідомий тег кодека actions: {value[0]:#x}")
+    payload = value[1:]
+    if codec.endswith("-zstd"):
+        payload = _zstd_decompress(payload)
+    elif codec == "json-zlib":
+        payload = zlib.decompress(payload)
+    return _serializer(codec)[1](payload)
+
+
+def payload_codec(value: Union[bytes, str, None]) -> str:
+    """Назва кодека, яким закодоване значення ("json" для тексту)."""
+    if not value or isinstance(value, str) or value[:1] == b"[":
+        return "json"
+    return _CODECS_BY_TAG.get(value[0], "unknown")
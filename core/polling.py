@@ -0,0 +1,110 @@
+# core/polling.py
+
+"""
+Адаптивна частота опитування гаманців.
+
+Кожен гаманець має власний час наступного оновлення (next_sync_at), який залежить
+від його активності (скільки нових подій з'являється за годину) та кількості
+користувачів, що за ним стежать. Черга — це heap за часом, тож планувальник
+дістає лише ті гаманці, чий час уже настав, без сканування всієї таблиці.
+"""
+
+import heapq
+import math
+import os
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POLL_MIN_INTERVAL_SECONDS = int(os.getenv("POLL_MIN_INTERVAL_SECONDS", "60"))
+POLL_MAX_INTERVAL_SECONDS = int(os.getenv("POLL_MAX_INTERVAL_SECONDS", str(6 * 3600)))
+# Опитуємо тоді, коли в середньому накопичилось стільки нових подій
+POLL_TARGET_EVENTS = float(os.getenv("POLL_TARGET_EVENTS", "5"))
+# Вага нового спостереження в експоненційному згладжуванні активності
+POLL_RATE_ALPHA = float(os.getenv("POLL_RATE_ALPHA", "0.3"))
+POLL_ERROR_BACKOFF_SECONDS = int(os.getenv("POLL_ERROR_BACKOFF_SECONDS", "300"))
+
+
+def update_activity_rate(old_rate: Optional[float], new_events: int, elapsed_seconds: float) -> float:
+    """
+    Оновлює згладжену активність гаманця (подій на годину) за результатом одного оновлення:
+    `new_events` нових подій за `elapsed_seconds` з попереднього оновлення.
+    """
+    observed = new_events / max(elapsed_seconds, 1.0) * 3600
+    if old_rate is None:
+        return observed
+    return POLL_RATE_ALPHA * observed + (1 - POLL_RATE_ALPHA) * old_rate
+
+
+def compute_poll_interval(
+    rate_per_hour: Optional[float],
+    watchers: int = 1,
+    last_activity_ts: Optional[int] = None,
+    now: Optional[float] = None,
+) -> float:
+    """
+    Інтервал (у секундах) до наступного оновлення гаманця.
+
+    - активний гаманець опитується тоді, коли очікується ~POLL_TARGET_EVENTS нових подій;
+    - гаманець без спостережуваної активності — пропорційно часу з останньої активності;
+    - кожен додатковий спостерігач скорочує інтервал (логарифмічно);
+    - результат обмежений POLL_MIN_INTERVAL_SECONDS..POLL_MAX_INTERVAL_SECONDS.
+    """
+    now = time.time() if now is None else now
+    if rate_per_hour and rate_per_hour > 0:
+        interval = POLL_TARGET_EVENTS / rate_per_hour * 3600
+    elif last_activity_ts:
+        # Давно неактивний гаманець перевіряємо рідше: десята частина "тиші"
+        interval = max(now - last_activity_ts, 0) / 10
+    else:
+        interval = POLL_MAX_INTERVAL_SECONDS
+
+    interval /= 1 + math.log(max(watchers, 1))
+    return min(max(interval, POLL_MIN_INTERVAL_SECONDS), POLL_MAX_INTERVAL_SECONDS)
+
+
+class PollingQueue:
+    """
+    Min-heap гаманців за часом наступного оновлення (unix timestamp).
+
+    Повторне планування того ж гаманця не шукає старий запис у heap: актуальний час
+    зберігається в `_due`, а застарілі записи відкидаються при діставанні (lazy deletion).
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str]] = []
+        self._due: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, wallet_id: int) -> bool:
+        return wallet_id in self._due
+
+    def push(self, wallet_id: int, address: str, due_ts: float) -> None:
+        self._due[wallet_id] = due_ts
+        heapq.heappush(self._heap, (due_ts, wallet_id, address))
+
+    def discard(self, wallet_id: int) -> None:
+        """Знімає гаманець з черги; його записи в heap відкинуться при діставанні."""
+        self._due.pop(wallet_id, None)
+
+    def pop_due(self, now: Optional[float] = None, limit: Optional[int] = None) -> list[tuple[int, str]]:
+        """Дістає гаманці, час оновлення яких настав (найпростроченіші першими)."""
+        now = time.time() if now is None else now
+        due: list[tuple[int, str]] = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            due_ts, wallet_id, address = heapq.heappop(self._heap)
+            if self._due.get(wallet_id) != due_ts:
+                continue  # Застарілий запис: гаманець уже перепланований
+            del self._due[wallet_id]
+            due.append((wallet_id, address))
+        return due
+
+    def next_due_ts(self) -> Optional[float]:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
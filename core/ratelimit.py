@@ -0,0 +1,73 @@
+# core/ratelimit.py
+
+"""
+Token bucket для обмеження частоти запитів до TonAPI.
+
+Один екземпляр ділиться між усіма воркерами планувальника, тому сумарний RPS
+ніколи не перевищує ліміт тарифу, незалежно від кількості паралельних задач.
+Фонові задачі (догрузка історії) беруть токени з низьким пріоритетом і
+поступаються місцем звичайним запитам.
+"""
+
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# RPS нашого тарифу TonAPI (free = 1 RPS). Burst — скільки запитів можна зробити "залпом".
+TONAPI_RPS = float(os.getenv("TONAPI_RPS", "1"))
+TONAPI_BURST = int(os.getenv("TONAPI_BURST", "1"))
+
+
+class TokenBucket:
+    """
+    Класичний token bucket: токени поповнюються зі швидкістю `rate` на секунду
+    до максимуму `capacity`. Кожен запит забирає один токен; якщо токенів немає —
+    корутина чекає рівно стільки, скільки потрібно для появи наступного.
+
+    Запити з `low_priority=True` не стають у чергу, поки хтось зі
+    звичайним пріоритетом чекає на токен.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        if rate <= 0:
+            raise ValueError("rate має бути > 0")
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._waiting = 0  # Скільки запитів зі звичайним пріоритетом зараз чекають
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: int = 1, low_priority: bool = False) -> None:
+        """Чекає, доки в бакеті з'являться `tokens` токенів, і забирає їх."""
+        if low_priority:
+            # Поступаємося, доки є черга зі звичайних запитів
+            while self._waiting or self._lock.locked():
+                await asyncio.sleep(1 / self.rate)
+        else:
+            self._waiting += 1
+        try:
+            # Lock гарантує FIFO-порядок: воркери не "перебивають" один одного
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    await asyncio.sleep((tokens - self._tokens) / self.rate)
+        finally:
+            if not low_priority:
+                self._waiting -= 1
+
+
+# Спільний лімітер для всіх звернень до TonAPI
+tonapi_limiter = TokenBucket(rate=TONAPI_RPS, capacity=TONAPI_BURST)
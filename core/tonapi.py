@@ -1,11 +1,127 @@
+import importlib.util
+import logging
 import os
+from typing import Optional
+
 import httpx
 from dotenv import load_dotenv
 
+from core.ratelimit import TokenBucket, tonapi_limiter
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 TONAPI_KEY = os.getenv("TONAPI_KEY")
-TONAPI_BASE_URL = "https://tonapi.io/v2"
+TONAPI_BASE_URL = os.getenv("TONAPI_BASE_URL", "https://tonapi.io/v2")
+
+# Параметри пулу з'єднань. Keep-alive з'єднання перевикористовуються між запитами,
+# тому TCP+TLS handshake відбувається один раз на з'єднання, а не на кожен виклик.
+TONAPI_TIMEOUT = float(os.getenv("TONAPI_TIMEOUT", "10"))
+TONAPI_CONNECT_TIMEOUT = float(os.getenv("TONAPI_CONNECT_TIMEOUT", "5"))
+TONAPI_MAX_CONNECTIONS = int(os.getenv("TONAPI_MAX_CONNECTIONS", "20"))
+TONAPI_MAX_KEEPALIVE = int(os.getenv("TONAPI_MAX_KEEPALIVE", "10"))
+TONAPI_KEEPALIVE_EXPIRY = float(os.getenv("TONAPI_KEEPALIVE_EXPIRY", "30"))
+TONAPI_HTTP2 = os.getenv("TONAPI_HTTP2", "false").lower() in ("1", "true", "yes")
+
+
+class TonApiClient:
+    """
+    Довгоживучий клієнт TonAPI поверх одного `httpx.AsyncClient`.
+
+    Єдине місце, де задаються base URL, заголовок авторизації, таймаути, ліміти пулу
+    та обмеження частоти запитів. Створюється один раз (див. `get_tonapi_client`)
+    і використовується API-роутами, планувальником і `fetch_transactions`.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = TONAPI_KEY,
+        base_url: str = TONAPI_BASE_URL,
+        limiter: Optional[TokenBucket] = tonapi_limiter,
+        http2: bool = TONAPI_HTTP2,
+        timeout: float = TONAPI_TIMEOUT,
+        connect_timeout: float = TONAPI_CONNECT_TIMEOUT,
+        max_connections: int = TONAPI_MAX_CONNECTIONS,
+        max_keepalive_connections: int = TONAPI_MAX_KEEPALIVE,
+        keepalive_expiry: float = TONAPI_KEEPALIVE_EXPIRY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("TONAPI_HTTP2 увімкнено, але пакет 'h2' не встановлено — використовується HTTP/1.1.")
+            http2 = False
+
+        headers = {"Accept": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        self.limiter = limiter
+        self.http2 = http2
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            http2=http2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            transport=transport,
+        )
+
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    async def request(self, method: str, path: str, low_priority: bool = False, **kwargs) -> httpx.Response:
+        """
+        Виконує запит до TonAPI (шлях відносно base URL) з урахуванням ліміту RPS.
+        `low_priority=True` — для фонових задач, які не повинні затримувати інші запити.
+        Кидає `httpx.HTTPStatusError` для 4xx/5xx та `httpx.RequestError` для мережевих помилок.
+        """
+        if self.limiter is not None:
+            await self.limiter.acquire(low_priority=low_priority)
+        resp = await self._client.request(method, path, **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    async def get(self, path: str, params: Optional[dict] = None, low_priority: bool = False) -> httpx.Response:
+        return await self.request("GET", path, low_priority=low_priority, params=params)
+
+    async def post(self, path: str, json: Optional[dict] = None, params: Optional[dict] = None) -> httpx.Response:
+        return await self.request("POST", path, json=json, params=params)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: Optional[TonApiClient] = None
+
+
+def get_tonapi_client() -> TonApiClient:
+    """
+    Повертає спільний клієнт TonAPI. Зазвичай його створює lifespan FastAPI
+    (`init_tonapi_client`), але для бота/скриптів клієнт створюється ліниво.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = TonApiClient()
+    return _client
+
+
+def init_tonapi_client() -> TonApiClient:
+    client = get_tonapi_client()
+    logger.info(f"TonAPI клієнт ініціалізовано (HTTP/2: {client.http2}, max_connections: {TONAPI_MAX_CONNECTIONS}).")
+    return client
+
+
+async def close_tonapi_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("TonAPI клієнт закрито.")
 
 
 async def fetch_transactions(address: str, limit: int = 10):
@@ -18,10 +134,5 @@ async def fetch_transactions(address: str, limit: int = 10):
     if not TONAPI_KEY:
         raise RuntimeError("TONAPI_KEY не задано у .env")
 
-    url = f"{TONAPI_BASE_URL}/blockchain/accounts/{address}/transactions?limit={limit}"
-    headers = {"Authorization": f"Bearer {TONAPI_KEY}"}
-
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(url, headers=headers, timeout=10.0)
-        resp.raise_for_status()
-        return resp.json().get("transactions", [])
+    resp = await get_tonapi_client().get(f"/blockchain/accounts/{address}/transactions", params={"limit": limit})
+    return resp.json().get("transactions", [])
@@ -1,10 +1,45 @@
 import os
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Iterable
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy import (
+    event, inspect, text, select, insert, update, bindparam, func, Integer, LargeBinary, MetaData, Numeric
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from .models import Base  # Используем относительный импорт, если models.py в том же каталоге
+# Используем относительный импорт, если models.py в том же каталоге
+from .models import (
+    Base,
+    Account,
+    Transaction,
+    Transfer,
+    CounterpartyStat,
+    Wallet,
+    WalletEvent,
+    VolumeHourly,
+    VolumeDaily,
+    CodecDictionary,
+    Amount,
+    add_amounts,
+)
+from .ingest import (
+    parse_addresses,
+    transfer_rows,
+    accumulate_counterparty_stat,
+    accumulate_volume,
+    transfer_direction,
+    INSERT_BATCH_SIZE,
+    STATS_TRANSFER_TYPES,
+)
+from .search import COMMENTS_FTS, ensure_search_index
+from core.actions import extract_transfers
+from core.address import to_raw_address
+from core.codec import decode_actions, mark_dictionaries_missing, register_dictionaries, unknown_dictionaries
 
 logger = logging.getLogger(__name__)
 
@@ -31,17 +66,564 @@ DATABASE_URL = os.getenv(
 )
 logger.info(f"Используется DATABASE_URL: {DATABASE_URL}")
 
+# Профиль движка: "auto" — настройки по диалекту DATABASE_URL, "default" — без тюнинга (для сравнения)
+DB_PROFILE = os.getenv("DB_PROFILE", "auto")
+
+# SQLite: WAL позволяет читать параллельно с записью, synchronous=NORMAL в WAL безопасен
+# для целостности БД и заметно ускоряет коммиты, busy_timeout вместо мгновенного "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# PostgreSQL (asyncpg): пул соединений и кэш подготовленных выражений.
+# За PgBouncer в режиме transaction DB_STATEMENT_CACHE_SIZE нужно выставить в 0.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
 
-# echo=True для отладки SQL-запросов
-engine = create_async_engine(DATABASE_URL, echo=False)
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Выставляет PRAGMA для каждого нового соединения SQLite."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """SQL-функции, которые нужны схеме в SQLite: amount_add — точная сумма колонок Amount (db.models)."""
+    dbapi_connection.create_function("amount_add", 2, add_amounts, deterministic=True)
+
+
+def create_db_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE) -> AsyncEngine:
+    """
+    Создаёт движок с профилем настроек под диалект БД:
+    - sqlite: WAL, synchronous=NORMAL, busy_timeout, mmap (см. _set_sqlite_pragmas);
+      функции register_sqlite_functions регистрируются в любом профиле;
+    - postgresql+asyncpg: размер пула, overflow, pre-ping и кэш подготовленных выражений.
+    """
+    db_url = make_url(url)
+    backend = db_url.get_backend_name()
+    # echo=True для отладки SQL-запросов
+    if backend == "sqlite":
+        db_engine = create_async_engine(url, echo=False)
+        event.listen(db_engine.sync_engine, "connect", register_sqlite_functions)
+        if profile != "default":
+            event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return db_engine
+
+    if profile == "default":
+        return create_async_engine(url, echo=False)
+
+    if backend == "postgresql":
+        connect_args = {}
+        if db_url.get_driver_name() == "asyncpg":
+            connect_args["statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+        return create_async_engine(
+            url,
+            echo=False,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+        )
+
+    return create_async_engine(url, echo=False)
+
+
+engine = create_db_engine()
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
 )
 
+
+async def load_codec_dictionaries(payloads: Iterable) -> None:
+    """
+    Подгружает словари zstd, которыми сжаты payloads (actions_json), но которых нет в памяти
+    (core.codec.unknown_dictionaries). Вызывается перед decode_actions; в БД идёт только при промахе,
+    id, которых нет в codec_dictionaries, запоминаются и не запрашиваются на каждом чтении.
+    """
+    dict_ids = unknown_dictionaries(payloads)
+    if not dict_ids:
+        return
+    async with async_session() as session:
+        rows = (
+            await session.execute(
+                select(CodecDictionary.id, CodecDictionary.codec, CodecDictionary.data).where(
+                    CodecDictionary.id.in_(sorted(dict_ids))
+                )
+            )
+        ).all()
+    register_dictionaries([(row.id, row.codec, bytes(row.data)) for row in rows])
+    mark_dictionaries_missing(dict_ids - {row.id for row in rows})
+    for row in rows:
+        logger.info(f"Загружен словарь zstd {row.id} ({row.codec})")
+
+
+# SQLite допускает только одного писателя: пишущие транзакции процесса выстраиваются
+# в очередь на asyncio.Lock, а не соревнуются за файловую блокировку до "database is locked".
+_write_locks: dict[int, asyncio.Lock] = {}
+
+
+def _get_write_lock() -> asyncio.Lock:
+    # Отдельный замок на event loop: тесты и скрипты запускают несколько asyncio.run подряд
+    loop_id = id(asyncio.get_running_loop())
+    lock = _write_locks.get(loop_id)
+    if lock is None:
+        _write_locks.clear()
+        lock = _write_locks[loop_id] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def write_lock(db_engine: AsyncEngine = None):
+    """
+    Очередь писателей для SQLite (для остальных СУБД ничего не делает).
+    Держать только на время пишущей транзакции — без сетевых запросов внутри.
+    """
+    if (db_engine or engine).dialect.name != "sqlite":
+        yield
+        return
+    async with _get_write_lock():
+        yield
+
+
+@asynccontextmanager
+async def write_session():
+    """Сессия с открытой пишущей транзакцией, выполняемой через очередь писателей."""
+    async with write_lock():
+        async with async_session() as session:
+            async with session.begin():
+                yield session
+
+def _add_missing_columns(sync_conn):
+    """
+    Простейшая миграция для уже существующих БД: create_all не изменяет
+    созданные таблицы, поэтому новые (nullable) колонки моделей добавляем через ALTER TABLE.
+    """
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            logger.info(f"Миграция: добавлена колонка {table.name}.{column.name} ({column_type})")
+
+
+def _add_missing_indexes(sync_conn):
+    """Создаёт индексы моделей, которых ещё нет в уже существующих таблицах."""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(sync_conn)
+                logger.info(f"Миграция: создан индекс {index.name}")
+
+
+def _migrate_transaction_lt(sync_conn):
+    """
+    Миграция transactions.lt из строки в BIGINT: строковое lt сортируется лексикографически
+    и не позволяет числовые range scan.
+    PostgreSQL меняет тип на месте, SQLite (без ALTER COLUMN) — пересборкой таблицы.
+    Индексы пересобранной таблицы создаёт затем _add_missing_indexes.
+    """
+    inspector = inspect(sync_conn)
+    if not inspector.has_table(Transaction.__tablename__):
+        return
+    lt_column = next(col for col in inspector.get_columns(Transaction.__tablename__) if col["name"] == "lt")
+    if isinstance(lt_column["type"], Integer):
+        return
+
+    dialect = sync_conn.dialect.name
+    logger.info(f"Миграция: transactions.lt {lt_column['type']} -> BIGINT ({dialect})")
+    if dialect == "postgresql":
+        sync_conn.execute(text("ALTER TABLE transactions ALTER COLUMN lt TYPE BIGINT USING lt::bigint"))
+        return
+    if dialect != "sqlite":
+        logger.warning(f"Миграция transactions.lt для диалекта {dialect} не поддерживается — выполните её вручную")
+        return
+
+    _rebuild_sqlite_table(sync_conn, Transaction.__table__, {"lt": 'CAST("lt" AS INTEGER)'})
+
+
+def _rebuild_sqlite_table(sync_conn, table, expressions: dict = None):
+    """
+    Пересобирает таблицу SQLite по текущей модели (в SQLite нет ALTER COLUMN и DROP для колонок
+    с индексами/внешними ключами): переносятся колонки, общие для старой таблицы и модели,
+    `expressions` задаёт SQL-выражение переноса для отдельных колонок.
+    Индексы пересобранной таблицы создаёт затем _add_missing_indexes.
+    """
+    expressions = expressions or {}
+    old_columns = {col["name"] for col in inspect(sync_conn).get_columns(table.name)}
+    migration_metadata = MetaData()
+    for referred in Base.metadata.sorted_tables:  # Таблицы, на которые ссылаются внешние ключи
+        if referred is not table:
+            referred.to_metadata(migration_metadata)
+    new_table = table.to_metadata(migration_metadata, name=f"{table.name}__migration")
+    copied = [column.name for column in table.columns if column.name in old_columns]
+    columns = ", ".join(f'"{name}"' for name in copied)
+    select_columns = ", ".join(expressions.get(name, f'"{name}"') for name in copied)
+    sync_conn.execute(CreateTable(new_table))  # Без индексов: их имена ещё заняты старой таблицей
+    sync_conn.execute(text(f"INSERT INTO {new_table.name} ({columns}) SELECT {select_columns} FROM {table.name}"))
+    sync_conn.execute(text(f"DROP TABLE {table.name}"))
+    sync_conn.execute(text(f"ALTER TABLE {new_table.name} RENAME TO {table.name}"))
+
+
+def _migrate_amount_columns(sync_conn):
+    """
+    Суммы (колонки Amount) в SQLite хранятся десятичной строкой: колонка DECIMAL теряла точность
+    у чисел вне int64. Таблицы со старым типом пересобираются; значения, уже сохранённые как REAL,
+    переносятся целым числом — потерянные знаки не восстановить. В PostgreSQL тип не меняется.
+    """
+    if sync_conn.dialect.name != "sqlite":
+        return
+    inspector = inspect(sync_conn)
+    for table in (Transfer.__table__, CounterpartyStat.__table__, VolumeHourly.__table__, VolumeDaily.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        amount_columns = [column.name for column in table.columns if isinstance(column.type, Amount)]
+        old_types = {col["name"]: col["type"] for col in inspector.get_columns(table.name)}
+        numeric = [name for name in amount_columns if isinstance(old_types.get(name), Numeric)]
+        if not numeric:
+            continue
+        logger.info(f"Миграция: {table.name} ({', '.join(numeric)}) DECIMAL -> TEXT (sqlite)")
+        # Значения, уже сохранённые как REAL: CAST в текст оставил бы 15 значащих цифр
+        real_values = {
+            name: sync_conn.execute(
+                text(f'SELECT id, "{name}" FROM {table.name} WHERE typeof("{name}") = \'real\'')
+            ).all()
+            for name in numeric
+        }
+        if table is Transfer.__table__:
+            sync_conn.execute(text(f"DROP TABLE IF EXISTS {COMMENTS_FTS}"))  # Пересоздаст ensure_search_index
+        _rebuild_sqlite_table(sync_conn, table, {name: f'CAST("{name}" AS TEXT)' for name in numeric})
+        for name, rows in real_values.items():
+            if rows:
+                sync_conn.execute(
+                    update(table).where(table.c.id == bindparam("row_id")).values({name: bindparam("value")}),
+                    [{"row_id": row_id, "value": int(value)} for row_id, value in rows],
+                )
+
+
+def _populate_wallet_events(sync_conn):
+    """
+    Одноразовая миграция на общее хранилище событий: связи wallet_events
+    строятся из transactions.wallet_id (до миграции каждое событие принадлежало одному кошельку).
+    """
+    result = sync_conn.execute(
+        text(
+            "INSERT INTO wallet_events (wallet_id, transaction_id, lt, timestamp) "
+            "SELECT wallet_id, id, CAST(lt AS BIGINT), timestamp FROM transactions"
+        )
+    )
+    logger.info(f"Миграция: в wallet_events перенесено {result.rowcount} связей кошелёк—событие")
+
+
+def _migrate_shared_events(sync_conn):
+    """
+    Удаляет колонку wallet_id из transactions и transfers: события и переводы хранятся
+    один раз, принадлежность кошельку — в wallet_events (см. _populate_wallet_events).
+    PostgreSQL удаляет колонку на месте (вместе с её индексами и ограничениями), SQLite — пересборкой таблиц;
+    индекс комментариев FTS5 над transfers пересоздаёт затем ensure_search_index.
+    """
+    inspector = inspect(sync_conn)
+    dialect = sync_conn.dialect.name
+    for table in (Transaction.__table__, Transfer.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        if "wallet_id" not in {col["name"] for col in inspector.get_columns(table.name)}:
+            continue
+        logger.info(f"Миграция: удаление {table.name}.wallet_id ({dialect})")
+        if dialect == "postgresql":
+            sync_conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN wallet_id"))
+        elif dialect == "sqlite":
+            if table is Transfer.__table__:
+                sync_conn.execute(text(f"DROP TABLE IF EXISTS {COMMENTS_FTS}"))
+            _rebuild_sqlite_table(sync_conn, table)
+        else:
+            logger.warning(f"Миграция {table.name}.wallet_id для диалекта {dialect} не поддерживается")
+
+
+def _migrate_actions_column(sync_conn):
+    """
+    transactions.actions_json хранит закодированные actions (core.codec) — в PostgreSQL
+    колонку TEXT переводим в BYTEA (старый JSON-текст сохраняется как UTF-8 и читается как раньше).
+    В SQLite тип колонки не ограничивает значения, миграция не нужна.
+    """
+    if sync_conn.dialect.name != "postgresql":
+        return
+    inspector = inspect(sync_conn)
+    if not inspector.has_table(Transaction.__tablename__):
+        return
+    column = next(col for col in inspector.get_columns(Transaction.__tablename__) if col["name"] == "actions_json")
+    if isinstance(column["type"], LargeBinary):
+        return
+    logger.info("Миграция: transactions.actions_json TEXT -> BYTEA")
+    sync_conn.execute(
+        text("ALTER TABLE transactions ALTER COLUMN actions_json TYPE BYTEA USING convert_to(actions_json, 'UTF8')")
+    )
+
+
+def _populate_transfers(sync_conn):
+    """
+    Одноразовая миграция: заполняет только что созданную таблицу transfers
+    из actions_json уже сохранённых транзакций (пакетами по id).
+    """
+    transactions = Transaction.__table__
+    last_id, total = 0, 0
+    while True:
+        batch = sync_conn.execute(
+            select(transactions.c.id, transactions.c.timestamp, transactions.c.actions_json)
+            .where(transactions.c.id > last_id)
+            .order_by(transactions.c.id)
+            .limit(INSERT_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        rows = []
+        for tx_id, timestamp, actions_json in batch:
+            rows.extend(transfer_rows(tx_id, timestamp, decode_actions(actions_json)))
+        if rows:
+            sync_conn.execute(insert(Transfer.__table__), rows)
+            total += len(rows)
+        last_id = batch[-1].id
+    if total:
+        logger.info(f"Миграция: в transfers перенесено {total} переводов из сохранённых транзакций")
+
+
+def _populate_transfer_comments(sync_conn):
+    """
+    Одноразовая миграция после добавления колонки transfers.comment:
+    переносит комментарии переводов из actions_json уже сохранённых транзакций.
+    """
+    transactions = Transaction.__table__
+    transfers = Transfer.__table__
+    update_stmt = (
+        update(transfers)
+        .where(transfers.c.transaction_id == bindparam("tx_id"), transfers.c.action_index == bindparam("index"))
+        .values(comment=bindparam("text"))
+    )
+    last_id, total = 0, 0
+    while True:
+        batch = sync_conn.execute(
+            select(transactions.c.id, transactions.c.actions_json)
+            .where(transactions.c.id > last_id)
+            .order_by(transactions.c.id)
+            .limit(INSERT_BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+        rows = [
+            {"tx_id": tx_id, "index": transfer["action_index"], "text": transfer["comment"]}
+            for tx_id, actions_json in batch
+            for transfer in extract_transfers(decode_actions(actions_json))
+            if transfer["comment"]
+        ]
+        if rows:
+            sync_conn.execute(update_stmt, rows)
+            total += len(rows)
+        last_id = batch[-1].id
+    if total:
+        logger.info(f"Миграция: в transfers.comment перенесено {total} комментариев")
+
+
+def _populate_accounts(sync_conn):
+    """
+    Одноразовая миграция: интернирует в accounts адреса кошельков, участников переводов
+    и контрагентов, затем проставляет wallets.account_id, transfers.sender_id/recipient_id
+    и counterparty_stats.counterparty_id.
+    """
+    wallets = Wallet.__table__
+    transfers = Transfer.__table__
+    stats = CounterpartyStat.__table__
+    targets = (
+        (wallets, wallets.c.address, wallets.c.account_id),
+        (transfers, transfers.c.sender, transfers.c.sender_id),
+        (transfers, transfers.c.recipient, transfers.c.recipient_id),
+        (stats, stats.c.counterparty, stats.c.counterparty_id),
+    )
+    addresses = set()
+    for _, address_column, _ in targets:
+        addresses.update(sync_conn.execute(select(address_column).distinct()).scalars())
+    parsed = parse_addresses(addresses)
+    if not parsed:
+        return
+
+    keys = list({(address.workchain, address.hash) for address in parsed.values()})
+    for start in range(0, len(keys), INSERT_BATCH_SIZE):
+        batch = keys[start : start + INSERT_BATCH_SIZE]
+        sync_conn.execute(insert(Account.__table__), [{"workchain": wc, "hash": key} for wc, key in batch])
+    account_ids = {
+        (row.workchain, row.hash): row.id
+        for row in sync_conn.execute(select(Account.id, Account.workchain, Account.hash))
+    }
+    ids_by_address = {address: account_ids[(value.workchain, value.hash)] for address, value in parsed.items()}
+
+    for table, address_column, id_column in targets:
+        stmt = (
+            update(table)
+            .where(address_column == bindparam("address_value"))
+            .values({id_column.name: bindparam("account_value")})
+        )
+        sync_conn.execute(
+            stmt,
+            [{"address_value": address, "account_value": account_id} for address, account_id in ids_by_address.items()],
+        )
+    logger.info(f"Миграция: в accounts интернировано {len(keys)} адресов ({len(ids_by_address)} написаний)")
+
+    duplicates = sync_conn.execute(
+        select(wallets.c.account_id, func.count())
+        .where(wallets.c.account_id.is_not(None))
+        .group_by(wallets.c.account_id)
+        .having(func.count() > 1)
+    ).all()
+    for account_id, count in duplicates:
+        logger.warning(
+            f"Миграция: {count} записей wallets — разные формы адреса одного аккаунта (account_id={account_id})"
+        )
+
+
+def _populate_counterparty_stats(sync_conn):
+    """
+    Одноразовая миграция: строит counterparty_stats по уже сохранённым переводам.
+    Переводы событий кошелька (через wallet_events) группируются в SQL по (отправитель, получатель, актив),
+    направление относительно кошелька определяется в Python (адреса в разных формах).
+    """
+    transfers = Transfer.__table__
+    wallet_events = WalletEvent.__table__
+    wallet_transfers = transfers.join(wallet_events, wallet_events.c.transaction_id == transfers.c.transaction_id)
+    wallets = sync_conn.execute(select(Wallet.__table__.c.id, Wallet.__table__.c.address)).all()
+    total = 0
+    for wallet_id, address in wallets:
+        grouped = sync_conn.execute(
+            select(
+                transfers.c.sender,
+                transfers.c.recipient,
+                transfers.c.asset,
+                func.max(transfers.c.asset_symbol),
+                func.max(transfers.c.decimals),
+                func.count(),
+                func.sum(transfers.c.amount),
+                func.min(transfers.c.timestamp),
+                func.max(transfers.c.timestamp),
+            )
+            .select_from(wallet_transfers)
+            .where(wallet_events.c.wallet_id == wallet_id)
+            .where(transfers.c.type.in_(STATS_TRANSFER_TYPES))
+            .group_by(transfers.c.sender, transfers.c.recipient, transfers.c.asset)
+        ).all()
+        stats: dict = {}
+        wallet_raw = to_raw_address(address) or address
+        for row in grouped:
+            accumulate_counterparty_stat(stats, wallet_id, wallet_raw, *row)
+        if stats:
+            sync_conn.execute(insert(CounterpartyStat.__table__), list(stats.values()))
+            total += len(stats)
+    if total:
+        logger.info(f"Миграция: построено {total} строк counterparty_stats по сохранённым переводам")
+
+
+def _populate_volume_rollups(sync_conn, models):
+    """
+    Одноразовая миграция: заполняет только что созданные таблицы роллапов `models`
+    по уже сохранённым переводам (группировка по интервалу — в SQL).
+    """
+    transfers = Transfer.__table__
+    wallet_events = WalletEvent.__table__
+    wallet_transfers = transfers.join(wallet_events, wallet_events.c.transaction_id == transfers.c.transaction_id)
+    wallets = sync_conn.execute(select(Wallet.__table__.c.id, Wallet.__table__.c.address)).all()
+    for model in models:
+        bucket = (transfers.c.timestamp - transfers.c.timestamp % model.bucket_seconds).label("bucket_ts")
+        total = 0
+        for wallet_id, address in wallets:
+            grouped = sync_conn.execute(
+                select(
+                    transfers.c.sender,
+                    transfers.c.recipient,
+                    bucket,
+                    transfers.c.asset,
+                    func.max(transfers.c.asset_symbol),
+                    func.max(transfers.c.decimals),
+                    func.count(),
+                    func.sum(transfers.c.amount),
+                )
+                .select_from(wallet_transfers)
+                .where(wallet_events.c.wallet_id == wallet_id)
+                .where(transfers.c.type.in_(STATS_TRANSFER_TYPES))
+                .group_by(transfers.c.sender, transfers.c.recipient, bucket, transfers.c.asset)
+            ).all()
+            rollups: dict = {}
+            wallet_raw = to_raw_address(address) or address
+            for sender, recipient, bucket_ts, *rest in grouped:
+                direction = transfer_direction(wallet_raw, sender, recipient)
+                if direction is not None:
+                    accumulate_volume(rollups, wallet_id, bucket_ts, direction, *rest)
+            if rollups:
+                sync_conn.execute(insert(model.__table__), list(rollups.values()))
+                total += len(rollups)
+        if total:
+            logger.info(f"Миграция: построено {total} строк {model.__tablename__} по сохранённым переводам")
+
+
 async def init_db():
     """
-    Создает все таблицы (если еще не существуют).
+    Создает все таблицы (если еще не существуют) и добавляет недостающие колонки и индексы.
     """
     async with engine.begin() as conn:
+        # Таблицы, которых ещё не было, заполняются из уже сохранённых данных после create_all
+        existing_tables = await conn.run_sync(lambda sync_conn: set(inspect(sync_conn).get_table_names()))
+        transfer_columns = set()
+        if Transfer.__tablename__ in existing_tables:
+            transfer_columns = await conn.run_sync(
+                lambda sync_conn: {col["name"] for col in inspect(sync_conn).get_columns(Transfer.__tablename__)}
+            )
+        transaction_columns = set()
+        if Transaction.__tablename__ in existing_tables:
+            transaction_columns = await conn.run_sync(
+                lambda sync_conn: {col["name"] for col in inspect(sync_conn).get_columns(Transaction.__tablename__)}
+            )
         await conn.run_sync(Base.metadata.create_all)
+        # Общее хранилище событий: связи кошельков строятся до пересборки таблиц без wallet_id
+        if WalletEvent.__tablename__ not in existing_tables and "wallet_id" in transaction_columns:
+            await conn.run_sync(_populate_wallet_events)
+        await conn.run_sync(_migrate_shared_events)
+        if Transfer.__tablename__ not in existing_tables:
+            await conn.run_sync(_populate_transfers)
+        if CounterpartyStat.__tablename__ not in existing_tables:
+            await conn.run_sync(_populate_counterparty_stats)
+        new_rollups = [model for model in (VolumeHourly, VolumeDaily) if model.__tablename__ not in existing_tables]
+        if new_rollups:
+            await conn.run_sync(_populate_volume_rollups, new_rollups)
+        await conn.run_sync(_add_missing_columns)
+        if transfer_columns and "comment" not in transfer_columns:
+            await conn.run_sync(_populate_transfer_comments)
+        if Account.__tablename__ not in existing_tables:
+            await conn.run_sync(_populate_accounts)
+        await conn.run_sync(_migrate_transaction_lt)
+        await conn.run_sync(_migrate_amount_columns)
+        await conn.run_sync(_migrate_actions_column)
+        await conn.run_sync(_add_missing_indexes)
+        # Полнотекстовый поиск по Watchlist (db.search): FTS5 в SQLite, pg_trgm в PostgreSQL
+        await conn.run_sync(ensure_search_index)
+        # Словари zstd нужны для чтения и записи actions (core.codec)
+        dictionaries = (
+            await conn.execute(select(CodecDictionary.id, CodecDictionary.codec, CodecDictionary.data))
+        ).all()
+        register_dictionaries([tuple(row) for row in dictionaries])
+    # Словари, обученные позже другим процессом, подгружает load_codec_dictionaries перед чтением
     logger.info("Схема базы данных инициализирована/проверена.")
@@ -0,0 +1,234 @@
+# db/graph.py
+
+"""
+Граф связей аккаунтов по сохранённым переводам (таблица transfers).
+
+Обход в ширину от корневых аккаунтов (accounts.id). Граница (frontier) уровня раскрывается
+пакетными запросами по индексам ix_transfers_sender_id_ts / ix_transfers_recipient_id_ts,
+а не запросом на каждый узел; переводы между парой аккаунтов агрегируются в SQL в одно
+взвешенное ребро: число переводов, сумма TON, число переводов jetton, время последнего.
+Сумма ребра — по всем сохранённым переводам пары, а не по случайному срезу.
+
+Размер ответа ограничен независимо от связности кошелька. У каждого узла границы остаются
+top_k контрагентов (по числу переводов или по сумме TON — rank_by, ранжирование оконной
+функцией в SQL), а «хвост» остальных сворачивается в агрегат: один на направление узла
+(others) с числом свёрнутых контрагентов и суммарными переводами. Рёбра уровня добавляются
+от самых «тяжёлых», пока не набрано max_edges рёбер и max_nodes узлов (агрегаты считаются
+в обоих бюджетах); граница следующего уровня — только добавленные узлы, агрегаты не
+раскрываются. Каждая пара аккаунтов ранжируется один раз: top_k узла — новые контрагенты,
+а переводы не считаются дважды в рёбрах и хвостах. Если бюджет обрезал граф, это отражается
+в результате (truncated, dropped_edges).
+"""
+
+from decimal import Decimal
+from typing import Iterable, Literal, NamedTuple
+
+from sqlalchemy import Numeric, case, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Transfer
+
+# Аккаунтов границы в одном запросе (IN-список; лимит параметров SQLite — 32766)
+FRONTIER_BATCH_SIZE = 500
+# Для порога min_value: сумма перевода сравнивается в минимальных единицах актива
+_MAX_DECIMALS = 18
+
+RankBy = Literal["count", "volume"]
+
+
+class GraphEdgeStats(NamedTuple):
+    count: int  # Переводов от sender к recipient
+    ton_amount: int  # nanoTON
+    jetton_count: int
+    last_ts: int
+
+
+class PrunedTail(NamedTuple):
+    counterparties: int  # Контрагентов, свёрнутых в агрегат
+    stats: GraphEdgeStats  # Их переводы, сложенные в одно ребро
+
+
+class ConnectionGraph(NamedTuple):
+    nodes: dict  # account_id -> уровень (0 — корень)
+    edges: dict  # (sender_id, recipient_id) -> GraphEdgeStats
+    truncated: bool  # Бюджет узлов или рёбер обрезал граф
+    others: dict  # (account_id, "in" | "out") -> PrunedTail: хвост контрагентов за пределами top_k
+    dropped_edges: int  # Рёбер и агрегатов, не вошедших в бюджеты max_nodes / max_edges
+
+
+def _min_amount_clause(min_value: float):
+    """Перевод не меньше min_value единиц актива: порог в минимальных единицах по decimals перевода."""
+    value = Decimal(str(min_value))
+    thresholds = {decimals: value.scaleb(decimals) for decimals in range(_MAX_DECIMALS + 1)}
+    # transfers.amount в SQLite — строка (db.models.Amount): сравнение и сумма — по числовому значению
+    return cast(Transfer.amount, Numeric) >= case(thresholds, value=Transfer.decimals, else_=value.scaleb(9))
+
+
+def _ranked_edges(side, accounts: list[int], filters: list, rank_by: RankBy):
+    """
+    Агрегированные рёбра, у которых `side` (sender_id или recipient_id) — один из accounts,
+    с местом ребра среди контрагентов своего аккаунта (rank, 1 — самое «тяжёлое»).
+    """
+    count = func.count()
+    ton_amount = func.sum(case((Transfer.asset.is_(None), cast(Transfer.amount, Numeric)), else_=0))
+    order = (ton_amount.desc(), count.desc()) if rank_by == "volume" else (count.desc(), ton_amount.desc())
+    return (
+        select(
+            side.label("account_id"),
+            Transfer.sender_id,
+            Transfer.recipient_id,
+            count.label("count"),
+            ton_amount.label("ton_amount"),
+            func.sum(case((Transfer.asset.is_not(None), 1), else_=0)).label("jetton_count"),
+            func.max(Transfer.timestamp).label("last_ts"),
+            func.row_number().over(partition_by=side, order_by=order).label("rank"),
+        )
+        .where(side.in_(accounts), *filters)
+        .group_by(Transfer.sender_id, Transfer.recipient_id)
+        .subquery()
+    )
+
+
+def _edges_stmt(ranked, top_k: int, limit: int):
+    """top_k рёбер каждого аккаунта; при лимите сначала первые места всех аккаунтов, потом вторые и т.д."""
+    return select(ranked).where(ranked.c.rank <= top_k).order_by(ranked.c.rank).limit(limit)
+
+
+def _tails_stmt(ranked, top_k: int):
+    """Хвост каждого аккаунта за пределами top_k — одной строкой на аккаунт."""
+    return (
+        select(
+            ranked.c.account_id,
+            func.count().label("counterparties"),
+            func.sum(ranked.c.count).label("count"),
+            func.sum(ranked.c.ton_amount).label("ton_amount"),
+            func.sum(ranked.c.jetton_count).label("jetton_count"),
+            func.max(ranked.c.last_ts).label("last_ts"),
+        )
+        .where(ranked.c.rank > top_k)
+        .group_by(ranked.c.account_id)
+    )
+
+
+async def transfers_version(session: AsyncSession, accounts: Iterable[int], upto: int | None = None) -> tuple:
+    """
+    Версия переводов аккаунтов: число и наибольший transfers.id переводов, где один из accounts —
+    отправитель или получатель (upto — только переводы с id не выше). Меняется при сохранении любого
+    перевода аккаунта, каким бы кошельком он ни был загружен, и при удалении переводов архивом.
+    """
+    accounts = sorted(set(accounts))
+    count, last_id = 0, 0
+    for start in range(0, len(accounts), FRONTIER_BATCH_SIZE):
+        batch = accounts[start : start + FRONTIER_BATCH_SIZE]
+        for side in (Transfer.sender_id, Transfer.recipient_id):
+            stmt = select(func.count(), func.max(Transfer.id)).where(side.in_(batch))
+            if upto is not None:
+                stmt = stmt.where(Transfer.id <= upto)
+            side_count, side_last_id = (await session.execute(stmt)).one()
+            count, last_id = count + side_count, max(last_id, side_last_id or 0)
+    return count, last_id
+
+
+def _edge_stats(row) -> GraphEdgeStats:
+    return GraphEdgeStats(int(row.count), int(row.ton_amount or 0), int(row.jetton_count or 0), row.last_ts)
+
+
+async def expand_graph(
+    session: AsyncSession,
+    roots: Iterable[int],
+    depth: int,
+    max_nodes: int,
+    max_edges: int,
+    incoming: bool = True,
+    outgoing: bool = True,
+    jetton_only: bool = False,
+    min_value: float = 0.0,
+    top_k: int | None = None,
+    rank_by: RankBy = "count",
+) -> ConnectionGraph:
+    """
+    Граф на `depth` шагов от roots. incoming/outgoing относятся к корням: без incoming
+    не берутся переводы в корневые аккаунты, без outgoing — из них.
+    top_k — контрагентов на направление узла (None — без свёртки хвоста, только бюджеты).
+    """
+    roots = list(dict.fromkeys(roots))
+    nodes = {account_id: 0 for account_id in roots}
+    edges = {}
+    others = {}
+    truncated = False
+    dropped_edges = 0
+    collapse = top_k is not None
+    top_k = top_k if collapse else max_edges
+
+    filters = [
+        Transfer.type.in_(("JettonTransfer",) if jetton_only else ("TonTransfer", "JettonTransfer")),
+        Transfer.sender_id.is_not(None),
+        Transfer.recipient_id.is_not(None),
+    ]
+    if min_value > 0:
+        filters.append(_min_amount_clause(min_value))
+    if not incoming:
+        filters.append(Transfer.recipient_id.not_in(roots))
+    if not outgoing:
+        filters.append(Transfer.sender_id.not_in(roots))
+
+    def _weight(stats: GraphEdgeStats) -> tuple:
+        if rank_by == "volume":
+            return stats.ton_amount, stats.count, stats.last_ts
+        return stats.count, stats.ton_amount, stats.last_ts
+
+    frontier = roots
+    for level in range(depth):
+        if not frontier or len(edges) + len(others) >= max_edges:
+            break
+        # Пары с уже раскрытыми узлами учтены на прошлых уровнях (ребром, хвостом или dropped_edges):
+        # они не занимают места в top_k и не попадают в хвост второй раз. Пара двух узлов границы
+        # ранжируется один раз — среди исходящих отправителя
+        expanded = [account_id for account_id, account_level in nodes.items() if account_level < level]
+        side_filters = {
+            "out": [Transfer.recipient_id.not_in(expanded)] if expanded else [],
+            "in": [Transfer.sender_id.not_in(expanded + frontier)],
+        }
+        candidates = {}
+        tails = {}
+        for start in range(0, len(frontier), FRONTIER_BATCH_SIZE):
+            batch = frontier[start : start + FRONTIER_BATCH_SIZE]
+            # Исходящие и входящие — отдельными запросами: каждый идёт по своему индексу
+            for side, direction in ((Transfer.sender_id, "out"), (Transfer.recipient_id, "in")):
+                ranked = _ranked_edges(side, batch, filters + side_filters[direction], rank_by)
+                rows = (await session.execute(_edges_stmt(ranked, top_k, max_edges))).all()
+                truncated = truncated or len(rows) >= max_edges  # Остальные рёбра пакета не прочитаны
+                for row in rows:
+                    key = (row.sender_id, row.recipient_id)
+                    if key not in edges:
+                        candidates[key] = _edge_stats(row)
+                if not collapse:
+                    continue
+                for row in await session.execute(_tails_stmt(ranked, top_k)):
+                    tails[(row.account_id, direction)] = PrunedTail(row.counterparties, _edge_stats(row))
+
+        next_frontier = []
+        for key, stats in sorted(candidates.items(), key=lambda item: _weight(item[1]), reverse=True):
+            if len(edges) + len(others) >= max_edges:
+                truncated = True
+                dropped_edges += 1
+                continue
+            new_nodes = [account_id for account_id in dict.fromkeys(key) if account_id not in nodes]
+            if len(nodes) + len(others) + len(new_nodes) > max_nodes:
+                truncated = True
+                dropped_edges += 1
+                continue
+            for account_id in new_nodes:
+                nodes[account_id] = level + 1
+                next_frontier.append(account_id)
+            edges[key] = stats
+        # Агрегаты хвостов — после рёбер уровня: узел-агрегат и ребро к нему занимают место в обоих бюджетах
+        for key, tail in sorted(tails.items(), key=lambda item: _weight(item[1].stats), reverse=True):
+            if len(nodes) + len(others) >= max_nodes or len(edges) + len(others) >= max_edges:
+                truncated = True
+                dropped_edges += 1
+                continue
+            others[key] = tail
+        frontier = next_frontier
+
+    return ConnectionGraph(nodes, edges, truncated, others, dropped_edges)
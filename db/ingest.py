@@ -0,0 +1,470 @@
+# db/ingest.py
+
+"""
+Массовая запись данных TonAPI в БД.
+
+Вставка идёт пакетами Core-строк (без создания ORM-объектов) через
+`INSERT ... ON CONFLICT DO NOTHING`, поэтому повторная или конкурентная запись
+того же события (второй наблюдатель кошелька, параллельный запрос) не ломает весь пакет.
+
+События хранятся один раз (transactions, уникальны по event_id) вместе с разобранными
+переводами; кошелёк связывается с ними лёгкими строками wallet_events. Событие, которое
+уже сохранено для другого кошелька, только получает новую связь.
+"""
+
+import logging
+import operator
+import os
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.actions import extract_transfers
+from core.address import TonAddress, parse_address, to_raw_address
+from core.codec import encode_actions
+from .models import (
+    Account,
+    Transaction,
+    Transfer,
+    BackfillJob,
+    CounterpartyStat,
+    Wallet,
+    WalletEvent,
+    VolumeHourly,
+    VolumeDaily,
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк отправлять в одном INSERT (ограничено числом параметров запроса)
+INSERT_BATCH_SIZE = int(os.getenv("INSERT_BATCH_SIZE", "500"))
+
+_DIALECT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def _chunks(rows: list, size: int) -> Iterable[list]:
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+# Переводы, которые учитываются в counterparty_stats (у NFT нет суммы)
+STATS_TRANSFER_TYPES = ("TonTransfer", "JettonTransfer")
+TON_ASSET = "TON"
+ROLLUP_MODELS = (VolumeHourly, VolumeDaily)
+
+
+def _dialect_insert(session: AsyncSession, table):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта БД."""
+    dialect = session.get_bind().dialect.name
+    insert_fn = _DIALECT_INSERTS.get(dialect)
+    if insert_fn is None:
+        raise NotImplementedError(f"ON CONFLICT не поддерживается для диалекта {dialect}")
+    return insert_fn(table)
+
+
+def _insert_ignore_stmt(session: AsyncSession, table):
+    """INSERT ... ON CONFLICT DO NOTHING для текущего диалекта БД."""
+    return _dialect_insert(session, table).on_conflict_do_nothing()
+
+
+def parse_addresses(addresses: Iterable[str]) -> dict[str, TonAddress]:
+    """Разбирает адреса (в любой форме); некорректные пропускаются."""
+    parsed = {}
+    for address in set(addresses):
+        ton_address = parse_address(address)
+        if ton_address is not None:
+            parsed[address] = ton_address
+    return parsed
+
+
+def account_ids_stmt(keys: list[tuple[int, bytes]]):
+    """SELECT id аккаунтов по списку (workchain, hash)."""
+    table = Account.__table__
+    return select(table.c.id, table.c.workchain, table.c.hash).where(tuple_(table.c.workchain, table.c.hash).in_(keys))
+
+
+async def intern_accounts(
+    session: AsyncSession, addresses: Iterable[str], batch_size: int = INSERT_BATCH_SIZE
+) -> dict[str, int]:
+    """
+    Интернирует адреса в таблицу accounts и возвращает {адрес (как передан) -> accounts.id}.
+    EQ.../UQ.../raw-формы одного аккаунта получают один id; некорректные адреса в результат не попадают.
+    """
+    parsed = parse_addresses(addresses)
+    if not parsed:
+        return {}
+    keys = list({(address.workchain, address.hash) for address in parsed.values()})
+    stmt = _insert_ignore_stmt(session, Account.__table__)
+    ids = {}
+    for batch in _chunks(keys, batch_size):
+        await session.execute(stmt, [{"workchain": workchain, "hash": key} for workchain, key in batch])
+        ids.update({(row.workchain, row.hash): row.id for row in await session.execute(account_ids_stmt(batch))})
+    return {address: ids[(parsed_address.workchain, parsed_address.hash)] for address, parsed_address in parsed.items()}
+
+
+def event_to_transaction_row(event: dict) -> dict:
+    """Преобразует событие TonAPI (/accounts/{id}/events) в строку таблицы transactions."""
+    return {
+        "event_id": event.get("event_id"),
+        "lt": int(event.get("lt", 0)),
+        "timestamp": event.get("timestamp"),
+        "is_scam_event": event.get("is_scam", False),
+        "actions_json": encode_actions(event.get("actions", [])),  # Компактный бинарный формат (core.codec)
+    }
+
+
+async def insert_transactions_returning(
+    session: AsyncSession, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE
+) -> list[tuple[int, str]]:
+    """
+    Идемпотентно вставляет строки в transactions пакетами по `batch_size`.
+    Уже существующие события (конфликт по event_id) пропускаются на стороне БД.
+    Возвращает (id, event_id) реально вставленных строк.
+    """
+    if not rows:
+        return []
+
+    table = Transaction.__table__
+    # RETURNING возвращает только вставленные строки — одинаково для SQLite и PostgreSQL
+    stmt = _insert_ignore_stmt(session, table).returning(table.c.id, table.c.event_id)
+
+    inserted = []
+    for batch in _chunks(rows, batch_size):
+        result = await session.execute(stmt, batch)
+        inserted.extend((row.id, row.event_id) for row in result)
+    return inserted
+
+
+async def insert_transactions(session: AsyncSession, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE) -> int:
+    """Как insert_transactions_returning, но возвращает только количество вставленных строк."""
+    return len(await insert_transactions_returning(session, rows, batch_size))
+
+
+async def transaction_ids(
+    session: AsyncSession, event_ids: list[str], batch_size: int = INSERT_BATCH_SIZE
+) -> dict[str, int]:
+    """{event_id -> transactions.id} для уже сохранённых событий."""
+    ids = {}
+    for batch in _chunks(event_ids, batch_size):
+        stmt = select(Transaction.id, Transaction.event_id).where(Transaction.event_id.in_(batch))
+        ids.update({row.event_id: row.id for row in await session.execute(stmt)})
+    return ids
+
+
+async def link_wallet_events(session: AsyncSession, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE) -> set[int]:
+    """
+    Идемпотентно связывает кошелёк с событиями (строки wallet_events).
+    Возвращает transaction_id событий, которые связаны с кошельком впервые.
+    """
+    if not rows:
+        return set()
+    table = WalletEvent.__table__
+    stmt = _insert_ignore_stmt(session, table).returning(table.c.transaction_id)
+    linked = set()
+    for batch in _chunks(rows, batch_size):
+        linked.update((await session.execute(stmt, batch)).scalars())
+    return linked
+
+
+def transfer_rows(transaction_id: int, timestamp: int, actions: list[dict]) -> list[dict]:
+    """Строки таблицы transfers для одной сохранённой транзакции."""
+    return [
+        {"transaction_id": transaction_id, "timestamp": timestamp, **transfer}
+        for transfer in extract_transfers(actions)
+    ]
+
+
+async def insert_transfers(session: AsyncSession, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE) -> int:
+    """Идемпотентно вставляет переводы (конфликт по transaction_id + action_index пропускается)."""
+    if not rows:
+        return 0
+    table = Transfer.__table__
+    stmt = _insert_ignore_stmt(session, table).returning(table.c.id)
+    inserted = 0
+    for batch in _chunks(rows, batch_size):
+        result = await session.execute(stmt, batch)
+        inserted += len(result.all())
+    return inserted
+
+
+def transfer_direction(wallet_raw: str, sender: str, recipient: str) -> Optional[str]:
+    """"out"/"in" относительно кошелька (raw-адрес) или None, если кошелёк в переводе не участвует."""
+    if to_raw_address(sender) == wallet_raw:
+        return "out"
+    if to_raw_address(recipient) == wallet_raw:
+        return "in"
+    return None
+
+
+def accumulate_counterparty_stat(
+    stats: dict,
+    wallet_id: int,
+    wallet_raw: str,
+    sender: str,
+    recipient: str,
+    asset: Optional[str],
+    asset_symbol: Optional[str],
+    decimals: int,
+    count: int,
+    amount,
+    first_ts: Optional[int],
+    last_ts: Optional[int],
+) -> None:
+    """
+    Добавляет в `stats` ((контрагент, актив) -> строка counterparty_stats) `count` переводов
+    на сумму `amount` между кошельком и контрагентом. Направление определяется по raw-адресу
+    кошелька; переводы, где кошелёк не участвует, пропускаются.
+    """
+    direction = transfer_direction(wallet_raw, sender, recipient)
+    if direction is None:
+        return
+    counterparty = recipient if direction == "out" else sender
+    counterparty = to_raw_address(counterparty) or counterparty  # Разные формы адреса — одна строка агрегатов
+
+    asset = asset or TON_ASSET
+    row = stats.get((counterparty, asset))
+    if row is None:
+        row = stats[(counterparty, asset)] = {
+            "wallet_id": wallet_id,
+            "counterparty": counterparty,
+            "asset": asset,
+            "asset_symbol": asset_symbol,
+            "decimals": decimals,
+            "in_count": 0,
+            "out_count": 0,
+            "in_amount": 0,
+            "out_amount": 0,
+            "first_ts": first_ts,
+            "last_ts": last_ts,
+        }
+    row[f"{direction}_count"] += count
+    row[f"{direction}_amount"] += int(amount or 0)
+    if first_ts is not None:
+        row["first_ts"] = first_ts if row["first_ts"] is None else min(row["first_ts"], first_ts)
+    if last_ts is not None:
+        row["last_ts"] = last_ts if row["last_ts"] is None else max(row["last_ts"], last_ts)
+
+
+def counterparty_stat_rows(wallet_id: int, wallet_address: str, transfers: list[dict]) -> list[dict]:
+    """Агрегирует строки transfers одного кошелька в строки counterparty_stats (по одной на ключ)."""
+    wallet_raw = to_raw_address(wallet_address) or wallet_address
+    stats: dict = {}
+    for transfer in transfers:
+        if transfer["type"] not in STATS_TRANSFER_TYPES:
+            continue
+        accumulate_counterparty_stat(
+            stats,
+            wallet_id,
+            wallet_raw,
+            transfer["sender"],
+            transfer["recipient"],
+            transfer["asset"],
+            transfer["asset_symbol"],
+            transfer["decimals"],
+            1,
+            transfer["amount"],
+            transfer["timestamp"],
+            transfer["timestamp"],
+        )
+    return list(stats.values())
+
+
+def _amount_adder(session: AsyncSession):
+    """Сложение колонок Amount в SQL: в SQLite — функцией amount_add (числа вне int64 он складывает как REAL)."""
+    if session.get_bind().dialect.name == "sqlite":
+        return func.amount_add
+    return operator.add
+
+
+async def upsert_counterparty_stats(
+    session: AsyncSession, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE
+) -> None:
+    """Прибавляет агрегаты пачки к counterparty_stats (INSERT ... ON CONFLICT DO UPDATE)."""
+    if not rows:
+        return
+    table = CounterpartyStat.__table__
+    stmt = _dialect_insert(session, table)
+    # SQLite: скалярные min/max от двух аргументов, PostgreSQL: LEAST/GREATEST
+    if session.get_bind().dialect.name == "sqlite":
+        least, greatest = func.min, func.max
+    else:
+        least, greatest = func.least, func.greatest
+    add_amount = _amount_adder(session)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["wallet_id", "counterparty", "asset"],
+        set_={
+            "in_count": table.c.in_count + excluded.in_count,
+            "out_count": table.c.out_count + excluded.out_count,
+            "in_amount": add_amount(table.c.in_amount, excluded.in_amount),
+            "out_amount": add_amount(table.c.out_amount, excluded.out_amount),
+            "counterparty_id": func.coalesce(table.c.counterparty_id, excluded.counterparty_id),
+            "first_ts": least(func.coalesce(table.c.first_ts, excluded.first_ts), excluded.first_ts),
+            "last_ts": greatest(func.coalesce(table.c.last_ts, excluded.last_ts), excluded.last_ts),
+            "asset_symbol": func.coalesce(excluded.asset_symbol, table.c.asset_symbol),
+        },
+    )
+    for batch in _chunks(rows, batch_size):
+        await session.execute(stmt, batch)
+
+
+def accumulate_volume(
+    rollups: dict,
+    wallet_id: int,
+    bucket_ts: int,
+    direction: str,
+    asset: Optional[str],
+    asset_symbol: Optional[str],
+    decimals: int,
+    count: int,
+    amount,
+) -> None:
+    """Добавляет `count` переводов на `amount` в строку роллапа (bucket_ts, актив)."""
+    asset = asset or TON_ASSET
+    row = rollups.get((bucket_ts, asset))
+    if row is None:
+        row = rollups[(bucket_ts, asset)] = {
+            "wallet_id": wallet_id,
+            "bucket_ts": bucket_ts,
+            "asset": asset,
+            "asset_symbol": asset_symbol,
+            "decimals": decimals,
+            "in_count": 0,
+            "out_count": 0,
+            "in_amount": 0,
+            "out_amount": 0,
+        }
+    row[f"{direction}_count"] += count
+    row[f"{direction}_amount"] += int(amount or 0)
+
+
+def volume_rollup_rows(wallet_id: int, wallet_address: str, transfers: list[dict], bucket_seconds: int) -> list[dict]:
+    """Агрегирует строки transfers кошелька в строки роллапа с шагом `bucket_seconds`."""
+    wallet_raw = to_raw_address(wallet_address) or wallet_address
+    rollups: dict = {}
+    for transfer in transfers:
+        if transfer["type"] not in STATS_TRANSFER_TYPES:
+            continue
+        direction = transfer_direction(wallet_raw, transfer["sender"], transfer["recipient"])
+        if direction is None:
+            continue
+        accumulate_volume(
+            rollups,
+            wallet_id,
+            transfer["timestamp"] - transfer["timestamp"] % bucket_seconds,
+            direction,
+            transfer["asset"],
+            transfer["asset_symbol"],
+            transfer["decimals"],
+            1,
+            transfer["amount"],
+        )
+    return list(rollups.values())
+
+
+async def upsert_volume_rollups(session: AsyncSession, model, rows: list[dict], batch_size: int = INSERT_BATCH_SIZE):
+    """Прибавляет строки пачки к таблице роллапа `model` (VolumeHourly / VolumeDaily)."""
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _dialect_insert(session, table)
+    add_amount = _amount_adder(session)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["wallet_id", "bucket_ts", "asset"],
+        set_={
+            "in_count": table.c.in_count + excluded.in_count,
+            "out_count": table.c.out_count + excluded.out_count,
+            "in_amount": add_amount(table.c.in_amount, excluded.in_amount),
+            "out_amount": add_amount(table.c.out_amount, excluded.out_amount),
+            "asset_symbol": func.coalesce(excluded.asset_symbol, table.c.asset_symbol),
+        },
+    )
+    for batch in _chunks(rows, batch_size):
+        await session.execute(stmt, batch)
+
+
+async def store_events(
+    session: AsyncSession, wallet_id: int, events: list[dict], wallet_address: Optional[str] = None
+) -> int:
+    """
+    Сохраняет события TonAPI кошелька и разобранные из них переводы;
+    возвращает количество событий, впервые связанных с кошельком.
+    Событие и его переводы пишутся в общее хранилище один раз: если событие уже сохранено
+    для другого кошелька, добавляется только связь в wallet_events.
+    Агрегаты по контрагентам (counterparty_stats) и роллапы объёмов по часам/дням
+    обновляются для впервые связанных событий, в той же транзакции БД;
+    участники переводов интернируются в accounts.
+    """
+    events_by_id = {event.get("event_id"): event for event in events}
+    if not events_by_id:
+        return 0
+    inserted = await insert_transactions_returning(
+        session, [event_to_transaction_row(event) for event in events_by_id.values()]
+    )
+    ids = {event_id: transaction_id for transaction_id, event_id in inserted}
+    # Остальные события уже в хранилище (сохранены для другого кошелька или ранее) — нужны только их id
+    ids.update(await transaction_ids(session, [event_id for event_id in events_by_id if event_id not in ids]))
+
+    linked = await link_wallet_events(
+        session,
+        [
+            {
+                "wallet_id": wallet_id,
+                "transaction_id": transaction_id,
+                "lt": int(events_by_id[event_id].get("lt", 0)),
+                "timestamp": events_by_id[event_id].get("timestamp"),
+            }
+            for event_id, transaction_id in ids.items()
+        ],
+    )
+    if not linked:
+        return 0
+
+    new_transaction_ids = {transaction_id for transaction_id, _ in inserted}
+    transfers = []
+    for event_id, transaction_id in ids.items():
+        if transaction_id in linked:
+            event = events_by_id[event_id]
+            transfers.extend(transfer_rows(transaction_id, event.get("timestamp"), event.get("actions", [])))
+    if not transfers:
+        return len(linked)
+
+    # Участники переводов интернируются в accounts: соединения и граф идут по целочисленным id
+    account_ids = await intern_accounts(
+        session, [address for transfer in transfers for address in (transfer["sender"], transfer["recipient"])]
+    )
+    for transfer in transfers:
+        transfer["sender_id"] = account_ids.get(transfer["sender"])
+        transfer["recipient_id"] = account_ids.get(transfer["recipient"])
+    # Переводы уже сохранённого события есть в хранилище — пишутся только переводы новых событий
+    await insert_transfers(
+        session, [transfer for transfer in transfers if transfer["transaction_id"] in new_transaction_ids]
+    )
+
+    if wallet_address is None:
+        wallet_address = await session.scalar(select(Wallet.address).where(Wallet.id == wallet_id))
+    stat_rows = counterparty_stat_rows(wallet_id, wallet_address, transfers)
+    for row in stat_rows:
+        row["counterparty_id"] = account_ids.get(row["counterparty"])
+    await upsert_counterparty_stats(session, stat_rows)
+    for model in ROLLUP_MODELS:
+        await upsert_volume_rollups(
+            session, model, volume_rollup_rows(wallet_id, wallet_address, transfers, model.bucket_seconds)
+        )
+    return len(linked)
+
+
+async def create_backfill_jobs(session: AsyncSession, wallet_ids: list[int]) -> int:
+    """Ставит кошельки в очередь догрузки истории (уже поставленные пропускаются)."""
+    if not wallet_ids:
+        return 0
+    table = BackfillJob.__table__
+    stmt = _insert_ignore_stmt(session, table).returning(table.c.id)
+    result = await session.execute(stmt, [{"wallet_id": wallet_id} for wallet_id in wallet_ids])
+    return len(result.all())
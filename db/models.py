@@ -1,12 +1,84 @@
 # db/models.py
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, UniqueConstraint, DECIMAL, Boolean, TEXT
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import (
+    Column,
+    Integer,
+    BigInteger,
+    String,
+    ForeignKey,
+    DateTime,
+    UniqueConstraint,
+    DECIMAL,
+    Boolean,
+    Float,
+    TEXT,
+    Index,
+    LargeBinary,
+    TypeDecorator,
+)
+from sqlalchemy.orm import declarative_base, declared_attr, relationship
 import datetime
+from decimal import Decimal
 
 Base = declarative_base()
 
 
+class ActionsPayload(TypeDecorator):
+    """
+    Закодированные actions события (core.codec). Старые значения, записанные JSON-текстом
+    (в SQLite хранятся как TEXT), возвращаются как bytes — декодирует их core.codec.decode_actions.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value.encode("utf-8") if isinstance(value, str) else value
+
+    def process_result_value(self, value, dialect):
+        return value.encode("utf-8") if isinstance(value, str) else value
+
+
+class Amount(TypeDecorator):
+    """
+    Сумма в минимальных единицах актива (целое до 40 знаков). PostgreSQL хранит её как NUMERIC(40, 0),
+    SQLite — десятичной строкой: числа вне int64 он хранит и складывает как REAL с потерей точности.
+    Читается как Decimal. Складывать суммы в SQLite — функцией amount_add (add_amounts, см. db.db_init).
+    """
+
+    impl = DECIMAL(precision=40, scale=0)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "sqlite":
+            return dialect.type_descriptor(TEXT())
+        return dialect.type_descriptor(self.impl)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return str(int(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else Decimal(str(value))
+
+
+def add_amounts(left, right):
+    """amount_add(a, b) для SQLite: точная сумма двух значений Amount (строки, целые или старые REAL)."""
+    if left is None or right is None:
+        return None
+    return str(int(Decimal(str(left))) + int(Decimal(str(right))))
+
+
+class Account(Base):  # Интернированные адреса TON: любая форма адреса -> один целочисленный id (core.address)
+    __tablename__ = "accounts"
+    id = Column(Integer, primary_key=True)
+    workchain = Column(Integer, nullable=False)
+    hash = Column(LargeBinary(32), nullable=False)  # 32-байтовый хеш аккаунта
+
+    __table_args__ = (UniqueConstraint("workchain", "hash", name="_account_uc"),)
+
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -24,6 +96,8 @@ class Wallet(Base):
     __tablename__ = "wallets"
     id = Column(Integer, primary_key=True, index=True)
     address = Column(String, unique=True, nullable=False, index=True)
+    # Аккаунт адреса: EQ.../UQ.../raw-формы одного кошелька сводятся к одному account_id
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True, index=True)
     # Дополнительные поля, которые могут обновляться фоново
     last_balance_ton = Column(
         DECIMAL(precision=20, scale=9), nullable=True
@@ -35,9 +109,23 @@ class Wallet(Base):
     is_scam = Column(Boolean, default=False, nullable=True)
     # Можно добавить поле для последней проверки на скам или других метаданных от TonAPI
 
+    # Курсор инкрементальной синхронизации: последнее уже сохранённое событие TonAPI.
+    # Плановое обновление дочитывает только события новее sync_cursor_lt.
+    sync_cursor_lt = Column(BigInteger, nullable=True)
+    sync_cursor_event_id = Column(String, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)  # Время последней синхронизации событий
+
+    # Адаптивное опитування (core.polling): когда обновлять кошелёк в следующий раз
+    # и сглаженная активность — новых событий в час
+    next_sync_at = Column(DateTime, nullable=True, index=True)
+    activity_rate = Column(Float, nullable=True)
+
     users = relationship("UserWallet", back_populates="wallet")
+    backfill_job = relationship("BackfillJob", back_populates="wallet", uselist=False, cascade="all, delete-orphan")
+    event_links = relationship("WalletEvent", back_populates="wallet", cascade="all, delete-orphan")
+    # События кошелька из общего хранилища (через wallet_events), только чтение
     transactions = relationship(
-        "Transaction", back_populates="wallet", cascade="all, delete-orphan", order_by="desc(Transaction.timestamp)"
+        "Transaction", secondary="wallet_events", viewonly=True, order_by="desc(Transaction.timestamp)"
     )
 
 
@@ -58,33 +146,162 @@ class UserWallet(Base):
     __table_args__ = (UniqueConstraint("user_id", "wallet_id", name="_user_wallet_uc"),)
 
 
-class Transaction(Base):  # Новая таблица для локального хранения транзакций
+class Transaction(Base):  # Общее хранилище событий: одно событие TonAPI — одна строка для всех кошельков
     __tablename__ = "transactions"
     id = Column(Integer, primary_key=True, index=True)
-    wallet_id = Column(
-        Integer, ForeignKey("wallets.id"), nullable=False, index=True
-    )
-    event_id = Column(String, unique=True, nullable=False, index=True)  # Уникальный ID события из TonAPI
-    lt = Column(String, nullable=False)  # Логическое время транзакции (важно для сортировки и уникальности)
+    event_id = Column(String, unique=True, nullable=False, index=True)  # Уникальный ID (хеш) события из TonAPI
+    lt = Column(BigInteger, nullable=False)  # Логическое время транзакции (важно для сортировки и уникальности)
     timestamp = Column(Integer, nullable=False, index=True)  # UNIX timestamp
     is_scam_event = Column(Boolean, default=False)
 
-    # Сохраняем все действия в JSON, так как их структура может быть разнообразной
-    actions_json = Column(TEXT, nullable=False)  # JSON строка со списком actions из события TonAPI
+    # Сохраняем все действия события, так как их структура может быть разнообразной.
+    # Кодек (MessagePack/CBOR + zstd или JSON) определяется первым байтом — см. core.codec
+    actions_json = Column(ActionsPayload, nullable=False)
 
     # Обобщенные поля для быстрого доступа и фильтрации (можно заполнять при сохранении)
     # main_action_type = Column(String, nullable=True) # Тип основного действия (TonTransfer, JettonTransfer и т.д.)
     # involved_address = Column(String, nullable=True, index=True) # Основной контрагент (если применимо)
 
-    wallet = relationship("Wallet", back_populates="transactions")
+    wallet_links = relationship("WalletEvent", back_populates="transaction", cascade="all, delete-orphan")
+    transfers = relationship("Transfer", back_populates="transaction", cascade="all, delete-orphan")
+
+
+class WalletEvent(Base):  # Связь кошелька с событием из общего хранилища (многие ко многим)
+    __tablename__ = "wallet_events"
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), primary_key=True)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), primary_key=True)
+    # Копия lt и timestamp события: лента и курсоры кошелька читаются без обращения к тяжёлой таблице
+    lt = Column(BigInteger, nullable=False)
+    timestamp = Column(Integer, nullable=False)
+
+    wallet = relationship("Wallet", back_populates="event_links")
+    transaction = relationship("Transaction", back_populates="wallet_links")
+
+    __table_args__ = (
+        # Лента кошелька (история, экспорт): фильтр по wallet_id и сортировка по времени без отдельной сортировки.
+        # В PostgreSQL lt и transaction_id включены в индекс — keyset-выборки идут index-only scan.
+        Index("ix_wallet_events_wallet_ts", wallet_id, timestamp.desc(), postgresql_include=["lt", "transaction_id"]),
+        # Курсоры синхронизации и диапазоны по логическому времени (числовой range scan)
+        Index("ix_wallet_events_wallet_lt", wallet_id, lt),
+        # Обратный поиск: какие кошельки ссылаются на событие (архивация, поиск по комментариям)
+        Index("ix_wallet_events_transaction_id", transaction_id),
+    )
+
+
+class Transfer(Base):  # Переводы, разобранные из actions события при сохранении (core.actions)
+    __tablename__ = "transfers"
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=False)  # Событие (общее для кошельков)
+    action_index = Column(Integer, nullable=False)  # Позиция action внутри события
+    type = Column(String, nullable=False)  # TonTransfer / JettonTransfer / NftItemTransfer
+    sender = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    # Аккаунты отправителя и получателя (accounts.id) — ключи соединений и узлов графа
+    sender_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    recipient_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    asset = Column(String, nullable=True)  # Адрес jetton master / NFT; NULL — TON
+    asset_symbol = Column(String, nullable=True)
+    amount = Column(Amount, nullable=True)  # В минимальных единицах (nanoTON и т.п.)
+    decimals = Column(Integer, nullable=False, default=9)
+    timestamp = Column(Integer, nullable=False)  # UNIX timestamp события
+    comment = Column(TEXT, nullable=True)  # Комментарий перевода (индексируется для поиска, см. db.search)
+
+    transaction = relationship("Transaction", back_populates="transfers")
 
     __table_args__ = (
-        UniqueConstraint("wallet_id", "event_id", name="_wallet_event_uc"),
-        # Можно добавить индекс по timestamp для более быстрых запросов по дате
-        # Index('ix_transaction_timestamp', 'timestamp'),
+        UniqueConstraint("transaction_id", "action_index", name="_transfer_action_uc"),
+        Index("ix_transfers_sender_ts", "sender", "timestamp"),
+        Index("ix_transfers_recipient_ts", "recipient", "timestamp"),
+        Index("ix_transfers_sender_id_ts", "sender_id", "timestamp"),
+        Index("ix_transfers_recipient_id_ts", "recipient_id", "timestamp"),
     )
 
 
+class BackfillJob(Base):  # Догрузка полной истории событий кошелька из TonAPI
+    __tablename__ = "backfill_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False, unique=True)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending / running / done / failed
+    # Контрольная точка: следующая страница запрашивается с before_lt (сохраняется после каждой страницы)
+    before_lt = Column(BigInteger, nullable=True)
+    start_lt = Column(BigInteger, nullable=True)  # lt самого нового события на момент старта
+    target_lt = Column(BigInteger, nullable=True)  # lt самой первой транзакции аккаунта (для прогресса/ETA)
+    pages_done = Column(Integer, default=0, nullable=False)
+    events_stored = Column(Integer, default=0, nullable=False)
+    last_error = Column(TEXT, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    wallet = relationship("Wallet", back_populates="backfill_job")
+
+
+class CounterpartyStat(Base):  # Агрегаты переводов кошелька с контрагентом, обновляются при сохранении событий
+    __tablename__ = "counterparty_stats"
+    id = Column(Integer, primary_key=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    counterparty = Column(String, nullable=False)  # Адрес контрагента в raw-форме (0:hex)
+    counterparty_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)  # Аккаунт контрагента
+    asset = Column(String, nullable=False)  # Адрес jetton master или "TON"
+    asset_symbol = Column(String, nullable=True)
+    decimals = Column(Integer, nullable=False, default=9)
+    in_count = Column(Integer, nullable=False, default=0)  # Переводов от контрагента кошельку
+    out_count = Column(Integer, nullable=False, default=0)  # Переводов кошелька контрагенту
+    in_amount = Column(Amount, nullable=False, default=0)  # В минимальных единицах
+    out_amount = Column(Amount, nullable=False, default=0)
+    first_ts = Column(Integer, nullable=True)
+    last_ts = Column(Integer, nullable=True)
+
+    __table_args__ = (UniqueConstraint("wallet_id", "counterparty", "asset", name="_counterparty_stat_uc"),)
+
+
+class VolumeRollupMixin:
+    """
+    Объёмы переводов кошелька по активу за интервал bucket_seconds (роллап).
+    bucket_ts — начало интервала (unix timestamp, кратен bucket_seconds).
+    """
+
+    bucket_seconds: int
+
+    id = Column(Integer, primary_key=True)
+    bucket_ts = Column(Integer, nullable=False)
+    asset = Column(String, nullable=False)  # Адрес jetton master или "TON"
+    asset_symbol = Column(String, nullable=True)
+    decimals = Column(Integer, nullable=False, default=9)
+    in_count = Column(Integer, nullable=False, default=0)
+    out_count = Column(Integer, nullable=False, default=0)
+    in_amount = Column(Amount, nullable=False, default=0)  # В минимальных единицах
+    out_amount = Column(Amount, nullable=False, default=0)
+
+    @declared_attr
+    def wallet_id(cls):
+        return Column(Integer, ForeignKey("wallets.id"), nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (UniqueConstraint("wallet_id", "bucket_ts", "asset", name=f"_{cls.__tablename__}_uc"),)
+
+
+class VolumeHourly(VolumeRollupMixin, Base):
+    __tablename__ = "volume_hourly"
+    bucket_seconds = 3600
+
+
+class VolumeDaily(VolumeRollupMixin, Base):
+    __tablename__ = "volume_daily"
+    bucket_seconds = 86400
+
+
+class CodecDictionary(Base):  # Натренированные словари zstd для кодека actions (core.codec)
+    __tablename__ = "codec_dictionaries"
+    id = Column(BigInteger, primary_key=True, autoincrement=False)  # dict_id словаря zstd
+    codec = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    samples = Column(Integer, nullable=False, default=0)  # На скольких событиях натренирован
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
 # Таблица для настроек уведомлений
 # class NotificationSetting(Base):
 #     __tablename__ = 'notification_settings'
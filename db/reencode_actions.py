@@ -0,0 +1,121 @@
+# db/reencode_actions.py
+
+"""
+Перекодирование сохранённых actions (transactions.actions_json) в текущий кодек.
+
+    python -m db.reencode_actions                      # старые JSON-строки -> ACTIONS_CODEC
+    python -m db.reencode_actions --train-dictionary   # сначала обучить словарь zstd на выборке
+    python -m db.reencode_actions --all                # перекодировать всё (например, с новым словарём)
+
+Строки обрабатываются пакетами по id, каждый пакет — отдельная пишущая транзакция,
+поэтому инструмент можно прервать и запустить снова. В конце печатается экономия места.
+Работающие API и бот перезапускать не нужно: словарь, обученный здесь, они загрузят из
+codec_dictionaries перед первым чтением строки с ним (db.db_init.load_codec_dictionaries).
+"""
+
+import argparse
+import asyncio
+import logging
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from core.codec import (
+    ACTIONS_CODEC,
+    decode_actions,
+    encode_actions,
+    payload_codec,
+    register_dictionaries,
+    resolve_codec,
+    serialize_actions,
+    train_dictionary,
+)
+from db.db_init import async_session, init_db, write_session
+from db.models import CodecDictionary, Transaction
+
+logger = logging.getLogger("db.reencode_actions")
+
+_transactions = Transaction.__table__
+_update_actions_stmt = (
+    update(_transactions).where(_transactions.c.id == bindparam("tx_id")).values(actions_json=bindparam("payload"))
+)
+
+
+async def train_codec_dictionary(codec: str, sample_size: int, dict_size: int) -> int:
+    """Обучает словарь zstd на случайной выборке событий, сохраняет его и делает активным."""
+    async with async_session() as session:
+        payloads = (
+            await session.scalars(select(Transaction.actions_json).order_by(func.random()).limit(sample_size))
+        ).all()
+    samples = [serialize_actions(decode_actions(payload), codec) for payload in payloads]
+    dictionary = train_dictionary(samples, dict_size)
+
+    async with write_session() as session:
+        await session.execute(
+            insert(CodecDictionary.__table__).values(
+                id=dictionary.dict_id(), codec=codec, data=dictionary.as_bytes(), samples=len(samples)
+            )
+        )
+    register_dictionaries([(dictionary.dict_id(), codec, dictionary.as_bytes())])
+    dict_id, size = dictionary.dict_id(), len(dictionary.as_bytes())
+    logger.info(f"Обучен словарь zstd {dict_id} ({size} байт, {len(samples)} событий)")
+    return dict_id
+
+
+async def reencode(codec: str, batch_size: int, reencode_all: bool) -> tuple[int, int, int]:
+    """Перекодирует actions пакетами; возвращает (строк перекодировано, байт до, байт после)."""
+    last_id, converted, size_before, size_after = 0, 0, 0, 0
+    while True:
+        async with async_session() as session:
+            batch = (
+                await session.execute(
+                    select(Transaction.id, Transaction.actions_json)
+                    .where(Transaction.id > last_id)
+                    .order_by(Transaction.id)
+                    .limit(batch_size)
+                )
+            ).all()
+        if not batch:
+            return converted, size_before, size_after
+        last_id = batch[-1].id
+
+        rows = []
+        for tx_id, payload in batch:
+            if not reencode_all and payload_codec(payload) == codec:
+                continue
+            encoded = encode_actions(decode_actions(payload), codec)
+            size_before += len(payload or b"")
+            size_after += len(encoded)
+            rows.append({"tx_id": tx_id, "payload": encoded})
+        if rows:
+            async with write_session() as session:
+                await session.execute(_update_actions_stmt, rows)
+            converted += len(rows)
+            logger.info(f"Перекодировано {converted} строк (до id {last_id})")
+
+
+async def main(args):
+    await init_db()
+    codec = resolve_codec(args.codec)
+    if args.train_dictionary:
+        if not codec.endswith("-zstd"):
+            raise SystemExit(f"Словарь применим только к кодекам *-zstd, выбран {codec}")
+        await train_codec_dictionary(codec, args.sample_size, args.dict_size)
+
+    converted, size_before, size_after = await reencode(codec, args.batch, args.all)
+    if converted:
+        ratio = size_before / size_after if size_after else 0
+        print(f"{codec}: перекодировано {converted} строк, {size_before} -> {size_after} байт (x{ratio:.1f})")
+    else:
+        print(f"{codec}: перекодировать нечего")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Перекодирование transactions.actions_json")
+    parser.add_argument("--codec", default=ACTIONS_CODEC)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--all", action="store_true", help="Перекодировать и строки, уже записанные этим кодеком")
+    parser.add_argument("--train-dictionary", action="store_true")
+    parser.add_argument("--sample-size", type=int, default=5000)
+    parser.add_argument("--dict-size", type=int, default=112640)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,322 @@
+# db/search.py
+
+"""
+Полнотекстовый поиск по Watchlist пользователя: адрес, метка, группа кошелька
+и комментарии его сохранённых переводов.
+
+SQLite — два индекса FTS5, которые синхронизируют триггеры (добавление кошелька, смена
+метки/группы, новые и архивированные переводы попадают в поиск в той же транзакции):
+- watchlist_fts (tokenize=trigram): адрес, метка, группа — поиск подстроки, как прежний ILIKE,
+  но по индексу; владелец строки — индексируемый токен owner ("u<users.id>u"), поэтому
+  запрос сразу сужается до Watchlist пользователя, а не фильтрует совпадения всех пользователей;
+- transfer_comments_fts (external content над transfers): слова комментариев с поиском по префиксу
+  и аккаунты участников перевода (sender_id, recipient_id) как индексируемые токены для сужения
+  до кошельков пользователя (переводы хранятся один раз на событие, без привязки к кошельку).
+Результаты ранжируются bm25.
+
+PostgreSQL — GIN-индексы pg_trgm по тем же колонкам: ILIKE идёт по индексу,
+ранжирование — word_similarity.
+
+Если индекс создать не удалось (SQLite без FTS5, нет прав на CREATE EXTENSION),
+поиск работает прежним ILIKE.
+"""
+
+import logging
+from typing import Optional
+
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Transfer, UserWallet, Wallet
+
+logger = logging.getLogger(__name__)
+
+SEARCH_RESULTS_LIMIT = 20
+# Сколько лучших совпадений по комментариям просматривать (на один кошелёк их может быть много)
+COMMENT_MATCHES_SCAN = 500
+# Веса bm25 колонок watchlist_fts: address, alias, grp, owner (совпадение в метке важнее всего)
+WATCHLIST_WEIGHTS = (4.0, 10.0, 2.0, 0.0)
+# До скольких кошельков Watchlist фильтр по аккаунтам идёт внутри MATCH (длинный OR в FTS5 дороже JOIN)
+COMMENT_WALLET_FILTER_MAX = 100
+TRIGRAM_MIN_LENGTH = 3  # Триграммный индекс не ищет подстроки короче 3 символов
+
+WATCHLIST_FTS = "watchlist_fts"
+COMMENTS_FTS = "transfer_comments_fts"
+
+_SQLITE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS user_wallets_search_ai AFTER INSERT ON user_wallets BEGIN
+        INSERT INTO {WATCHLIST_FTS} (rowid, address, alias, grp, owner)
+        SELECT new.id, wallets.address, new.alias, new."group", 'u' || new.user_id || 'u'
+        FROM wallets WHERE wallets.id = new.wallet_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS user_wallets_search_au AFTER UPDATE ON user_wallets BEGIN
+        DELETE FROM {WATCHLIST_FTS} WHERE rowid = old.id;
+        INSERT INTO {WATCHLIST_FTS} (rowid, address, alias, grp, owner)
+        SELECT new.id, wallets.address, new.alias, new."group", 'u' || new.user_id || 'u'
+        FROM wallets WHERE wallets.id = new.wallet_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS user_wallets_search_ad AFTER DELETE ON user_wallets BEGIN
+        DELETE FROM {WATCHLIST_FTS} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS wallets_search_au AFTER UPDATE OF address ON wallets BEGIN
+        UPDATE {WATCHLIST_FTS} SET address = new.address
+        WHERE rowid IN (SELECT id FROM user_wallets WHERE wallet_id = new.id);
+    END
+    """,
+    # External content: индекс хранит только токены, текст комментария читается из transfers
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transfers_comment_ai AFTER INSERT ON transfers
+    WHEN new.comment IS NOT NULL BEGIN
+        INSERT INTO {COMMENTS_FTS} (rowid, comment, sender_id, recipient_id)
+        VALUES (new.id, new.comment, new.sender_id, new.recipient_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transfers_comment_ad AFTER DELETE ON transfers
+    WHEN old.comment IS NOT NULL BEGIN
+        INSERT INTO {COMMENTS_FTS} ({COMMENTS_FTS}, rowid, comment, sender_id, recipient_id)
+        VALUES ('delete', old.id, old.comment, old.sender_id, old.recipient_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transfers_comment_au AFTER UPDATE OF comment, sender_id, recipient_id ON transfers
+    BEGIN
+        INSERT INTO {COMMENTS_FTS} ({COMMENTS_FTS}, rowid, comment, sender_id, recipient_id)
+        SELECT 'delete', old.id, old.comment, old.sender_id, old.recipient_id WHERE old.comment IS NOT NULL;
+        INSERT INTO {COMMENTS_FTS} (rowid, comment, sender_id, recipient_id)
+        SELECT new.id, new.comment, new.sender_id, new.recipient_id WHERE new.comment IS NOT NULL;
+    END
+    """,
+)
+
+_POSTGRESQL_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_wallets_address_trgm ON wallets USING gin (address gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_user_wallets_alias_trgm ON user_wallets USING gin (alias gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS ix_user_wallets_group_trgm ON user_wallets USING gin ("group" gin_trgm_ops)',
+    "CREATE INDEX IF NOT EXISTS ix_transfers_comment_trgm ON transfers USING gin (comment gin_trgm_ops) "
+    "WHERE comment IS NOT NULL",
+)
+
+_SQLITE_WATCHLIST_QUERY = text(
+    f"""
+    SELECT wallets.address, user_wallets.alias, user_wallets."group"
+    FROM {WATCHLIST_FTS}
+    JOIN user_wallets ON user_wallets.id = {WATCHLIST_FTS}.rowid
+    JOIN wallets ON wallets.id = user_wallets.wallet_id
+    WHERE {WATCHLIST_FTS} MATCH :match AND user_wallets.user_id = :user_id
+    ORDER BY bm25({WATCHLIST_FTS}, {", ".join(map(str, WATCHLIST_WEIGHTS))})
+    LIMIT :limit
+    """
+)
+
+# bm25/snippet нельзя вызывать в агрегатном запросе — лучший комментарий кошелька выбирается снаружи
+_SQLITE_COMMENTS_QUERY = text(
+    f"""
+    SELECT address, alias, grp, snippet, min(rank) AS best_rank FROM (
+        SELECT user_wallets.id AS user_wallet_id, wallets.address, user_wallets.alias, user_wallets."group" AS grp,
+               snippet({COMMENTS_FTS}, 0, '', '', '…', 12) AS snippet, bm25({COMMENTS_FTS}, 1.0, 0.0, 0.0) AS rank
+        FROM {COMMENTS_FTS}
+        JOIN transfers ON transfers.id = {COMMENTS_FTS}.rowid
+        JOIN wallets ON wallets.account_id IN (transfers.sender_id, transfers.recipient_id)
+        JOIN user_wallets ON user_wallets.wallet_id = wallets.id AND user_wallets.user_id = :user_id
+        WHERE {COMMENTS_FTS} MATCH :match
+        ORDER BY rank
+        LIMIT :scan
+    )
+    GROUP BY user_wallet_id
+    ORDER BY best_rank
+    LIMIT :limit
+    """
+)
+
+# Выставляется ensure_search_index при инициализации БД
+search_index_ready = False
+
+
+def _ensure_sqlite_index(sync_conn) -> None:
+    existing = set(
+        sync_conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (:watchlist, :comments)"),
+            {"watchlist": WATCHLIST_FTS, "comments": COMMENTS_FTS},
+        ).scalars()
+    )
+    if WATCHLIST_FTS not in existing:
+        sync_conn.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {WATCHLIST_FTS} "
+                "USING fts5(address, alias, grp, owner, tokenize='trigram')"
+            )
+        )
+        sync_conn.execute(
+            text(
+                f"""
+                INSERT INTO {WATCHLIST_FTS} (rowid, address, alias, grp, owner)
+                SELECT user_wallets.id, wallets.address, user_wallets.alias, user_wallets."group",
+                       'u' || user_wallets.user_id || 'u'
+                FROM user_wallets JOIN wallets ON wallets.id = user_wallets.wallet_id
+                """
+            )
+        )
+        logger.info(f"Поиск: создан индекс {WATCHLIST_FTS}")
+    if COMMENTS_FTS not in existing:
+        sync_conn.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {COMMENTS_FTS} USING fts5(comment, sender_id, recipient_id, "
+                "content='transfers', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        )
+        sync_conn.execute(text(f"INSERT INTO {COMMENTS_FTS} ({COMMENTS_FTS}) VALUES ('rebuild')"))
+        logger.info(f"Поиск: создан индекс {COMMENTS_FTS}")
+    for trigger in _SQLITE_TRIGGERS:
+        sync_conn.execute(text(trigger))
+
+
+def _ensure_postgresql_index(sync_conn) -> None:
+    sync_conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for index in _POSTGRESQL_INDEXES:
+        sync_conn.execute(text(index))
+
+
+def ensure_search_index(sync_conn) -> None:
+    """Создаёт поисковые индексы (если их ещё нет) и заполняет их уже сохранёнными данными."""
+    global search_index_ready
+    ensure = {"sqlite": _ensure_sqlite_index, "postgresql": _ensure_postgresql_index}.get(sync_conn.dialect.name)
+    if ensure is None:
+        search_index_ready = False
+        return
+    try:
+        with sync_conn.begin_nested():  # Ошибка не должна откатывать остальную инициализацию
+            ensure(sync_conn)
+        search_index_ready = True
+    except DBAPIError as e:
+        search_index_ready = False
+        logger.warning(f"Поисковый индекс недоступен ({e.orig}) — поиск по Watchlist будет работать через ILIKE")
+
+
+def _fts_phrase(term: str, prefix: bool = False) -> str:
+    return '"' + term.replace('"', '""') + '"' + ("*" if prefix else "")
+
+
+def watchlist_match_expression(query: str, user_id: int) -> Optional[str]:
+    """
+    MATCH для watchlist_fts: все слова запроса как подстроки адреса/метки/группы
+    (слова короче 3 символов пропускаются) в строках пользователя.
+    """
+    terms = [term for term in query.split() if len(term) >= TRIGRAM_MIN_LENGTH]
+    if not terms:
+        return None
+    return f"{{address alias grp}} : ({' '.join(map(_fts_phrase, terms))}) AND owner : \"u{user_id}u\""
+
+
+def comments_match_expression(query: str, account_ids: list[int]) -> Optional[str]:
+    """
+    MATCH для transfer_comments_fts: все слова запроса, каждое — по префиксу.
+    Небольшой Watchlist сужается по аккаунтам участников прямо в индексе.
+    """
+    terms = query.split()
+    if not terms:
+        return None
+    match = f"comment : ({' '.join(_fts_phrase(term, prefix=True) for term in terms)})"
+    if len(account_ids) <= COMMENT_WALLET_FILTER_MAX:
+        accounts = " OR ".join(_fts_phrase(str(account_id)) for account_id in account_ids)
+        match += f" AND {{sender_id recipient_id}} : ({accounts})"
+    return match
+
+
+def _result(address: str, alias: Optional[str], group: Optional[str], comment: Optional[str] = None) -> dict:
+    return {"address": address, "alias": alias, "group": group, "matched_comment": comment}
+
+
+async def _search_sqlite(session: AsyncSession, user_id: int, query: str, limit: int) -> list[dict]:
+    results = []
+    watchlist_match = watchlist_match_expression(query, user_id)
+    if watchlist_match:
+        rows = await session.execute(
+            _SQLITE_WATCHLIST_QUERY, {"match": watchlist_match, "user_id": user_id, "limit": limit}
+        )
+        results = [_result(*row) for row in rows]
+
+    if len(results) >= limit:
+        return results
+    account_ids = (
+        await session.scalars(
+            select(Wallet.account_id)
+            .join(UserWallet, UserWallet.wallet_id == Wallet.id)
+            .where(UserWallet.user_id == user_id, Wallet.account_id.is_not(None))
+        )
+    ).all()
+    comments_match = comments_match_expression(query, account_ids) if account_ids else None
+    if comments_match:
+        rows = await session.execute(
+            _SQLITE_COMMENTS_QUERY,
+            {"match": comments_match, "user_id": user_id, "scan": COMMENT_MATCHES_SCAN, "limit": limit},
+        )
+        found = {result["address"] for result in results}
+        for address, alias, group, snippet, _ in rows:
+            if address not in found and len(results) < limit:
+                found.add(address)
+                results.append(_result(address, alias, group, snippet))
+    return results
+
+
+async def _search_like(session: AsyncSession, user_id: int, query: str, limit: int, ranked: bool) -> list[dict]:
+    """ILIKE-поиск; в PostgreSQL идёт по индексам pg_trgm и ранжируется word_similarity (ranked=True)."""
+    pattern = f"%{query}%"
+    watchlist_stmt = (
+        select(Wallet.address, UserWallet.alias, UserWallet.group)
+        .join(UserWallet, Wallet.id == UserWallet.wallet_id)
+        .where(UserWallet.user_id == user_id)
+        .where(
+            or_(Wallet.address.ilike(pattern), UserWallet.alias.ilike(pattern), UserWallet.group.ilike(pattern))
+        )
+        .limit(limit)
+    )
+    comments_stmt = (
+        select(Wallet.address, UserWallet.alias, UserWallet.group, Transfer.comment)
+        .join(Wallet, Wallet.account_id.in_((Transfer.sender_id, Transfer.recipient_id)))
+        .join(UserWallet, UserWallet.wallet_id == Wallet.id)
+        .where(UserWallet.user_id == user_id, Transfer.comment.ilike(pattern))
+        .limit(COMMENT_MATCHES_SCAN)
+    )
+    if ranked:
+        watchlist_stmt = watchlist_stmt.order_by(
+            func.greatest(
+                func.word_similarity(query, Wallet.address),
+                func.word_similarity(query, func.coalesce(UserWallet.alias, "")),
+                func.word_similarity(query, func.coalesce(UserWallet.group, "")),
+            ).desc()
+        )
+        comments_stmt = comments_stmt.order_by(func.word_similarity(query, Transfer.comment).desc())
+    else:
+        comments_stmt = comments_stmt.order_by(Transfer.timestamp.desc())
+
+    results = [_result(*row) for row in await session.execute(watchlist_stmt)]
+    if len(results) < limit:
+        found = {result["address"] for result in results}
+        for address, alias, group, comment in await session.execute(comments_stmt):
+            if address not in found and len(results) < limit:
+                found.add(address)
+                results.append(_result(address, alias, group, comment))
+    return results
+
+
+async def search_watchlist(
+    session: AsyncSession, user_id: int, query: str, limit: int = SEARCH_RESULTS_LIMIT
+) -> list[dict]:
+    """
+    Ищет кошельки Watchlist пользователя (users.id) по адресу, метке, группе и комментариям переводов.
+    Сначала идут совпадения по самому кошельку, затем — по комментариям (matched_comment — фрагмент).
+    """
+    query = query.strip()
+    dialect = session.get_bind().dialect.name
+    if search_index_ready and dialect == "sqlite":
+        return await _search_sqlite(session, user_id, query, limit)
+    return await _search_like(session, user_id, query, limit, ranked=search_index_ready and dialect == "postgresql")
@@ -1,5 +1,40 @@
 import sys
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+import pytest
+
 ROOT = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(ROOT))
+
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db.db_init import create_db_engine  # noqa: E402
+from db.models import Base  # noqa: E402
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    """
+    Тестовая БД в памяти: `async with memory_db(wallets, export) as session_factory` внутри
+    asyncio.run создаёт SQLite со схемой (и setup — функциями для conn.run_sync), подменяет
+    async_session в переданных модулях и закрывает движок на выходе.
+    """
+
+    @asynccontextmanager
+    async def _memory_db(*modules, setup=()):
+        engine = create_db_engine("sqlite+aiosqlite://", profile="default")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                for step in setup:
+                    await conn.run_sync(step)
+            session_factory = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+            for module in modules:
+                monkeypatch.setattr(module, "async_session", session_factory)
+            yield session_factory
+        finally:
+            await engine.dispose()
+
+    return _memory_db
@@ -0,0 +1,36 @@
+from core.actions import extract_transfers
+
+
+def test_extract_transfers_ton_and_jetton():
+    actions = [
+        {
+            "type": "TonTransfer",
+            "TonTransfer": {"sender": {"address": "0:a"}, "recipient": {"address": "0:b"}, "amount": 1_500_000_000},
+        },
+        {"type": "SmartContractExec", "SmartContractExec": {}},
+        {
+            "type": "JettonTransfer",
+            "JettonTransfer": {
+                "sender": {"address": "0:b"},
+                "recipient": {"address": "0:c"},
+                "amount": "250000",
+                "jetton": {"address": "0:usdt", "symbol": "USDT", "decimals": 6},
+            },
+        },
+    ]
+
+    transfers = extract_transfers(actions)
+
+    assert [t["action_index"] for t in transfers] == [0, 2]
+    assert transfers[0]["asset"] is None and transfers[0]["amount"] == 1_500_000_000
+    assert transfers[1] == {
+        "action_index": 2,
+        "type": "JettonTransfer",
+        "sender": "0:b",
+        "recipient": "0:c",
+        "asset": "0:usdt",
+        "asset_symbol": "USDT",
+        "amount": 250000,
+        "decimals": 6,
+        "comment": None,
+    }
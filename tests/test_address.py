@@ -0,0 +1,27 @@
+from core.address import TonAddress, parse_address, to_raw_address
+
+FRIENDLY = "EQCD39VS5jcptHL8vMjEXrzGaRcCVYto7HUn4bpAOg8xqB2N"
+RAW = "0:83dfd552e63729b472fcbcc8c45ebcc6691702558b68ec7527e1ba403a0f31a8"
+
+
+def test_parse_address_forms_are_canonical():
+    parsed = parse_address(FRIENDLY)
+    assert parsed == TonAddress(0, bytes.fromhex(RAW[2:]))
+    assert parsed.raw == RAW
+    # Non-bounceable, testnet, base64 (не url-safe) та raw у верхньому регістрі — той самий акаунт
+    forms = [
+        parsed.to_friendly(bounceable=False),
+        parsed.to_friendly(testnet=True),
+        parsed.to_friendly().replace("-", "+").replace("_", "/"),
+        RAW.upper(),
+    ]
+    assert {parse_address(form) for form in forms} == {parsed}
+    assert parsed.to_friendly() == FRIENDLY
+    assert parsed.to_friendly(bounceable=False).startswith("UQ")
+
+
+def test_parse_address_rejects_invalid():
+    broken_crc = FRIENDLY[:-1] + ("A" if FRIENDLY[-1] != "A" else "B")
+    for value in (broken_crc, "EQabc", "0:xyz", "-1:" + "0" * 63, "", None):
+        assert parse_address(value) is None
+    assert to_raw_address(broken_crc) is None
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import api.archive as archive  # noqa: E402
+
+
+def _row(n: int, timestamp: int) -> dict:
+    return {"event_id": f"ev{n}", "lt": n, "timestamp": timestamp, "is_scam_event": False, "actions_json": "[]"}
+
+
+def test_archive_rows_are_merged_per_month(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", tmp_path)
+    january, february = 1_704_067_200, 1_706_745_600  # 2024-01-01, 2024-02-01 UTC
+
+    archive.write_archive_rows(1, [_row(1, january), _row(2, february)])
+    # Повторный перенос того же события не создаёт дубликат
+    archive.write_archive_rows(1, [_row(2, february), _row(3, february + 60)])
+
+    assert sorted(path.name for path in (tmp_path / "wallet_1").iterdir()) == ["2024-01.parquet", "2024-02.parquet"]
+    archived = asyncio.run(archive.read_archived_transactions(1, from_ts=february))
+    assert sorted(row["event_id"] for row in archived) == ["ev2", "ev3"]
+
+    merged = archive.merge_with_archive([_row(3, february + 60), _row(4, february + 120)], archived)
+    assert [row["event_id"] for row in merged] == ["ev4", "ev3", "ev2"]
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+
+import api.backfill as backfill
+from core.tonapi import TonApiClient
+from db.models import BackfillJob, Wallet
+
+WALLET = "0:" + "a" * 64
+
+
+def _tonapi_history(monkeypatch, lts: list[int]) -> list[dict]:
+    """TonAPI с историей событий lts (страницы по limit до before_lt); возвращает параметры запросов событий."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/transactions"):  # Самая первая транзакция аккаунта
+            oldest = [{"lt": min(lts), "utime": 1_600_000_000}] if lts else []
+            return httpx.Response(200, json={"transactions": oldest})
+        requests.append(dict(request.url.params))
+        before_lt = int(request.url.params.get("before_lt", 10**18))
+        page = [lt for lt in sorted(lts, reverse=True) if lt < before_lt][: int(request.url.params["limit"])]
+        events = [{"event_id": f"ev{lt}", "lt": lt, "timestamp": 1_600_000_000 + lt, "actions": []} for lt in page]
+        return httpx.Response(200, json={"events": events})
+
+    transport = httpx.MockTransport(handler)
+    client = TonApiClient(api_key="k", base_url="https://tonapi.test/v2", limiter=None, transport=transport)
+    monkeypatch.setattr(backfill, "get_tonapi_client", lambda: client)
+    monkeypatch.setattr(backfill, "BACKFILL_PAGE_LIMIT", 3)
+    return requests
+
+
+def test_backfill_resumes_from_checkpoint_until_done(monkeypatch, memory_db):
+    requests = _tonapi_history(monkeypatch, list(range(1, 11)))
+
+    async def _run():
+        async with memory_db(backfill) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address=WALLET))
+                    # Прошлый запуск загрузил события 10..8 и остановился
+                    started_at = datetime.utcnow() - timedelta(minutes=1)
+                    checkpoint = dict(start_lt=10, target_lt=1, before_lt=8, pages_done=1, events_stored=3)
+                    job = BackfillJob(id=1, wallet_id=1, status="running", started_at=started_at, **checkpoint)
+                    job.updated_at = started_at
+                    session.add(job)
+
+            first_run = await backfill.backfill_wallet(1, 1, WALLET, max_pages=1)
+            async with session_factory() as session:
+                resumed = await session.get(BackfillJob, 1)
+            second_run = await backfill.backfill_wallet(1, 1, WALLET, max_pages=5)
+            async with session_factory() as session:
+                finished = await session.get(BackfillJob, 1)
+        return first_run, resumed, second_run, finished
+
+    first_run, resumed, second_run, finished = asyncio.run(_run())
+    assert first_run == 1 and (resumed.status, resumed.before_lt, resumed.events_stored) == ("running", 5, 6)
+    assert 0 < backfill.backfill_progress(resumed)[0] < 1
+    # Страницы 4..2 и 1 (короткая) — история загружена целиком
+    assert second_run == 2 and (finished.status, finished.before_lt, finished.events_stored) == ("done", 1, 10)
+    assert finished.pages_done == 4 and finished.finished_at is not None
+    assert [request.get("before_lt") for request in requests] == ["8", "5", "2"]
+    assert backfill.backfill_progress(finished) == (1.0, 0)
+
+
+def test_backfill_first_run_sets_bounds(monkeypatch, memory_db):
+    _tonapi_history(monkeypatch, list(range(1, 11)))
+
+    async def _run():
+        async with memory_db(backfill) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all([Wallet(id=1, address=WALLET), BackfillJob(id=1, wallet_id=1)])
+
+            pages = await backfill.backfill_wallet(1, 1, WALLET, max_pages=1)
+            async with session_factory() as session:
+                job = await session.get(BackfillJob, 1)
+                wallet = await session.get(Wallet, 1)
+        return pages, job, wallet
+
+    pages, job, wallet = asyncio.run(_run())
+    assert pages == 1 and job.status == "running"
+    assert (job.start_lt, job.before_lt, job.target_lt) == (10, 8, 1)
+    assert wallet.first_activity_ts == 1_600_000_000
+
+
+def test_backfill_of_empty_account_is_done(monkeypatch, memory_db):
+    requests = _tonapi_history(monkeypatch, [])
+
+    async def _run():
+        async with memory_db(backfill) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all([Wallet(id=1, address=WALLET), BackfillJob(id=1, wallet_id=1)])
+
+            pages = await backfill.backfill_wallet(1, 1, WALLET, max_pages=5)
+            async with session_factory() as session:
+                job = await session.get(BackfillJob, 1)
+        return pages, job
+
+    pages, job = asyncio.run(_run())
+    assert pages == 0 and job.status == "done" and not requests
+
+
+def test_backfill_progress_estimates_share_and_eta():
+    started_at = datetime(2024, 1, 1)
+    job = BackfillJob(status="running", start_lt=110, target_lt=10, before_lt=60, started_at=started_at)
+    job.updated_at = started_at + timedelta(seconds=100)
+    assert backfill.backfill_progress(job) == (0.5, 100)
+    assert backfill.backfill_progress(BackfillJob(status="pending")) == (None, None)
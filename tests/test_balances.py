@@ -0,0 +1,82 @@
+import asyncio
+import json
+from datetime import datetime
+
+import httpx
+from sqlalchemy import select
+
+import api.balances as balances
+from core.address import TonAddress
+from core.tonapi import TonApiClient
+from db import db_init
+from db.models import Wallet
+
+RAW = ["0:" + letter * 64 for letter in "abcdef"]
+
+
+def _tonapi_bulk(monkeypatch, missing: set = frozenset()) -> list[list[str]]:
+    """TonAPI /accounts/_bulk: баланс аккаунта — номер его адреса в RAW, missing не возвращаются."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        account_ids = json.loads(request.content)["account_ids"]
+        requests.append(account_ids)
+        accounts = [
+            {"address": raw, "balance": RAW.index(raw) + 1, "is_scam": raw == RAW[1]}
+            for raw in account_ids
+            if raw not in missing
+        ]
+        # Аккаунт, которого не запрашивали, не должен попасть ни в один кошелёк
+        accounts.append({"address": "0:" + "f" * 63 + "0", "balance": 99})
+        return httpx.Response(200, json={"accounts": accounts})
+
+    transport = httpx.MockTransport(handler)
+    client = TonApiClient(api_key="k", base_url="https://tonapi.test/v2", limiter=None, transport=transport)
+    monkeypatch.setattr(balances, "get_tonapi_client", lambda: client)
+    return requests
+
+
+def test_refresh_balances_chunk_maps_bulk_response_to_wallets(monkeypatch, memory_db):
+    requests = _tonapi_bulk(monkeypatch, missing={RAW[2]})
+    friendly = TonAddress(0, bytes.fromhex("b" * 64)).to_friendly()
+    wallets = [(1, RAW[0]), (2, friendly), (3, RAW[2]), (4, "not-an-address")]
+
+    async def _run():
+        async with memory_db(balances, db_init) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all(Wallet(id=wallet_id, address=address) for wallet_id, address in wallets)
+
+            updated = await balances.refresh_balances_chunk(wallets)
+            async with session_factory() as session:
+                rows = (await session.scalars(select(Wallet).order_by(Wallet.id))).all()
+        return updated, rows
+
+    updated, rows = asyncio.run(_run())
+    # TonAPI отвечает raw-адресами: user-friendly адрес сопоставляется по raw-форме, некорректный не запрашивается
+    assert requests == [[RAW[0], RAW[1], RAW[2]]]
+    assert updated == 2
+    assert [(row.last_balance_ton, row.is_scam) for row in rows[:2]] == [(1, False), (2, True)]
+    # Аккаунта нет в ответе — баланс и время обновления не трогаются
+    assert rows[2].last_balance_ton is None and rows[2].last_balance_updated_at is None
+
+
+def test_balance_refresh_requests_stale_wallets_in_chunks(monkeypatch, memory_db):
+    requests = _tonapi_bulk(monkeypatch)
+    monkeypatch.setattr(balances, "TONAPI_KEY", "k")
+    monkeypatch.setattr(balances, "BALANCE_BULK_SIZE", 2)
+
+    async def _run():
+        async with memory_db(balances, db_init) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all(Wallet(id=n, address=RAW[n]) for n in range(5))
+                    # Свежий баланс — в этот проход не запрашивается
+                    session.add(Wallet(id=5, address=RAW[5], last_balance_updated_at=datetime.utcnow()))
+
+            await balances.scheduled_balance_refresh()
+            async with session_factory() as session:
+                return (await session.scalars(select(Wallet.last_balance_ton).order_by(Wallet.id))).all()
+
+    assert asyncio.run(_run()) == [1, 2, 3, 4, 5, None]
+    assert [len(chunk) for chunk in requests] == [2, 2, 1] and RAW[5] not in sum(requests, [])
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from core.cache import TTLCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_coalesces_concurrent_misses():
+    calls = []
+
+    async def _load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def _run():
+        cache = TTLCache(ttl=60)
+        first = await asyncio.gather(*(cache.get("a", _load) for _ in range(10)))
+        return first, await cache.get("a", _load)
+
+    first, cached = asyncio.run(_run())
+    assert first == [1] * 10 and cached == 1
+    assert len(calls) == 1  # Один вызов источника на все параллельные запросы
+
+
+def test_ttl_cache_serves_stale_while_revalidating():
+    clock = _Clock()
+    values = iter(["v1", "v2", "v3"])
+
+    async def _load():
+        return next(values)
+
+    async def _run():
+        cache = TTLCache(ttl=10, stale_ttl=20, clock=clock)
+        results = [await cache.get("a", _load)]
+        clock.now = 15  # Устарело, но в пределах stale_ttl — старое значение сразу, новое грузится в фоне
+        results.append(await cache.get("a", _load))
+        await asyncio.sleep(0)
+        results.append(await cache.get("a", _load))
+        clock.now = 100  # За пределами stale_ttl — ждём загрузку
+        results.append(await cache.get("a", _load))
+        return results
+
+    assert asyncio.run(_run()) == ["v1", "v1", "v2", "v3"]
+
+
+def test_ttl_cache_does_not_cache_errors_and_evicts_lru():
+    attempts = []
+
+    async def _failing():
+        attempts.append(1)
+        raise RuntimeError("upstream")
+
+    async def _value(value):
+        return value
+
+    async def _run():
+        cache = TTLCache(ttl=60, max_entries=2)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await cache.get("err", _failing)
+        await cache.get("a", lambda: _value(1))
+        await cache.get("b", lambda: _value(2))
+        await cache.get("a", lambda: _value(1))  # "a" использован последним — вытесняется "b"
+        await cache.get("c", lambda: _value(3))
+        return len(cache), await cache.get("b", lambda: _value("reloaded"))
+
+    size, b_value = asyncio.run(_run())
+    assert len(attempts) == 2
+    assert size == 2 and b_value == "reloaded"
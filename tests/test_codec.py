@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import insert
+
+from core import codec
+from db import db_init
+from db.models import CodecDictionary
+
+ACTIONS = [
+    {
+        "type": "TonTransfer",
+        "status": "ok",
+        "TonTransfer": {"sender": {"address": "0:a"}, "recipient": {"address": "0:b"}, "amount": 10**12},
+        "simple_preview": {"description": "Transferring 1000 TON", "value_image": "https://example.com/ton.png"},
+    }
+]
+
+
+@pytest.mark.parametrize("name", ["json", "json-zlib", "msgpack", "msgpack-zstd", "cbor", "cbor-zstd"])
+def test_actions_roundtrip(name):
+    if not codec.codec_available(name):
+        pytest.skip(f"кодек {name} недоступен")
+    encoded = codec.encode_actions(ACTIONS, name)
+    assert codec.decode_actions(encoded) == ACTIONS
+    assert codec.payload_codec(encoded) == name
+
+
+def test_legacy_json_text_is_decoded():
+    legacy = json.dumps(ACTIONS)
+    assert codec.decode_actions(legacy) == ACTIONS
+    assert codec.decode_actions(legacy.encode("utf-8")) == ACTIONS  # PostgreSQL после миграции в BYTEA
+    assert codec.decode_actions(None) == []
+
+
+def test_strip_display_fields():
+    stripped = codec.strip_display_fields(ACTIONS)
+    assert "value_image" not in stripped[0]["simple_preview"]
+    assert stripped[0]["simple_preview"]["description"] == "Transferring 1000 TON"
+
+    # Картинка токена нужна /history (jetton_image), картинки превью — нет
+    jetton = {"symbol": "USDT", "image": "https://example.com/usdt.png", "metadata": {"image": "ipfs://usdt"}}
+    action = {"JettonTransfer": {"jetton": jetton}, "simple_preview": {"value_image": "https://example.com/usdt.png"}}
+    stripped = codec.strip_display_fields([action])[0]
+    assert stripped["JettonTransfer"]["jetton"] == jetton and stripped["simple_preview"] == {}
+
+
+def test_unknown_dictionary_is_loaded_from_database(monkeypatch, memory_db):
+    zstandard = pytest.importorskip("zstandard")
+    if not codec.codec_available("msgpack-zstd"):
+        pytest.skip("msgpack не установлен")
+
+    events = [[{**ACTIONS[0], "lt": n, "comment": f"c{n % 7}"}] for n in range(500)]
+    samples = [codec.serialize_actions(actions, "msgpack-zstd") for actions in events]
+    dictionary = zstandard.train_dictionary(4096, samples)
+    dict_id = dictionary.dict_id()
+    for name in ("_dictionaries", "_active_dictionaries", "_compressors", "_decompressors", "_missing_dictionaries"):
+        monkeypatch.setattr(codec, name, {})
+
+    # Другой процесс (db.reencode_actions) обучил словарь и записал им строку
+    codec.register_dictionaries([(dict_id, "msgpack-zstd", dictionary.as_bytes())])
+    payload = codec.encode_actions(ACTIONS, "msgpack-zstd")
+    for name in ("_dictionaries", "_active_dictionaries", "_compressors", "_decompressors"):
+        getattr(codec, name).clear()
+
+    async def _run():
+        async with memory_db(db_init) as session_factory:
+            # Словаря ещё нет в таблице: промах запоминается и не повторяется на каждом чтении
+            await db_init.load_codec_dictionaries([payload])
+            missed = codec.unknown_dictionaries([payload])
+            async with session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        insert(CodecDictionary.__table__).values(
+                            id=dict_id, codec="msgpack-zstd", data=dictionary.as_bytes(), samples=len(samples)
+                        )
+                    )
+            await db_init.load_codec_dictionaries([payload])
+            cached_miss = dict_id not in codec._dictionaries
+            monkeypatch.setattr(codec, "DICTIONARY_RETRY_SECONDS", 0)
+            await db_init.load_codec_dictionaries([payload])
+        return missed, cached_miss
+
+    assert codec.payload_dictionary(payload) == dict_id
+    with pytest.raises(ValueError):
+        codec.decode_actions(payload)
+    missed, cached_miss = asyncio.run(_run())
+    assert missed == set() and cached_miss
+    assert codec.decode_actions(payload) == ACTIONS
+    assert codec._active_dictionaries["msgpack-zstd"] == dict_id and not codec._missing_dictionaries
@@ -0,0 +1,21 @@
+import asyncio
+
+from sqlalchemy import text
+
+from db.db_init import create_db_engine
+
+
+def test_sqlite_profile_sets_pragmas(tmp_path):
+    async def _run():
+        engine = create_db_engine(f"sqlite+aiosqlite:///{tmp_path / 'profile.db'}")
+        async with engine.connect() as conn:
+            journal_mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+            synchronous = (await conn.execute(text("PRAGMA synchronous"))).scalar()
+            busy_timeout = (await conn.execute(text("PRAGMA busy_timeout"))).scalar()
+        await engine.dispose()
+        return journal_mode, synchronous, busy_timeout
+
+    journal_mode, synchronous, busy_timeout = asyncio.run(_run())
+    assert journal_mode == "wal"
+    assert synchronous == 1  # NORMAL
+    assert busy_timeout > 0
@@ -0,0 +1,116 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import api.export as export
+from core.codec import encode_actions
+from db.ingest import store_events
+from db.models import Wallet
+
+WALLET_A = "0:" + "a" * 64
+WALLET_B = "0:" + "b" * 64
+
+
+def _event(n: int) -> dict:
+    transfer = {"sender": {"address": WALLET_A}, "recipient": {"address": WALLET_B}, "amount": n}
+    return {
+        "event_id": f"ev{n}",
+        "lt": 1000 + n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "status": "ok", "TonTransfer": transfer}],
+    }
+
+
+def _archived(n: int) -> dict:
+    event = _event(n)
+    return {**event, "is_scam_event": False, "actions_json": encode_actions(event["actions"])}
+
+
+def test_export_streams_hot_and_archived_events(monkeypatch, memory_db):
+    async def _archive(wallet_id, from_ts=None, to_ts=None):
+        # ev2 перенесён в архив, но ещё не удалён из БД — в экспорте один раз
+        for n in (2, 1, 0):
+            if from_ts is None or _event(n)["timestamp"] >= from_ts:
+                yield _archived(n)
+
+    async def _collect(export_format, **kwargs):
+        chunks = [chunk async for chunk in export.stream_export(1, "EQwallet", export_format, **kwargs)]
+        return b"".join(chunks)
+
+    async def _run():
+        async with memory_db(export) as session_factory:
+            monkeypatch.setattr(export, "iter_archived_transactions", _archive)
+            monkeypatch.setattr(export, "EXPORT_FETCH_SIZE", 2)
+            monkeypatch.setattr(export, "EXPORT_CHUNK_SIZE", 64)
+
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address="EQwallet"))
+                    await session.flush()
+                    await store_events(session, 1, [_event(n) for n in range(2, 6)])
+
+            ndjson = await _collect("ndjson", compress=True)
+            document = await _collect("json", from_ts=1_700_000_002, to_ts=1_700_000_004)
+            table = await _collect("csv")
+        return ndjson, document, table
+
+    ndjson, document, table = asyncio.run(_run())
+    lines = gzip.decompress(ndjson).decode().splitlines()
+    assert [json.loads(line)["event_id"] for line in lines] == ["ev5", "ev4", "ev3", "ev2", "ev1", "ev0"]
+    assert [row["lt"] for row in json.loads(document)["transactions"]] == [1004, 1003, 1002]
+    rows = list(csv.DictReader(io.StringIO(table.decode())))
+    assert len(rows) == 6 and rows[0]["action_type"] == "TonTransfer" and rows[-1]["event_id"] == "ev0"
+
+
+def test_columnar_export_has_typed_transfer_columns(monkeypatch, memory_db):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+
+    async def _no_archive(wallet_id, from_ts=None, to_ts=None):
+        return
+        yield
+
+    async def _run():
+        async with memory_db(export) as session_factory:
+            monkeypatch.setattr(export, "iter_archived_transactions", _no_archive)
+
+            jetton = {"address": "0:" + "c" * 64, "symbol": "USDT", "decimals": 6}
+            # Сумма вне int64: Arrow получает её из БД без потери точности
+            amount = "123456789012345678901"
+            transfer = {"sender": {"address": WALLET_A}, "recipient": {"address": WALLET_B}, "amount": amount}
+            event = {
+                "event_id": "jetton",
+                "lt": 7,
+                "timestamp": 1_700_000_000,
+                "actions": [
+                    {"type": "JettonTransfer", "status": "ok", "JettonTransfer": {**transfer, "jetton": jetton}}
+                ],
+            }
+            async with session_factory() as session:
+                async with session.begin():
+                    wallets = [Wallet(id=1, address=WALLET_A), Wallet(id=2, address=WALLET_B)]
+                    session.add_all(wallets)
+                    await session.flush()
+                    await store_events(session, 1, [event, _event(1)], WALLET_A)
+                    await store_events(session, 2, [event], WALLET_B)
+
+            arrow = b"".join([chunk async for chunk in export.stream_columnar_export(wallets, "arrow")])
+            parquet = b"".join([chunk async for chunk in export.stream_columnar_export(wallets, "parquet")])
+        return arrow, parquet
+
+    arrow, parquet = asyncio.run(_run())
+    table = pa.ipc.open_stream(arrow).read_all()
+    assert pq.read_table(io.BytesIO(parquet)).to_pylist() == table.to_pylist()  # Parquet хранит время в ms
+    assert table.schema.field("amount").type == pa.decimal256(40, 0)
+    rows = table.to_pylist()
+    assert [(row["wallet"], row["event_id"], row["direction"]) for row in rows] == [
+        (WALLET_A, "ev1", "out"),
+        (WALLET_A, "jetton", "out"),
+        (WALLET_B, "jetton", "in"),
+    ]
+    assert rows[1]["amount"] == 123_456_789_012_345_678_901
+    assert rows[1]["decimals"] == 6 and rows[1]["asset_symbol"] == "USDT"
@@ -0,0 +1,256 @@
+import asyncio
+import gzip
+import json
+
+from sqlalchemy import update
+
+import api.graph_format as graph_format
+import api.routes.wallets as wallets
+from db.graph import expand_graph
+from db.ingest import intern_accounts, store_events
+from db.models import User, UserWallet, Wallet
+
+A, B, C, D, E = ("0:" + letter * 64 for letter in "abcde")
+# Параметры /wallet/graph при прямом вызове обработчика (без FastAPI значения Query не подставляются)
+GRAPH_PARAMS = dict(
+    depth=1,
+    target_address=None,
+    incoming=True,
+    outgoing=True,
+    jetton_only=False,
+    min_value=0.0,
+    max_nodes=100,
+    max_edges=100,
+    top_k=10,
+    rank_by="count",
+    format="json",
+    accept_encoding=None,
+)
+
+
+def _transfer_event(n: int, sender: str, recipient: str, amount: int) -> dict:
+    transfer = {"sender": {"address": sender}, "recipient": {"address": recipient}, "amount": amount}
+    return {
+        "event_id": f"ev{n}",
+        "lt": n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "status": "ok", "TonTransfer": transfer}],
+    }
+
+
+def test_expand_graph_aggregates_edges_and_respects_budgets(memory_db):
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A, B, C, D, E])
+                    session.add(Wallet(id=1, address=A, account_id=ids[A]))
+                    await session.flush()
+                    # Цепочка A -> B -> C -> D; три параллельных перевода A -> B сводятся в одно ребро
+                    events = [_transfer_event(n, A, B, 10**9) for n in range(3)]
+                    events += [
+                        _transfer_event(3, B, C, 2 * 10**9),
+                        _transfer_event(4, C, D, 10**9),
+                        _transfer_event(5, E, A, 10**6),
+                    ]
+                    await store_events(session, 1, events, A)
+
+                full = await expand_graph(session, [ids[A]], depth=3, max_nodes=100, max_edges=100)
+                outgoing_only = await expand_graph(
+                    session, [ids[A]], depth=1, max_nodes=100, max_edges=100, incoming=False, min_value=0.5
+                )
+                small = await expand_graph(session, [ids[A]], depth=3, max_nodes=2, max_edges=100)
+        return ids, full, outgoing_only, small
+
+    ids, full, outgoing_only, small = asyncio.run(_run())
+    a_to_b = full.edges[(ids[A], ids[B])]
+    assert (a_to_b.count, a_to_b.ton_amount, a_to_b.last_ts) == (3, 3 * 10**9, 1_700_000_002)
+    assert full.nodes == {ids[A]: 0, ids[B]: 1, ids[E]: 1, ids[C]: 2, ids[D]: 3}
+    assert len(full.edges) == 4 and not full.truncated
+    assert list(outgoing_only.edges) == [(ids[A], ids[B])]
+    # Бюджет узлов: остаётся самое «тяжёлое» ребро, граф помечен как обрезанный
+    assert set(small.nodes) == {ids[A], ids[B]} and small.truncated
+
+
+def test_expand_graph_collapses_tail_beyond_top_k(memory_db):
+    peers = ["0:" + f"{n:x}" * 64 for n in range(1, 6)]
+
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A, *peers])
+                    session.add(Wallet(id=1, address=A, account_id=ids[A]))
+                    await session.flush()
+                    # Получателю peers[i] — i + 1 перевод по 1 TON, кроме peers[0]: один, но на 100 TON
+                    events, n = [], 0
+                    for i, peer in enumerate(peers):
+                        for _ in range(i + 1):
+                            events.append(_transfer_event(n, A, peer, 100 * 10**9 if i == 0 else 10**9))
+                            n += 1
+                    await store_events(session, 1, events, A)
+
+                by_count = await expand_graph(session, [ids[A]], depth=1, max_nodes=100, max_edges=100, top_k=2)
+                by_volume = await expand_graph(
+                    session, [ids[A]], depth=1, max_nodes=100, max_edges=100, top_k=2, rank_by="volume"
+                )
+                tight = await expand_graph(session, [ids[A]], depth=1, max_nodes=3, max_edges=100, top_k=2)
+        return ids, by_count, by_volume, tight
+
+    ids, by_count, by_volume, tight = asyncio.run(_run())
+    assert set(by_count.edges) == {(ids[A], ids[peers[4]]), (ids[A], ids[peers[3]])}
+    tail = by_count.others[(ids[A], "out")]
+    assert tail.counterparties == 3 and tail.stats.count == 1 + 2 + 3
+    assert tail.stats.ton_amount == (100 + 2 + 3) * 10**9
+    assert (ids[A], ids[peers[0]]) in by_volume.edges and by_volume.others[(ids[A], "out")].counterparties == 3
+    # Бюджет узлов: корень и два контрагента, агрегату места нет
+    assert len(tight.nodes) == 3 and not tight.others and tight.truncated and tight.dropped_edges == 1
+
+
+def test_expand_graph_depth_two_ranks_only_new_counterparties(memory_db):
+    X, Y, E1, D1, D2, D3, Z1, Z2 = ("0:" + f"{n:x}" * 64 for n in range(1, 9))
+    # Уровень 0: A -> B, X, Y; уровень 1: B и X с новыми контрагентами и перевод B -> X между собой
+    pairs = {(A, B): 5, (A, X): 4, (A, Y): 1, (D1, B): 3, (D2, B): 2, (D3, B): 1}
+    pairs |= {(B, X): 1, (Z1, X): 3, (Z2, X): 2, (X, E1): 2}
+
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A, B, X, Y, E1, D1, D2, D3, Z1, Z2])
+                    session.add(Wallet(id=1, address=A, account_id=ids[A]))
+                    await session.flush()
+                    transfers = [pair for pair, count in pairs.items() for _ in range(count)]
+                    events = [_transfer_event(n, *pair, 10**9) for n, pair in enumerate(transfers)]
+                    await store_events(session, 1, events, A)
+
+                graph = await expand_graph(session, [ids[A]], depth=2, max_nodes=100, max_edges=100, top_k=2)
+        return ids, graph
+
+    ids, graph = asyncio.run(_run())
+    # Входящее A -> B не занимает место в top_k узла B: он получает двух новых отправителей
+    assert (ids[D1], ids[B]) in graph.edges and (ids[D2], ids[B]) in graph.edges
+    assert {key: (tail.counterparties, tail.stats.count) for key, tail in graph.others.items()} == {
+        (ids[A], "out"): (1, 1),
+        (ids[B], "in"): (1, 1),
+    }
+    # B -> X уже ребро и не попадает в хвост X: каждый перевод учтён ровно один раз
+    assert (ids[B], ids[X]) in graph.edges
+    counted = sum(stats.count for stats in graph.edges.values())
+    counted += sum(tail.stats.count for tail in graph.others.values())
+    assert len(graph.edges) == 8 and counted == sum(pairs.values())
+
+
+def test_graph_endpoint_revalidates_with_etag(monkeypatch, memory_db):
+    params = dict(GRAPH_PARAMS)
+
+    async def _run():
+        async with memory_db(wallets) as session_factory:
+            wallets.graph_cache.clear()
+            wallets.graph_accounts.clear()
+
+            async def _ingest(event):
+                async with session_factory() as session:
+                    async with session.begin():
+                        await store_events(session, 1, [event], A)
+                        await session.execute(update(Wallet).where(Wallet.id == 1).values(sync_cursor_lt=event["lt"]))
+
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A])
+                    session.add_all([User(id=1, telegram_id=10), Wallet(id=1, address=A, account_id=ids[A])])
+                    await session.flush()
+                    session.add(UserWallet(user_id=1, wallet_id=1, alias="main"))
+            await _ingest(_transfer_event(1, A, B, 10**9))
+
+            first = await wallets.get_connection_graph_api(10, if_none_match=None, **params)
+            etag = first.headers["etag"]
+            repeat = await wallets.get_connection_graph_api(10, if_none_match=etag, **params)
+            await _ingest(_transfer_event(2, A, C, 10**9))  # Новое событие кошелька — новая версия графа
+            changed = await wallets.get_connection_graph_api(10, if_none_match=etag, **params)
+            params.update(format="columnar", accept_encoding="br;q=0, gzip")
+            columnar = await wallets.get_connection_graph_api(10, if_none_match=changed.headers["etag"], **params)
+        return first, repeat, changed, etag, columnar
+
+    monkeypatch.setattr(graph_format, "GRAPH_COMPRESS_MIN_SIZE", 0)
+    monkeypatch.setattr(graph_format, "brotli", None)
+    first, repeat, changed, etag, columnar = asyncio.run(_run())
+    assert first.status_code == 200 and len(json.loads(first.body)["edges"]) == 1
+    assert repeat.status_code == 304 and repeat.headers["etag"] == etag
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert len(json.loads(changed.body)["edges"]) == 2
+    # Другое представление той же версии — свой ETag и тело, а не 304
+    assert columnar.status_code == 200 and columnar.headers["content-encoding"] == "gzip"
+    table = json.loads(gzip.decompress(columnar.body))
+    assert table["nodes"]["id"][table["edges"]["source"][0]] == A
+    assert table["edges"]["count"] == [1, 1] and table["edges"]["ton"] == [1.0, 1.0]
+    shapes = [table["styles"]["node"][style]["shape"] for style in table["nodes"]["style"]]
+    assert shapes == ["box", "ellipse", "ellipse"]
+
+
+def test_graph_etag_is_stable_when_counterparty_is_tracked_wallet(memory_db):
+
+    async def _run():
+        async with memory_db(wallets) as session_factory:
+            wallets.graph_cache.clear()
+            wallets.graph_accounts.clear()
+
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A, B])
+                    # B отслеживается (кто-то другой добавил его), но не в Watchlist этого пользователя
+                    wallet_a, wallet_b = (Wallet(id=n, address=a, account_id=ids[a]) for n, a in ((1, A), (2, B)))
+                    session.add_all([User(id=1, telegram_id=10), wallet_a, wallet_b])
+                    await session.flush()
+                    session.add(UserWallet(user_id=1, wallet_id=1, alias="main"))
+                    await store_events(session, 1, [_transfer_event(1, A, B, 10**9)], A)
+
+            responses, etag = [], None
+            for _ in range(3):
+                response = await wallets.get_connection_graph_api(10, if_none_match=etag, **GRAPH_PARAMS)
+                responses.append(response)
+                etag = response.headers["etag"]
+            async with session_factory() as session:
+                async with session.begin():
+                    await store_events(session, 2, [_transfer_event(2, C, B, 10**9)], B)
+                    await session.execute(update(Wallet).where(Wallet.id == 2).values(sync_cursor_lt=2))
+            changed = await wallets.get_connection_graph_api(10, if_none_match=etag, **GRAPH_PARAMS)
+        return responses, changed
+
+    responses, changed = asyncio.run(_run())
+    assert [response.status_code for response in responses] == [200, 304, 304]
+    assert len({response.headers["etag"] for response in responses}) == 1
+    # Новое событие кошелька-контрагента меняет версию графа
+    assert changed.status_code == 200 and changed.headers["etag"] != responses[0].headers["etag"]
+
+
+def test_graph_etag_changes_when_other_wallet_ingests_transfer_into_root(memory_db):
+
+    async def _run():
+        async with memory_db(wallets) as session_factory:
+            wallets.graph_cache.clear()
+            wallets.graph_accounts.clear()
+
+            async with session_factory() as session:
+                async with session.begin():
+                    ids = await intern_accounts(session, [A, D])
+                    # D отслеживается другим пользователем и в граф пока не входит
+                    wallet_a, wallet_d = (Wallet(id=n, address=a, account_id=ids[a]) for n, a in ((1, A), (2, D)))
+                    session.add_all([User(id=1, telegram_id=10), wallet_a, wallet_d])
+                    await session.flush()
+                    session.add(UserWallet(user_id=1, wallet_id=1, alias="main"))
+                    await store_events(session, 1, [_transfer_event(1, A, B, 10**9)], A)
+
+            first = await wallets.get_connection_graph_api(10, if_none_match=None, **GRAPH_PARAMS)
+            etag = first.headers["etag"]
+            async with session_factory() as session:
+                async with session.begin():
+                    # Перевод D -> A сохраняет кошелёк D: курсор корня A не сдвигается
+                    await store_events(session, 2, [_transfer_event(2, D, A, 10**9)], D)
+            changed = await wallets.get_connection_graph_api(10, if_none_match=etag, **GRAPH_PARAMS)
+        return first, changed
+
+    first, changed = asyncio.run(_run())
+    assert first.status_code == 200 and len(json.loads(first.body)["edges"]) == 1
+    assert changed.status_code == 200 and changed.headers["etag"] != first.headers["etag"]
+    assert len(json.loads(changed.body)["edges"]) == 2
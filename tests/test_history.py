@@ -0,0 +1,50 @@
+import asyncio
+from datetime import datetime
+
+import api.routes.wallets as wallets
+from db.ingest import intern_accounts, store_events
+from db.models import BackfillJob, Wallet
+
+WALLET = "0:" + "a" * 64
+OTHER = "0:" + "b" * 64
+
+
+def _event(n: int) -> dict:
+    transfer = {"sender": {"address": WALLET}, "recipient": {"address": OTHER}, "amount": n * 1_000_000_000}
+    return {
+        "event_id": f"ev{n}",
+        "lt": 1000 + n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "status": "ok", "TonTransfer": transfer}],
+    }
+
+
+def test_history_pages_local_store_by_cursor(monkeypatch, memory_db):
+    async def _tonapi_history(*args, **kwargs):
+        raise AssertionError("история полностью в хранилище — TonAPI не нужен")
+
+    async def _run():
+        async with memory_db(wallets) as session_factory:
+            monkeypatch.setattr(wallets, "_tonapi_history", _tonapi_history)
+
+            async with session_factory() as session:
+                async with session.begin():
+                    account_ids = await intern_accounts(session, [WALLET])
+                    account_id = account_ids[WALLET]
+                    session.add(Wallet(id=1, address=WALLET, account_id=account_id, last_synced_at=datetime.now()))
+                    session.add(BackfillJob(wallet_id=1, status="done"))
+                    await session.flush()
+                    await store_events(session, 1, [_event(n) for n in range(5)], WALLET)
+
+            pages, cursor = [], None
+            while True:
+                page = await wallets.get_wallet_history(WALLET, limit=2, cursor=cursor)
+                pages.append([event.event_id for event in page.events])
+                if page.next_cursor is None:
+                    break
+                cursor = page.next_cursor
+        return pages, page.events[0].actions[0]
+
+    pages, action = asyncio.run(_run())
+    assert pages == [["ev4", "ev3"], ["ev2", "ev1"], ["ev0"]]
+    assert action.is_send is True and action.amount_ton == 0.0
@@ -0,0 +1,199 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from db.ingest import intern_accounts, store_events, volume_rollup_rows
+from core.address import parse_address
+from db.models import Account, CounterpartyStat, Transaction, Transfer, VolumeHourly, Wallet, WalletEvent
+
+
+def _event(n: int) -> dict:
+    transfer = {"sender": {"address": "0:a"}, "recipient": {"address": "0:b"}, "amount": n}
+    return {
+        "event_id": f"ev{n}",
+        "lt": 1000 + n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+    }
+
+
+def test_store_events_is_idempotent(memory_db):
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address="EQwallet"))
+
+            async with session_factory() as session:
+                async with session.begin():
+                    first = await store_events(session, 1, [_event(n) for n in range(3)])
+                async with session.begin():
+                    # ev1, ev2 уже есть — вставляются только ev3, ev4
+                    second = await store_events(session, 1, [_event(n) for n in range(1, 5)])
+                total = await session.scalar(select(func.count()).select_from(Transaction))
+                transfers = await session.scalar(select(func.count()).select_from(Transfer))
+        return first, second, total, transfers
+
+    # Переводы пишутся только для реально вставленных событий — без дублей
+    assert asyncio.run(_run()) == (3, 2, 5, 5)
+
+
+def test_counterparty_stats_accumulate_across_batches(memory_db):
+    wallet = "0:" + "a" * 64
+    other = "0:" + "b" * 64
+
+    def _transfer_event(n: int, sender: str, recipient: str, amount: int) -> dict:
+        transfer = {"sender": {"address": sender}, "recipient": {"address": recipient}, "amount": amount}
+        return {
+            "event_id": f"cp{n}",
+            "lt": 2000 + n,
+            "timestamp": 1_700_000_000 + n,
+            "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+        }
+
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address=wallet))
+                async with session.begin():
+                    first_batch = [_transfer_event(1, wallet, other, 5), _transfer_event(2, other, wallet, 7)]
+                    await store_events(session, 1, first_batch)
+                async with session.begin():
+                    # cp2 — повтор, не должен посчитаться второй раз
+                    second_batch = [_transfer_event(2, other, wallet, 7), _transfer_event(3, wallet, other, 1)]
+                    await store_events(session, 1, second_batch)
+                stat = await session.scalar(select(CounterpartyStat))
+        return stat
+
+    stat = asyncio.run(_run())
+    assert (stat.counterparty, stat.asset) == (other, "TON")
+    assert (stat.in_count, stat.out_count) == (1, 2)
+    assert (int(stat.in_amount), int(stat.out_amount)) == (7, 6)
+    assert (stat.first_ts, stat.last_ts) == (1_700_000_001, 1_700_000_003)
+
+
+def test_amounts_beyond_int64_are_stored_exactly(memory_db):
+    wallet = "0:" + "a" * 64
+    amount = 123456789012345678901  # > 2**63: SQLite с колонкой DECIMAL вернул бы 123456789012345683968
+
+    def _transfer_event(n: int) -> dict:
+        transfer = {"sender": {"address": wallet}, "recipient": {"address": "0:" + "b" * 64}, "amount": str(amount)}
+        return {
+            "event_id": f"big{n}",
+            "lt": 3000 + n,
+            "timestamp": 1_700_000_000 + n,
+            "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+        }
+
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address=wallet))
+                for n in range(2):  # Вторая пачка прибавляется к агрегатам в ON CONFLICT DO UPDATE
+                    async with session.begin():
+                        await store_events(session, 1, [_transfer_event(n)])
+                transfers = (await session.scalars(select(Transfer.amount))).all()
+                stat = await session.scalar(select(CounterpartyStat))
+                rollup = await session.scalar(select(VolumeHourly))
+        return transfers, stat, rollup
+
+    transfers, stat, rollup = asyncio.run(_run())
+    assert [int(value) for value in transfers] == [amount, amount]
+    assert int(stat.out_amount) == int(rollup.out_amount) == 2 * amount
+    assert int(stat.in_amount) == 0
+
+
+def test_volume_rollup_rows_bucket_by_interval():
+    wallet = "0:" + "a" * 64
+    other = "0:" + "b" * 64
+    base = {"type": "TonTransfer", "asset": None, "asset_symbol": "TON", "decimals": 9}
+    transfers = [
+        {**base, "sender": wallet, "recipient": other, "amount": 5, "timestamp": 7200},
+        {**base, "sender": other, "recipient": wallet, "amount": 3, "timestamp": 7300},
+        {**base, "sender": other, "recipient": wallet, "amount": 1, "timestamp": 10800},
+    ]
+
+    hourly = volume_rollup_rows(1, wallet, transfers, 3600)
+    assert [(row["bucket_ts"], row["in_count"], row["out_count"]) for row in hourly] == [(7200, 1, 1), (10800, 1, 0)]
+    daily = volume_rollup_rows(1, wallet, transfers, 86400)
+    assert [(row["bucket_ts"], row["in_amount"], row["out_amount"]) for row in daily] == [(0, 4, 5)]
+
+
+def test_store_events_interns_address_forms_to_one_account(memory_db):
+    wallet = "0:" + "a" * 64
+    other = parse_address("0:" + "b" * 64)
+    # Один и тот же контрагент приходит в raw, EQ... и UQ... формах
+    forms = [other.raw, other.to_friendly(), other.to_friendly(bounceable=False)]
+
+    def _event(n: int, sender: str, recipient: str) -> dict:
+        transfer = {"sender": {"address": sender}, "recipient": {"address": recipient}, "amount": 1}
+        return {
+            "event_id": f"ia{n}",
+            "lt": n,
+            "timestamp": 1_700_000_000 + n,
+            "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+        }
+
+    async def _run():
+        async with memory_db() as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add(Wallet(id=1, address=wallet))
+                async with session.begin():
+                    await store_events(session, 1, [_event(n, form, wallet) for n, form in enumerate(forms)], wallet)
+                async with session.begin():
+                    ids = await intern_accounts(session, [wallet, *forms, "not-an-address"])
+                    sender_ids = set((await session.scalars(select(Transfer.sender_id))).all())
+                    counterparty_ids = (await session.scalars(select(CounterpartyStat.counterparty_id))).all()
+                    accounts = await session.scalar(select(func.count()).select_from(Account))
+        return ids, sender_ids, counterparty_ids, accounts
+
+    ids, sender_ids, counterparty_ids, accounts = asyncio.run(_run())
+    assert accounts == 2
+    assert "not-an-address" not in ids
+    assert {ids[form] for form in forms} == sender_ids == set(counterparty_ids)
+    assert len(counterparty_ids) == 1  # Агрегаты контрагента не дробятся по формам адреса
+    assert ids[wallet] not in sender_ids
+
+
+def test_shared_event_is_stored_once_and_linked_to_each_wallet(memory_db):
+    wallet_a = "0:" + "a" * 64
+    wallet_b = "0:" + "b" * 64
+
+    async def _run():
+        async with memory_db() as session_factory:
+            # Одно событие — перевод между двумя наблюдаемыми кошельками
+            transfer = {"sender": {"address": wallet_a}, "recipient": {"address": wallet_b}, "amount": 7}
+            shared = {
+                "event_id": "shared",
+                "lt": 10,
+                "timestamp": 1_700_000_000,
+                "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+            }
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all([Wallet(id=1, address=wallet_a), Wallet(id=2, address=wallet_b)])
+                async with session.begin():
+                    first = await store_events(session, 1, [shared], wallet_a)
+                async with session.begin():
+                    second = await store_events(session, 2, [shared], wallet_b)
+                async with session.begin():
+                    repeated = await store_events(session, 2, [shared], wallet_b)
+                counts = [
+                    await session.scalar(select(func.count()).select_from(model))
+                    for model in (Transaction, Transfer, WalletEvent)
+                ]
+                stats = (
+                    await session.execute(
+                        select(CounterpartyStat.wallet_id, CounterpartyStat.in_count, CounterpartyStat.out_count)
+                        .order_by(CounterpartyStat.wallet_id)
+                    )
+                ).all()
+        return first, second, repeated, counts, stats
+
+    first, second, repeated, counts, stats = asyncio.run(_run())
+    assert (first, second, repeated) == (1, 1, 0)
+    assert counts == [1, 1, 2]  # Событие и перевод — один раз, связей — по одной на кошелёк
+    assert [tuple(row) for row in stats] == [(1, 0, 1), (2, 1, 0)]  # Агрегаты второго кошелька тоже обновлены
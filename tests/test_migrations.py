@@ -0,0 +1,131 @@
+import asyncio
+
+from sqlalchemy import text
+
+from db.db_init import (
+    _add_missing_indexes,
+    _migrate_amount_columns,
+    _migrate_shared_events,
+    _migrate_transaction_lt,
+    _populate_wallet_events,
+)
+
+
+def test_transaction_lt_migrates_to_integer(memory_db):
+    async def _run():
+        async with memory_db() as session_factory, session_factory() as session:
+            conn = await session.connection()
+            # Таблица в старом виде: lt хранится строкой
+            await conn.execute(text("DROP TABLE transactions"))
+            await conn.execute(
+                text(
+                    "CREATE TABLE transactions (id INTEGER PRIMARY KEY, wallet_id INTEGER NOT NULL, "
+                    "event_id VARCHAR NOT NULL, lt VARCHAR NOT NULL, timestamp INTEGER NOT NULL, "
+                    "is_scam_event BOOLEAN, actions_json TEXT NOT NULL)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO transactions (wallet_id, event_id, lt, timestamp, actions_json) VALUES "
+                    "(1, 'a', '9', 1, '[]'), (1, 'b', '100', 2, '[]'), (1, 'c', '10', 3, '[]')"
+                )
+            )
+            await conn.run_sync(_migrate_transaction_lt)
+            await conn.run_sync(_add_missing_indexes)
+            ordered = (await conn.execute(text("SELECT lt FROM transactions ORDER BY lt"))).scalars().all()
+            indexes = (
+                await conn.execute(text("SELECT name FROM sqlite_master WHERE tbl_name = 'transactions'"))
+            ).scalars().all()
+        return ordered, indexes
+
+    ordered, indexes = asyncio.run(_run())
+    assert ordered == [9, 10, 100]  # Числовой, а не лексикографический порядок
+    assert {"ix_transactions_event_id", "ix_transactions_timestamp"} <= set(indexes)
+
+
+def test_wallet_ids_move_to_wallet_events(memory_db):
+    async def _run():
+        async with memory_db() as session_factory, session_factory() as session:
+            conn = await session.connection()
+            # Таблицы в старом виде: событие и перевод принадлежат одному кошельку
+            await conn.execute(text("DROP TABLE transactions"))
+            await conn.execute(text("DROP TABLE transfers"))
+            await conn.execute(
+                text(
+                    "CREATE TABLE transactions (id INTEGER PRIMARY KEY, wallet_id INTEGER NOT NULL, "
+                    "event_id VARCHAR NOT NULL UNIQUE, lt BIGINT NOT NULL, timestamp INTEGER NOT NULL, "
+                    "is_scam_event BOOLEAN, actions_json TEXT NOT NULL)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE TABLE transfers (id INTEGER PRIMARY KEY, transaction_id INTEGER NOT NULL, "
+                    "wallet_id INTEGER NOT NULL, action_index INTEGER NOT NULL, type VARCHAR NOT NULL, "
+                    "sender VARCHAR NOT NULL, recipient VARCHAR NOT NULL, decimals INTEGER NOT NULL, "
+                    "timestamp INTEGER NOT NULL)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO transactions (id, wallet_id, event_id, lt, timestamp, actions_json) VALUES "
+                    "(1, 1, 'a', 10, 1, '[]'), (2, 2, 'b', 20, 2, '[]')"
+                )
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO transfers (transaction_id, wallet_id, action_index, type, sender, recipient, "
+                    "decimals, timestamp) VALUES (2, 2, 0, 'TonTransfer', '0:a', '0:b', 9, 2)"
+                )
+            )
+            await conn.run_sync(_populate_wallet_events)
+            await conn.run_sync(_migrate_shared_events)
+            await conn.run_sync(_add_missing_indexes)
+            links = (
+                await conn.execute(text("SELECT wallet_id, transaction_id, lt FROM wallet_events ORDER BY wallet_id"))
+            ).all()
+            columns = {
+                table: [row[1] for row in await conn.execute(text(f"PRAGMA table_info({table})"))]
+                for table in ("transactions", "transfers")
+            }
+            transfers = (await conn.execute(text("SELECT transaction_id, sender, comment FROM transfers"))).all()
+        return links, columns, transfers
+
+    links, columns, transfers = asyncio.run(_run())
+    assert [tuple(row) for row in links] == [(1, 1, 10), (2, 2, 20)]
+    assert "wallet_id" not in columns["transactions"] and "wallet_id" not in columns["transfers"]
+    assert [tuple(row) for row in transfers] == [(2, "0:a", None)]  # Колонки новее старой таблицы — NULL
+
+
+def test_amount_columns_migrate_to_text_in_sqlite(memory_db):
+    async def _run():
+        async with memory_db() as session_factory, session_factory() as session:
+            conn = await session.connection()
+            # Таблица в старом виде: суммы в DECIMAL (в SQLite — NUMERIC, числа вне int64 становятся REAL)
+            await conn.execute(text("DROP TABLE volume_daily"))
+            await conn.execute(
+                text(
+                    "CREATE TABLE volume_daily (id INTEGER PRIMARY KEY, wallet_id INTEGER NOT NULL, "
+                    "bucket_ts INTEGER NOT NULL, asset VARCHAR NOT NULL, asset_symbol VARCHAR, "
+                    "decimals INTEGER NOT NULL, in_count INTEGER NOT NULL, out_count INTEGER NOT NULL, "
+                    "in_amount DECIMAL(40, 0) NOT NULL, out_amount DECIMAL(40, 0) NOT NULL)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO volume_daily (wallet_id, bucket_ts, asset, decimals, in_count, out_count, "
+                    "in_amount, out_amount) VALUES (1, 0, 'TON', 9, 1, 1, 5, 18446744073709551616)"
+                )
+            )
+            await conn.run_sync(_migrate_amount_columns)
+            await conn.run_sync(_add_missing_indexes)
+            row = (await conn.execute(text("SELECT in_amount, out_amount, typeof(in_amount) FROM volume_daily"))).one()
+            column_types = {
+                column: declared
+                for _, column, declared, *_ in await conn.execute(text("PRAGMA table_info(volume_daily)"))
+            }
+        return tuple(row), column_types
+
+    row, column_types = asyncio.run(_run())
+    # 2**64 в REAL представим точно и переносится целым числом, а не в экспоненциальной записи
+    assert row == ("5", "18446744073709551616", "text")
+    assert column_types["in_amount"] == column_types["out_amount"] == "TEXT"
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+
+import api.scheduler as scheduler
+from core.polling import (
+    POLL_MAX_INTERVAL_SECONDS,
+    POLL_MIN_INTERVAL_SECONDS,
+    PollingQueue,
+    compute_poll_interval,
+)
+from core.tonapi import TonApiClient
+
+
+def test_busy_and_watched_wallets_are_polled_more_often():
+    now = 1_700_000_000
+    dormant = compute_poll_interval(None, watchers=1, last_activity_ts=now - 90 * 86400, now=now)
+    busy = compute_poll_interval(120.0, watchers=1, now=now)
+    busy_watched = compute_poll_interval(120.0, watchers=10, now=now)
+
+    assert dormant == POLL_MAX_INTERVAL_SECONDS
+    assert POLL_MIN_INTERVAL_SECONDS <= busy_watched < busy < dormant
+
+
+def test_polling_queue_pops_only_due_and_latest_schedule():
+    queue = PollingQueue()
+    queue.push(1, "EQa", 100)
+    queue.push(2, "EQb", 200)
+    queue.push(1, "EQa", 300)  # Перепланирование: старая запись на 100 становится неактуальной
+
+    assert queue.pop_due(now=250) == [(2, "EQb")]
+    assert queue.next_due_ts() == 300
+    assert queue.pop_due(now=300) == [(1, "EQa")]
+    assert len(queue) == 0
+
+
+def test_removed_wallet_is_dropped_from_polling_queue(monkeypatch, memory_db):
+    monkeypatch.setattr(scheduler, "TONAPI_KEY", "test-key")
+    monkeypatch.setattr(scheduler, "polling_queue", PollingQueue())
+
+    async def _run():
+        async with memory_db(scheduler):
+            # Кошелёк 1 удалён из БД, пока ждал своей очереди
+            return await scheduler.run_refresh_pool([(1, "EQa")], on_result=scheduler._reschedule)
+
+    progress = asyncio.run(_run())
+    scheduler._reschedule(2, "EQb", None)  # Ошибка обновления — повтор с backoff
+
+    assert progress.failed == 0
+    assert 1 not in scheduler.polling_queue and 2 in scheduler.polling_queue
+    assert scheduler.polling_queue.pop_due(now=scheduler.polling_queue.next_due_ts()) == [(2, "EQb")]
+
+
+def _tonapi_events(monkeypatch, lts: list[int]) -> list[dict]:
+    """TonAPI с историей событий lts: страницы от новых к старым по limit и before_lt. Возвращает запросы."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(dict(request.url.params))
+        before_lt = int(request.url.params.get("before_lt", 10**18))
+        page = [lt for lt in sorted(lts, reverse=True) if lt < before_lt][: int(request.url.params["limit"])]
+        return httpx.Response(200, json={"events": [{"event_id": f"ev{lt}", "lt": lt} for lt in page]})
+
+    transport = httpx.MockTransport(handler)
+    client = TonApiClient(api_key="k", base_url="https://tonapi.test/v2", limiter=None, transport=transport)
+    monkeypatch.setattr(scheduler, "get_tonapi_client", lambda: client)
+    monkeypatch.setattr(scheduler, "SYNC_PAGE_LIMIT", 3)
+    return requests
+
+
+def test_fetch_new_events_pages_back_to_cursor(monkeypatch):
+    requests = _tonapi_events(monkeypatch, list(range(1, 11)))
+
+    events = asyncio.run(scheduler.fetch_new_events("EQa", cursor_lt=4))
+
+    # Граничное событие курсора (lt=4) остаётся для дедупликации, более старые не берутся
+    assert [event["lt"] for event in events] == [10, 9, 8, 7, 6, 5, 4]
+    assert [request.get("before_lt") for request in requests] == [None, "8", "5"]
+
+
+def test_fetch_new_events_without_cursor_reads_first_page(monkeypatch):
+    requests = _tonapi_events(monkeypatch, list(range(1, 11)))
+
+    events = asyncio.run(scheduler.fetch_new_events("EQa", cursor_lt=None))
+
+    # Первая синхронизация: полную историю догружает api.backfill
+    assert [event["lt"] for event in events] == [10, 9, 8] and len(requests) == 1
+
+
+def test_fetch_new_events_stops_at_page_limit(monkeypatch):
+    requests = _tonapi_events(monkeypatch, list(range(1, 11)))
+    monkeypatch.setattr(scheduler, "SYNC_MAX_PAGES", 2)
+
+    events = asyncio.run(scheduler.fetch_new_events("EQa", cursor_lt=1))
+
+    assert [event["lt"] for event in events] == [10, 9, 8, 7, 6, 5] and len(requests) == 2
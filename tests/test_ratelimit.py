@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from core.ratelimit import TokenBucket
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def _run():
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(5)))
+        return time.monotonic() - start
+
+    # Первый токен есть сразу, остальные 4 появляются по одному каждые 50 мс
+    assert asyncio.run(_run()) >= 0.19
+
+
+def test_token_bucket_allows_burst():
+    bucket = TokenBucket(rate=1, capacity=3)
+
+    async def _run():
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(_run()) < 0.1
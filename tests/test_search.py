@@ -0,0 +1,75 @@
+import asyncio
+
+from sqlalchemy import delete
+
+from db.ingest import intern_accounts, store_events
+from db.models import Transfer, User, UserWallet, Wallet
+from db.search import ensure_search_index, search_watchlist
+
+WALLET_A = "0:" + "a" * 64
+WALLET_B = "0:" + "b" * 64
+
+
+def _comment_event(n: int, comment: str) -> dict:
+    transfer = {
+        "sender": {"address": WALLET_B},
+        "recipient": {"address": WALLET_A},
+        "amount": 1,
+        "comment": comment,
+    }
+    return {
+        "event_id": f"c{n}",
+        "lt": n,
+        "timestamp": 1_700_000_000 + n,
+        "actions": [{"type": "TonTransfer", "TonTransfer": transfer}],
+    }
+
+
+def test_search_watchlist_fts_is_synced_with_writes(memory_db):
+    async def _run():
+        async with memory_db(setup=(ensure_search_index,)) as session_factory:
+            async with session_factory() as session:
+                async with session.begin():
+                    session.add_all([User(id=1, telegram_id=10), User(id=2, telegram_id=20)])
+                    account_ids = await intern_accounts(session, [WALLET_A, WALLET_B])  # Как при /add
+                    session.add_all(
+                        [
+                            Wallet(id=1, address=WALLET_A, account_id=account_ids[WALLET_A]),
+                            Wallet(id=2, address=WALLET_B, account_id=account_ids[WALLET_B]),
+                        ]
+                    )
+                    await session.flush()
+                    session.add_all(
+                        [
+                            UserWallet(id=1, user_id=1, wallet_id=1, alias="Binance hot", group="exchanges"),
+                            UserWallet(id=2, user_id=1, wallet_id=2, alias="Friend"),
+                            UserWallet(id=3, user_id=2, wallet_id=1, alias="Binance other user"),
+                        ]
+                    )
+                async with session.begin():
+                    await store_events(session, 1, [_comment_event(1, "Оплата за кофе")], WALLET_A)
+
+                async with session.begin():
+                    by_alias = await search_watchlist(session, 1, "binance")
+                    by_address_infix = await search_watchlist(session, 1, "bbbbbb")
+                    by_comment_prefix = await search_watchlist(session, 1, "оплат")
+
+                async with session.begin():
+                    user_wallet = await session.get(UserWallet, 2)
+                    user_wallet.alias = "Cold storage"
+                    await session.flush()
+                    after_label = await search_watchlist(session, 1, "storage")
+
+                async with session.begin():  # Архивация удаляет переводы — комментарий пропадает из поиска
+                    await session.execute(delete(Transfer))
+                    after_delete = await search_watchlist(session, 1, "оплат")
+        return by_alias, by_address_infix, by_comment_prefix, after_label, after_delete
+
+    by_alias, by_address_infix, by_comment_prefix, after_label, after_delete = asyncio.run(_run())
+    # Только свой Watchlist
+    assert by_alias == [{"address": WALLET_A, "alias": "Binance hot", "group": "exchanges", "matched_comment": None}]
+    assert [result["address"] for result in by_address_infix] == [WALLET_B]
+    assert by_comment_prefix[0]["address"] == WALLET_A
+    assert by_comment_prefix[0]["matched_comment"] == "Оплата за кофе"
+    assert [result["alias"] for result in after_label] == ["Cold storage"]
+    assert after_delete == []
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import api.routes.wallets as wallets
+from db.ingest import intern_accounts, store_events
+from db.models import Wallet
+
+WALLET = "0:" + "a" * 64
+OTHER = "0:" + "b" * 64
+MONDAY = 1_699_833_600  # 2023-11-13 00:00 UTC
+
+
+def _event(n: int, timestamp: int) -> dict:
+    transfer = {"sender": {"address": WALLET}, "recipient": {"address": OTHER}, "amount": 10**9}
+    return {
+        "event_id": f"ev{n}",
+        "lt": 1000 + n,
+        "timestamp": timestamp,
+        "actions": [{"type": "TonTransfer", "status": "ok", "TonTransfer": transfer}],
+    }
+
+
+def test_timeseries_aligns_week_start_and_defaults_to_utc_now(monkeypatch, memory_db):
+    # Часовой пояс хоста не должен сдвигать конец окна по умолчанию
+    monkeypatch.setenv("TZ", "Europe/Moscow")
+    time.tzset()
+    now = int(time.time())
+
+    async def _run():
+        async with memory_db(wallets) as session_factory:
+            # По переводу в полдень каждого дня недели и один — минуту назад
+            events = [_event(day, MONDAY + day * 86400 + 43200) for day in range(7)] + [_event(7, now - 60)]
+            async with session_factory() as session:
+                async with session.begin():
+                    account_ids = await intern_accounts(session, [WALLET])
+                    session.add(Wallet(id=1, address=WALLET, account_id=account_ids[WALLET]))
+                    await session.flush()
+                    await store_events(session, 1, events, WALLET)
+
+            week = await wallets.get_wallet_timeseries(
+                WALLET, bucket="week", asset=None, from_ts=MONDAY + 2 * 86400 + 43200, to_ts=MONDAY + 7 * 86400
+            )
+            hours = await wallets.get_wallet_timeseries(WALLET, bucket="hour", asset=None, from_ts=None, to_ts=None)
+        return week, hours
+
+    try:
+        week, hours = asyncio.run(_run())
+    finally:
+        monkeypatch.delenv("TZ")
+        time.tzset()
+    # Первая недельная точка — с понедельника и суммирует всю неделю, а не дни начиная с from_ts
+    assert [(point.ts, point.out_count) for point in week.points] == [(MONDAY, 7)]
+    assert hours.points and hours.points[-1].ts == now - 60 - (now - 60) % 3600
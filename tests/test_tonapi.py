@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+
+from core.tonapi import TonApiClient
+
+
+def test_client_sends_auth_and_uses_base_url():
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request)
+        return httpx.Response(200, json={"balance": 1})
+
+    async def _run():
+        client = TonApiClient(
+            api_key="secret", base_url="https://tonapi.test/v2", limiter=None, transport=httpx.MockTransport(handler)
+        )
+        try:
+            resp = await client.get("/accounts/EQabc", params={"limit": 5})
+            return resp.json()
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(_run()) == {"balance": 1}
+    assert str(seen[0].url) == "https://tonapi.test/v2/accounts/EQabc?limit=5"
+    assert seen[0].headers["Authorization"] == "Bearer secret"